@@ -0,0 +1,342 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# ==========================================
+# レーススナップショットのアーカイブ (追記専用)
+# - 実行ごとに各レースの race_info・出走馬・買い目を取得時刻付きで SQLite に追記し、履歴を残す
+# - 出走馬は1頭1行の列 (オッズ・人気・勝率・期待値・馬体重…) として保存し、オッズ推移などを SQL で引ける
+# - フロントエンド向けに開催日ごとの最新スナップショットを圧縮JSON (インデントなし) で書き出す
+# - オッズ・人気・馬体重の時系列 (OddsSeries) は前回から変化した値だけを記録し、数分おきの実行でも小さく保つ
+# ==========================================
+
+DEFAULT_ARCHIVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive', 'races.sqlite3')
+DEFAULT_EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend', 'data', 'dates')
+
+# horse_snapshots の列 (race_model.Horse.to_dict が返す出走馬 dict のキー順)
+HORSE_COLUMNS = (
+    "number", "name", "jockey", "odds", "popularity", "win_probability", "expected_return", "score_si",
+    "classification", "weight", "weight_change", "last_3f", "speed_index", "condition_score",
+)
+JSON_HORSE_COLUMNS = ("features",)
+BUSY_TIMEOUT = 30.0  # 他プロセスの書き込みを待つ秒数
+
+
+def normalize_race_id(race_id):
+    """ race_info["id"] ('202606020111&rf=race_list') からレースID部分だけを取り出す """
+    return race_id.split('&')[0]
+
+
+def content_hash(entry):
+    """ 取得時刻を除いたレースデータの内容ハッシュ (前回と同じ内容なら追記しない) """
+    return hashlib.sha256(json.dumps(entry, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def connect(path):
+    """
+    アーカイブ・特徴量ストアの SQLite 接続を開く。
+    全レースモードでは親プロセス (OutputWriter) とワーカープロセス (OddsSeries / FeatureStore) が同じファイルを開くため、
+    WAL モードにして読み書きを並行させ、他プロセスの書き込み中は BUSY_TIMEOUT 秒まで待つ
+    """
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+def dumps_compact(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+class RaceArchive:
+    """ レースデータのスナップショットを追記していく SQLite ストア (スレッドセーフ) """
+
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                race_id TEXT NOT NULL,
+                race_date TEXT NOT NULL,
+                scraped_at TEXT NOT NULL,
+                status TEXT,
+                content_hash TEXT NOT NULL,
+                race_info TEXT NOT NULL,
+                portfolios TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_snapshots_race ON snapshots(race_id, snapshot_id);
+            CREATE INDEX IF NOT EXISTS idx_snapshots_date ON snapshots(race_date);
+            CREATE TABLE IF NOT EXISTS horse_snapshots (
+                snapshot_id INTEGER NOT NULL REFERENCES snapshots(snapshot_id),
+                race_id TEXT NOT NULL,
+                scraped_at TEXT NOT NULL,
+                {", ".join(HORSE_COLUMNS + JSON_HORSE_COLUMNS)},
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_horse_snapshots_snapshot ON horse_snapshots(snapshot_id);
+            CREATE INDEX IF NOT EXISTS idx_horse_snapshots_race ON horse_snapshots(race_id, number);
+        """)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def append(self, entry, scraped_at=None):
+        """
+        1レース分の出力 (race_info / horses / portfolios) をスナップショットとして追記する。
+        直前のスナップショットと内容が同じ場合は追記せず None を返す。
+        """
+        race_info = entry["race_info"]
+        race_id = normalize_race_id(race_info["id"])
+        digest = content_hash(entry)
+        scraped_at = scraped_at or datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            latest = self._db.execute(
+                "SELECT content_hash FROM snapshots WHERE race_id = ? ORDER BY snapshot_id DESC LIMIT 1",
+                (race_id,)).fetchone()
+            if latest and latest[0] == digest:
+                return None
+            cur = self._db.execute(
+                "INSERT INTO snapshots (race_id, race_date, scraped_at, status, content_hash, race_info, portfolios) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (race_id, race_info.get("date", ""), scraped_at, race_info.get("status"), digest,
+                 dumps_compact(race_info), dumps_compact(entry["portfolios"])))
+            snapshot_id = cur.lastrowid
+            rows = []
+            for h in entry["horses"]:
+                extra = {k: v for k, v in h.items() if k not in HORSE_COLUMNS and k not in JSON_HORSE_COLUMNS}
+                rows.append((snapshot_id, race_id, scraped_at)
+                            + tuple(h.get(k) for k in HORSE_COLUMNS)
+                            + tuple(dumps_compact(h[k]) if k in h else None for k in JSON_HORSE_COLUMNS)
+                            + (dumps_compact(extra) if extra else None,))
+            placeholders = ", ".join("?" * (4 + len(HORSE_COLUMNS) + len(JSON_HORSE_COLUMNS)))
+            self._db.executemany(f"INSERT INTO horse_snapshots VALUES ({placeholders})", rows)
+            self._db.commit()
+        return snapshot_id
+
+    def append_all(self, entries, scraped_at=None):
+        """ 複数レースを同じ取得時刻で追記し、追記したレースの開催日の集合を返す """
+        scraped_at = scraped_at or datetime.now().isoformat(timespec='seconds')
+        dates = set()
+        for entry in entries:
+            if self.append(entry, scraped_at) is not None:
+                dates.add(entry["race_info"].get("date", ""))
+        return dates
+
+    def _load_horses(self, snapshot_id):
+        columns = HORSE_COLUMNS + JSON_HORSE_COLUMNS + ("extra",)
+        horses = []
+        for row in self._db.execute(
+                f"SELECT {', '.join(columns)} FROM horse_snapshots WHERE snapshot_id = ? ORDER BY rowid",
+                (snapshot_id,)):
+            h = dict(zip(HORSE_COLUMNS, row[:len(HORSE_COLUMNS)]))
+            for k, v in zip(JSON_HORSE_COLUMNS, row[len(HORSE_COLUMNS):-1]):
+                if v is not None:
+                    h[k] = json.loads(v)
+            if row[-1]:
+                h.update(json.loads(row[-1]))
+            horses.append(h)
+        return horses
+
+    def latest_entries(self, race_date=None):
+        """ レースごとの最新スナップショットを出力と同じ形式 (race_info / horses / portfolios) で返す """
+        query = ("SELECT s.snapshot_id, s.race_info, s.portfolios FROM snapshots s "
+                 "JOIN (SELECT MAX(snapshot_id) AS snapshot_id FROM snapshots {where} GROUP BY race_id) latest "
+                 "ON s.snapshot_id = latest.snapshot_id ORDER BY s.race_id")
+        params = ()
+        if race_date is not None:
+            query = query.format(where="WHERE race_date = ?")
+            params = (race_date,)
+        else:
+            query = query.format(where="")
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+            return [{"race_info": json.loads(race_info), "horses": self._load_horses(snapshot_id),
+                     "portfolios": json.loads(portfolios)} for snapshot_id, race_info, portfolios in rows]
+
+    def race_dates(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT DISTINCT race_date FROM snapshots WHERE race_date != '' ORDER BY race_date")]
+
+
+# odds_ticks で差分記録する項目 (NULL は前回から変化なし)
+TICK_FIELDS = ("odds", "popularity", "weight", "weight_change")
+# 記録する値 (race_model.Horse の属性。馬体重・増減は出力と同じ表記)
+TICK_SOURCE_KEYS = {"odds": "odds", "popularity": "popularity", "weight": "display_weight",
+                    "weight_change": "display_weight_change"}
+# 仮の値で埋めた項目のフラグ (立っている場合は記録しない)
+TICK_ESTIMATED_FLAGS = {"odds": "odds_estimated", "popularity": "popularity_estimated"}
+
+
+class OddsSeries:
+    """
+    馬ごとのオッズ・人気・馬体重の時系列 (スレッドセーフ)。
+    直前の値をレース単位でメモリに保持し、変化した項目だけを1行として追記する。
+    """
+
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS odds_ticks (
+                race_id TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                observed_at TEXT NOT NULL,
+                {", ".join(TICK_FIELDS)}
+            );
+            CREATE INDEX IF NOT EXISTS idx_odds_ticks_race ON odds_ticks(race_id, number, observed_at);
+        """)
+        self._db.commit()
+        # race_id → {馬番: {"first_odds": 最初に記録したオッズ, "last": {項目: 直前の値}}}
+        self._state = {}
+
+    def close(self):
+        self._db.close()
+
+    def _load_state(self, race_id):
+        """ レースの既存の時系列から最初のオッズと各項目の直前の値を復元する (レースごとに1回) """
+        state = {}
+        rows = self._db.execute(
+            f"SELECT number, {', '.join(TICK_FIELDS)} FROM odds_ticks WHERE race_id = ? ORDER BY number, rowid",
+            (race_id,))
+        for number, *values in rows:
+            s = state.setdefault(number, {"first_odds": None, "last": {}})
+            for field, value in zip(TICK_FIELDS, values):
+                if value is not None:
+                    s["last"][field] = value
+            if s["first_odds"] is None and values[0] is not None:
+                s["first_odds"] = values[0]
+        return state
+
+    def record(self, race_id, raw_horses, observed_at=None):
+        """ 出走馬 (race_model.Horse の並び) の現在値を記録し、追記した行数を返す。前回から変化のない馬は書き込まない """
+        race_id = normalize_race_id(race_id)
+        observed_at = observed_at or datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            state = self._state.get(race_id)
+            if state is None:
+                state = self._state[race_id] = self._load_state(race_id)
+            rows = []
+            for h in raw_horses:
+                s = state.setdefault(h.number, {"first_odds": None, "last": {}})
+                delta = []
+                for field in TICK_FIELDS:
+                    value = getattr(h, TICK_SOURCE_KEYS[field])
+                    if field in TICK_ESTIMATED_FLAGS and getattr(h, TICK_ESTIMATED_FLAGS[field]):
+                        value = None
+                    if value is None or s["last"].get(field) == value:
+                        delta.append(None)
+                    else:
+                        delta.append(value)
+                        s["last"][field] = value
+                if any(v is not None for v in delta):
+                    rows.append((race_id, h.number, observed_at, *delta))
+                if s["first_odds"] is None and delta[0] is not None:
+                    s["first_odds"] = delta[0]
+            if rows:
+                self._db.executemany(
+                    f"INSERT INTO odds_ticks VALUES ({', '.join('?' * (3 + len(TICK_FIELDS)))})", rows)
+                self._db.commit()
+        return len(rows)
+
+    def odds_drift(self, race_id):
+        """
+        馬番 → オッズの変化率 log(現在のオッズ / 最初に記録したオッズ) を返す。
+        負の値は売れている (オッズが下がっている) ことを表す
+        """
+        race_id = normalize_race_id(race_id)
+        with self._lock:
+            state = self._state.get(race_id)
+            if state is None:
+                state = self._state[race_id] = self._load_state(race_id)
+            drift = {}
+            for number, s in state.items():
+                first, last = s["first_odds"], s["last"].get("odds")
+                if first and last and first > 0 and last > 0:
+                    drift[number] = math.log(last / first)
+            return drift
+
+    def history(self, race_id):
+        """ 馬番 → [(取得時刻, {項目: 値})] を差分を埋めた形で返す """
+        race_id = normalize_race_id(race_id)
+        history = {}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT number, observed_at, {', '.join(TICK_FIELDS)} FROM odds_ticks "
+                "WHERE race_id = ? ORDER BY number, rowid", (race_id,)).fetchall()
+        last = {}
+        for number, observed_at, *values in rows:
+            current = dict(last.get(number, {}))
+            current.update({f: v for f, v in zip(TICK_FIELDS, values) if v is not None})
+            last[number] = current
+            history.setdefault(number, []).append((observed_at, current))
+        return history
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def export_dates(archive, out_dir=DEFAULT_EXPORT_DIR, dates=None):
+    """
+    開催日ごとの最新スナップショットを {out_dir}/{開催日}.json (インデントなし) に書き出し、
+    開催日の一覧を {out_dir}/index.json に書き出す。dates を渡すとその開催日だけを書き直す。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    all_dates = archive.race_dates()
+    written = []
+    for race_date in sorted(d for d in (all_dates if dates is None else dates) if d):
+        entries = archive.latest_entries(race_date)
+        if entries:
+            _write_atomic(os.path.join(out_dir, f"{race_date}.json"), dumps_compact(entries))
+            written.append(race_date)
+    _write_atomic(os.path.join(out_dir, 'index.json'), dumps_compact(all_dates))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="レーススナップショットのアーカイブ操作")
+    parser.add_argument("--db", default=DEFAULT_ARCHIVE_PATH, help="アーカイブ (SQLite) のパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="開催日ごとの圧縮JSONを書き出す")
+    p_export.add_argument("--out", default=DEFAULT_EXPORT_DIR, help="出力先ディレクトリ")
+    p_export.add_argument("--date", action="append", help="対象の開催日 (YYYY-MM-DD)。省略時は全開催日")
+    p_odds = sub.add_parser("odds", help="レースのオッズ・人気・馬体重の推移を表示する")
+    p_odds.add_argument("race_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        archive = RaceArchive(args.db)
+        try:
+            written = export_dates(archive, args.out, args.date)
+        finally:
+            archive.close()
+        print(f"{len(written)} 開催日分を書き出しました: {args.out}")
+    else:
+        series = OddsSeries(args.db)
+        try:
+            history = series.history(args.race_id)
+        finally:
+            series.close()
+        for number, ticks in history.items():
+            print(f"{number:>2}番")
+            for observed_at, v in ticks:
+                print(f"    {observed_at}  {v.get('odds', '-'):>6}倍  {v.get('popularity', '-'):>2}人気  "
+                      f"{v.get('weight', '-')}({v.get('weight_change', '-')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fixtures
+import html_parsing
+import scraper
+from bet_probabilities import ORDERED_BET_TYPES
+
+# ==========================================
+# 過去レースのバックテスト
+# 保存済みの出馬表・過去走・結果ページ (fixtures と同じ {ページ種別}_{レースID}.html 形式のアーカイブ) に
+# 期待値モデルと買い目生成を適用し、strategy_a / strategy_b の各買い目を実際の払戻で精算する。
+# レースごとの処理はプロセスプールで並列実行する。
+# ==========================================
+
+STAKE_PER_BET = 100  # 1点あたりの購入額 (払戻金は100円あたりの金額)
+
+
+def load_archived_race(archive_dir, race_id):
+    """ アーカイブから1レース分をパースし (race_info, raw_horses) を返す。結果未確定・欠損の場合は (None, None) """
+    def read(page):
+        path = fixtures.fixture_path(archive_dir, page, race_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    shutuba, result = read('shutuba'), read('result')
+    if not shutuba or not result:
+        return None, None
+
+    status, results = scraper.parse_race_result(html_parsing.make_soup(result, 'result'))
+    if status != "finished" or not results["payouts"]:
+        return None, None
+
+    soup = html_parsing.make_soup(shutuba, 'shutuba')
+    race_info = scraper.parse_race_header(soup, f"shutuba.html?race_id={race_id}", "")
+    race_info.update({"status": status, "results": results})
+    raw_horses = scraper.parse_shutuba_horses(soup)
+    if not raw_horses or any(h.odds <= 0 for h in raw_horses):
+        return None, None
+
+    past = read('shutuba_past')
+    if past:
+        sp = html_parsing.make_soup(past.decode('euc-jp', errors='replace'), 'shutuba_past')
+        scraper.parse_past_performance(sp, raw_horses)
+    return race_info, raw_horses
+
+
+def parse_payouts(payouts):
+    """
+    race_info["results"]["payouts"] を {券種: [(馬番タプル, 払戻金)]} に変換する。
+    同着や複勝・ワイドのように的中が複数ある券種はリストに複数入る。
+    """
+    parsed = {}
+    for kind, p in payouts.items():
+        groups = [g for g in p["numbers"].split(", ") if g]
+        amounts = [int(a.replace(",", "").replace("円", "")) for a in p["payout"].split(", ") if a.strip()]
+        combos = [tuple(int(n) for n in g.split("-") if n.isdigit()) for g in groups]
+        # 複勝は "3-2-5" のように1つにまとめて表記されるため馬番ごとに分ける
+        if kind == "複勝" and len(combos) == 1 and len(amounts) > 1:
+            combos = [(n,) for n in combos[0]]
+        parsed[kind] = list(zip(combos, amounts))
+    return parsed
+
+
+def settle_bet(bet, parsed_payouts):
+    """ 1点 (STAKE_PER_BET 円) の買い目の払戻額を返す """
+    numbers = tuple(bet["numbers"])
+    for combo, amount in parsed_payouts.get(bet["type"], []):
+        if bet["type"] in ORDERED_BET_TYPES:
+            hit = combo == numbers
+        else:
+            hit = sorted(combo) == sorted(numbers)
+        if hit:
+            return amount * STAKE_PER_BET // 100
+    return 0
+
+
+def settle_portfolios(portfolios, parsed_payouts):
+    """ generate_portfolios の全買い目を精算し、買い目ごとの {strategy, type, stake, return} を返す """
+    bets = []
+    for strategy, candidates in portfolios.items():
+        for bet in candidates:
+            bets.append({
+                "strategy": strategy,
+                "type": bet["type"],
+                "stake": STAKE_PER_BET,
+                "return": settle_bet(bet, parsed_payouts),
+            })
+    return bets
+
+
+def backtest_race(archive_dir, race_id):
+    """ 1レース分のモデル適用・買い目生成・精算を行い、買い目ごとの精算結果を返す (ワーカープロセスで実行) """
+    race_info, raw_horses = load_archived_race(archive_dir, race_id)
+    if not race_info:
+        return None
+    horses = scraper.calculate_expected_values(raw_horses, race_info)
+    # 精算は一律 STAKE_PER_BET 円のため、購入額の最適化は行わない
+    portfolios = scraper.generate_portfolios(horses, allocate=False)
+    parsed_payouts = parse_payouts(race_info["results"]["payouts"])
+    return {"race_id": race_id, "bets": settle_portfolios(portfolios, parsed_payouts)}
+
+
+def _backtest_chunk(args):
+    archive_dir, race_ids = args
+    return [backtest_race(archive_dir, race_id) for race_id in race_ids]
+
+
+def run_backtest(archive_dir, workers=None, chunk_size=32):
+    """ アーカイブ内の全レースを並列にバックテストし、レースID順の精算結果リストを返す """
+    race_ids = sorted(fixtures.list_fixtures(archive_dir)['result'])
+    chunks = [(archive_dir, race_ids[i:i + chunk_size]) for i in range(0, len(race_ids), chunk_size)]
+    if workers == 1:
+        results = [r for chunk in chunks for r in _backtest_chunk(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [r for chunk_result in executor.map(_backtest_chunk, chunks) for r in chunk_result]
+    return [r for r in results if r]
+
+
+def summarize(race_results):
+    """ 戦略別・戦略×券種別に的中率・回収率・最大ドローダウンを集計する """
+    groups = {}
+    for race in race_results:
+        # レースID順 (≒開催順) に損益を積み上げ、ドローダウンを計算する
+        race_pnl = {}
+        for bet in race["bets"]:
+            for key in ((bet["strategy"], "全券種"), (bet["strategy"], bet["type"])):
+                g = groups.setdefault(key, {"races": 0, "bets": 0, "hits": 0, "stake": 0, "return": 0,
+                                            "balance": 0, "peak": 0, "max_drawdown": 0})
+                g["bets"] += 1
+                g["hits"] += 1 if bet["return"] > 0 else 0
+                g["stake"] += bet["stake"]
+                g["return"] += bet["return"]
+                race_pnl[key] = race_pnl.get(key, 0) + bet["return"] - bet["stake"]
+        for key, pnl in race_pnl.items():
+            g = groups[key]
+            g["races"] += 1
+            g["balance"] += pnl
+            g["peak"] = max(g["peak"], g["balance"])
+            g["max_drawdown"] = max(g["max_drawdown"], g["peak"] - g["balance"])
+
+    summary = []
+    for (strategy, bet_type), g in sorted(groups.items()):
+        summary.append({
+            "strategy": strategy,
+            "bet_type": bet_type,
+            "races": g["races"],
+            "bets": g["bets"],
+            "hit_rate": round(g["hits"] / g["bets"], 4) if g["bets"] else 0.0,
+            "stake": g["stake"],
+            "return": g["return"],
+            "roi": round(g["return"] / g["stake"], 4) if g["stake"] else 0.0,
+            "max_drawdown": g["max_drawdown"],
+        })
+    return summary
+
+
+def print_summary(summary, n_races):
+    print(f"バックテスト対象: {n_races} レース (1点 {STAKE_PER_BET} 円)")
+    print(f"{'strategy':<12}{'bet':<8}{'races':>7}{'bets':>7}{'hit%':>8}{'stake':>10}{'return':>10}{'ROI%':>8}{'maxDD':>9}")
+    for s in summary:
+        print(f"{s['strategy']:<12}{s['bet_type']:<8}{s['races']:>7}{s['bets']:>7}{s['hit_rate'] * 100:>7.1f}%"
+              f"{s['stake']:>10}{s['return']:>10}{s['roi'] * 100:>7.1f}%{s['max_drawdown']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="過去レースのアーカイブで期待値モデルと買い目をバックテストする")
+    parser.add_argument("--archive", default=fixtures.DEFAULT_FIXTURE_DIR,
+                        help="出馬表・過去走・結果ページのアーカイブ ({ページ種別}_{レースID}.html)")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数 (既定: CPUコア数)")
+    parser.add_argument("--json", metavar="PATH", help="集計結果をJSONで保存する")
+    args = parser.parse_args(argv)
+
+    race_results = run_backtest(args.archive, args.workers)
+    if not race_results:
+        print(f"バックテスト可能な確定済みレースがありません: {args.archive}")
+        return
+    summary = summarize(race_results)
+    print_summary(summary, len(race_results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"races": len(race_results), "summary": summary}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+import discovery
+import fetcher
+import fixtures
+import html_parsing
+import keibalab
+import race_model
+import scraper
+import standin_server
+
+# ==========================================
+# オフラインベンチマーク
+# 保存済みのHTMLフィクスチャ (scraper.py --record-fixtures で記録) を使い、ネットワークを介さずに計測する
+#   parsers : パーサー構成 (html.parser / lxml × 文書全体 / 部分木) ごとのパース時間を比較する
+#   pipeline: パース・期待値計算・買い目生成の各段階の所要時間とメモリ使用量を計測する
+#   loadtest: スタンドインサーバー (standin_server.py) にフィクスチャを複製して載せ、遅延・エラー・流量制限を加えた状態で
+#             scraper の全体 (一覧取得〜出力) を実行し、スループットとリクエスト・レースごとの所要時間の分布を計測する
+# ==========================================
+
+PARSER_PAGE_TYPES = ('shutuba', 'shutuba_past', 'result', 'mark_list')
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def parse_page(page, content):
+    """ scraper と同じ手順で1ページをパースする """
+    if page == 'shutuba':
+        soup = html_parsing.make_soup(content, 'shutuba')
+        scraper.parse_race_header(soup, 'shutuba.html?race_id=0', '')
+        return scraper.parse_shutuba_horses(soup)
+    if page == 'shutuba_past':
+        sp = html_parsing.make_soup(content.decode('euc-jp', errors='replace'), 'shutuba_past')
+        # 馬番 1〜18 のダミー行に過去走を反映させる
+        horses = race_model.Runners(race_model.Horse(n) for n in range(1, 19))
+        scraper.parse_past_performance(sp, horses)
+        return horses
+    if page == 'result':
+        return scraper.parse_race_result(html_parsing.make_soup(content, 'result'))
+    if page == 'mark_list':
+        return scraper.parse_yoso_odds(html_parsing.make_soup(content, 'mark_list'))
+
+
+def run_parser_benchmark(pages, backend, subtrees, repeat):
+    """ ページ種別ごとの1ページあたり平均所要時間 (ms) を返す """
+    html_parsing.configure(backend, subtrees)
+    timings = {}
+    for page, contents in pages.items():
+        if not contents:
+            continue
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for content in contents:
+                parse_page(page, content)
+        timings[page] = (time.perf_counter() - started) * 1000 / (repeat * len(contents))
+    return timings
+
+
+def compare_parsers(fixture_dir, repeat):
+    found = fixtures.list_fixtures(fixture_dir)
+    pages = {page: [read_bytes(p) for p in found[page].values()] for page in PARSER_PAGE_TYPES}
+    if not any(pages.values()):
+        print(f"フィクスチャが見つかりません: {fixture_dir}")
+        return
+
+    configs = [(html_parsing.FALLBACK_BACKEND, False), (html_parsing.FALLBACK_BACKEND, True)]
+    if html_parsing.FAST_BACKEND:
+        configs += [(html_parsing.FAST_BACKEND, False), (html_parsing.FAST_BACKEND, True)]
+    else:
+        print("lxml が未インストールのため html.parser のみ計測します。")
+
+    results = {config: run_parser_benchmark(pages, config[0], config[1], repeat) for config in configs}
+    baseline = results[configs[0]]
+
+    print(f"{'page':<14}{'n':>4}  " + "  ".join(f"{b + ('/subtree' if s else '/full'):<17}" for b, s in configs))
+    for page in PARSER_PAGE_TYPES:
+        if page not in baseline:
+            continue
+        cells = []
+        for config in configs:
+            ms = results[config][page]
+            cells.append(f"{ms:7.2f}ms x{baseline[page] / ms:4.1f}  ")
+        print(f"{page:<14}{len(pages[page]):>4}  " + "  ".join(cells))
+    html_parsing.configure()
+
+
+class StageRecorder:
+    """ 段階名ごとに呼び出し回数・所要時間・メモリピークを集計する """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def run(self, stage, fn, *args):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        s = self.stages.setdefault(stage, {"calls": 0, "total_ms": 0.0, "peak_kb": 0.0})
+        s["calls"] += 1
+        s["total_ms"] += elapsed * 1000
+        if self.trace_memory:
+            peak = (tracemalloc.get_traced_memory()[1] - base) / 1024
+            s["peak_kb"] = max(s["peak_kb"], peak)
+        return result
+
+
+def replay_pipeline(found, rec):
+    """ フィクスチャを scraper と同じ順序でパース → 期待値計算 → 買い目生成する """
+    for key, path in found['race_list_sub'].items():
+        rec.run('parse.race_list_sub', lambda c: discovery.parse_race_list(html_parsing.make_soup(c), ''),
+                read_bytes(path))
+
+    for race_id, path in found['shutuba'].items():
+        soup = rec.run('parse.shutuba', html_parsing.make_soup, read_bytes(path), 'shutuba')
+        race_info = rec.run('parse.race_header', scraper.parse_race_header,
+                            soup, f"shutuba.html?race_id={race_id}", '')
+        raw_horses = rec.run('parse.shutuba_horses', scraper.parse_shutuba_horses, soup)
+        if not raw_horses:
+            continue
+
+        if race_id in found['result']:
+            status, results = rec.run('parse.result', lambda c: scraper.parse_race_result(html_parsing.make_soup(c, 'result')),
+                                      read_bytes(found['result'][race_id]))
+            race_info.update({"status": status, "results": results})
+
+        # 予想オッズの補完はフィクスチャ再生モードの fetch で mark_list を読む
+        rec.run('parse.mark_list', scraper.apply_yoso_odds, raw_horses, race_id)
+
+        if race_id in found['shutuba_past']:
+            text = read_bytes(found['shutuba_past'][race_id]).decode('euc-jp', errors='replace')
+            rec.run('parse.shutuba_past',
+                    lambda t: scraper.parse_past_performance(html_parsing.make_soup(t, 'shutuba_past'), raw_horses), text)
+
+        horses = rec.run('model.calculate_expected_values', scraper.calculate_expected_values, raw_horses, race_info)
+        rec.run('model.generate_portfolios', scraper.generate_portfolios, horses)
+
+    for key, path in found['keibalab_list'].items():
+        rec.run('parse.keibalab_list', lambda c, d: keibalab.parse_keibalab_race_links(html_parsing.make_soup(c), d),
+                read_bytes(path), key)
+    for key, path in found['keibalab'].items():
+        s_l = rec.run('parse.keibalab', html_parsing.make_soup, read_bytes(path))
+        names = rec.run('parse.keibalab_horses', keibalab.parse_keibalab_horse_names, s_l)
+        rec.run('parse.keibalab_last_3f', keibalab.parse_keibalab_last_3f, s_l, names)
+
+
+def benchmark_pipeline(fixture_dir, repeat, json_path=None):
+    found = fixtures.list_fixtures(fixture_dir)
+    if not found['shutuba']:
+        print(f"出馬表のフィクスチャが見つかりません: {fixture_dir}")
+        return
+    fetcher.enable_replay(fixture_dir)
+
+    # 時間計測とメモリ計測は別パスで行う (tracemalloc のオーバーヘッドを時間に含めない)
+    timing = StageRecorder()
+    for _ in range(repeat):
+        replay_pipeline(found, timing)
+    memory = StageRecorder(trace_memory=True)
+    tracemalloc.start()
+    try:
+        replay_pipeline(found, memory)
+    finally:
+        tracemalloc.stop()
+
+    backend, subtrees = html_parsing.current_backend()
+    print(f"レース {len(found['shutuba'])} 件 x {repeat} 回 / パーサー: {backend}{' (部分木)' if subtrees else ''}")
+    print(f"{'stage':<34}{'calls':>7}{'total ms':>11}{'ms/call':>10}{'peak KB':>10}")
+    report = []
+    for stage, s in timing.stages.items():
+        peak_kb = memory.stages.get(stage, {}).get("peak_kb", 0.0)
+        per_call = s["total_ms"] / s["calls"]
+        print(f"{stage:<34}{s['calls']:>7}{s['total_ms']:>11.2f}{per_call:>10.3f}{peak_kb:>10.1f}")
+        report.append({
+            "stage": stage,
+            "calls": s["calls"],
+            "total_ms": round(s["total_ms"], 3),
+            "ms_per_call": round(per_call, 4),
+            "peak_kb": round(peak_kb, 1),
+        })
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": datetime.now().isoformat(timespec='seconds'),
+                "python": platform.python_version(),
+                "parser": backend,
+                "subtrees": subtrees,
+                "races": len(found['shutuba']),
+                "repeat": repeat,
+                "stages": report,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"計測結果を保存しました: {json_path}")
+
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def _distribution(values):
+    """ 所要時間 (秒) の件数・パーセンタイル・最大 """
+    if not values:
+        return {"n": 0}
+    values = np.asarray(values, dtype=float)
+    result = {"n": len(values)}
+    result.update({f"p{q}": round(float(np.percentile(values, q)), 4) for q in LATENCY_PERCENTILES})
+    result["max"] = round(float(values.max()), 4)
+    return result
+
+
+def run_load_test(fixture_dir, scale, latency_ms, latency_sigma, error_rate, max_rps, seed, scraper_args,
+                  json_path=None):
+    """ スタンドインサーバーを起動して scraper.main を実行し、スループットと所要時間の分布を返す """
+    found = fixtures.list_fixtures(fixture_dir)
+    if not found['race_list_sub']:
+        print(f"レース一覧のフィクスチャが見つかりません: {fixture_dir}")
+        return None
+    # フィクスチャにある開催日の範囲だけを取得させる
+    days = sorted(found['race_list_sub'])
+    server = standin_server.StandinServer(fixture_dir, port=0, latency_ms=latency_ms, latency_sigma=latency_sigma,
+                                          error_rate=error_rate, max_rps=max_rps, scale=scale, seed=seed).start()
+    out_dir = tempfile.mkdtemp(prefix='loadtest_')
+    report_path = os.path.join(out_dir, 'run_report.json')
+    # 出力先は一時ディレクトリにする (frontend/data を書き換えない)
+    scraper.FRONTEND_DATA_DIR = out_dir
+    scraper.OUTPUT_JSON_PATH = os.path.join(out_dir, 'data.json')
+    argv = ["--no-cache", "--no-archive", "--run-report", report_path,
+            "--netkeiba-base-url", f"{server.base_url}/netkeiba",
+            "--keibalab-base-url", f"{server.base_url}/keibalab",
+            "--from-date", days[0], "--to-date", days[-1]] + list(scraper_args)
+    started = time.perf_counter()
+    try:
+        scraper.main(argv)
+    finally:
+        wall = time.perf_counter() - started
+        server.stop()
+
+    with open(report_path, encoding='utf-8') as f:
+        run_report = json.load(f)
+    stats = fetcher.get_fetch_stats()
+    races = run_report.get("races", {})
+    result = {
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "scale": scale,
+        "latency_ms": latency_ms,
+        "latency_sigma": latency_sigma,
+        "error_rate": error_rate,
+        "max_rps": max_rps,
+        "scraper_args": list(scraper_args),
+        "wall_s": round(wall, 3),
+        "races": len(races),
+        "races_per_s": round(len(races) / wall, 3) if wall else None,
+        "requests": len(stats),
+        "requests_per_s": round(len(stats) / wall, 3) if wall else None,
+        "retries": sum(s["retries"] for s in stats),
+        "failures": sum(1 for s in stats if s["error"]),
+        "request_latency_s": _distribution([s["elapsed"] for s in stats]),
+        "race_wall_s": _distribution([r["wall_s"] for r in races.values() if r.get("wall_s")]),
+        "server": server.summary(),
+    }
+
+    print(f"レース {result['races']} 件 (x{scale}) / 全体 {wall:.2f}s / {result['races_per_s']} レース/s / "
+          f"{result['requests_per_s']} リクエスト/s / リトライ {result['retries']} 回 / 失敗 {result['failures']} 件")
+    for label, key in (("リクエスト", "request_latency_s"), ("レース", "race_wall_s")):
+        d = result[key]
+        if d["n"]:
+            print(f"{label:<8}" + "  ".join(f"p{q} {d[f'p{q}']:.3f}s" for q in LATENCY_PERCENTILES)
+                  + f"  max {d['max']:.3f}s")
+    for page, statuses in result["server"].items():
+        print(f"  {page:<16}" + "  ".join(f"{status}: {count}" for status, count in statuses.items()))
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"計測結果を保存しました: {json_path}")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTMLフィクスチャを使ったオフラインベンチマーク")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_parsers = sub.add_parser("parsers", help="パーサー構成ごとのパース時間を比較する")
+    p_pipeline = sub.add_parser("pipeline", help="パース・期待値計算・買い目生成の段階別に時間とメモリを計測する")
+    for p in (p_parsers, p_pipeline):
+        p.add_argument("--fixtures", default=fixtures.DEFAULT_FIXTURE_DIR, help="HTMLフィクスチャのディレクトリ")
+        p.add_argument("--repeat", type=int, default=5, help="繰り返し回数")
+    p_pipeline.add_argument("--json", metavar="PATH", help="計測結果をJSONで保存する (回帰の追跡用)")
+    p_load = sub.add_parser("loadtest", help="スタンドインサーバーに対して scraper 全体を実行し、スループットと遅延の分布を計測する")
+    p_load.add_argument("--fixtures", default=fixtures.DEFAULT_FIXTURE_DIR, help="HTMLフィクスチャのディレクトリ")
+    p_load.add_argument("--scale", type=int, default=10, help="レース数の倍率 (レース一覧の各レースを複製する)")
+    p_load.add_argument("--latency-ms", type=float, default=50.0, help="応答遅延の中央値 (ミリ秒)")
+    p_load.add_argument("--latency-sigma", type=float, default=0.5, help="応答遅延の対数正規分布の σ")
+    p_load.add_argument("--error-rate", type=float, default=0.0, help="503 を返す割合 (0〜1)")
+    p_load.add_argument("--max-rps", type=float, help="サーバー側の1秒あたりのリクエスト数の上限 (超過分は 429)")
+    p_load.add_argument("--seed", type=int, default=0, help="遅延・エラーの乱数シード")
+    p_load.add_argument("--json", metavar="PATH", help="計測結果をJSONで保存する")
+    p_load.add_argument("scraper_args", nargs=argparse.REMAINDER,
+                        help="scraper.py に渡す引数 (例: -- --workers 8 --full-card)")
+    args = parser.parse_args(argv)
+
+    if args.command == "parsers":
+        compare_parsers(args.fixtures, args.repeat)
+    elif args.command == "pipeline":
+        benchmark_pipeline(args.fixtures, args.repeat, args.json)
+    else:
+        scraper_args = args.scraper_args[1:] if args.scraper_args[:1] == ["--"] else args.scraper_args
+        run_load_test(args.fixtures, args.scale, args.latency_ms, args.latency_sigma, args.error_rate, args.max_rps,
+                      args.seed, scraper_args, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import json
+import math
+import threading
+
+import numpy as np
+
+import fetcher
+import instrumentation
+from fetcher import prefetch
+
+# ==========================================
+# 組み合わせ馬券のリアルタイムオッズ (netkeiba のオッズAPI)
+# - 券種ごとに1回のリクエストで全組み合わせのオッズ (JSON) を取得する
+# - 馬番の組み合わせ → 配列の位置 (馬番-1 を18進の桁とみなした通し番号) の float32 配列として保持する。
+#   3連単でも 18^3 要素 (約23KB) で、取得できなかった組み合わせは NaN
+# - 複勝・ワイドは下限オッズを使う (トリガミ判定を甘くしないため)
+# - 1回の実行の間はレースごとに取得結果を共有し、同じレースを再取得しない
+# ==========================================
+
+ODDS_API_URL = fetcher.NETKEIBA_BASE_URL + "/api/api_get_jra_odds.html?race_id={race_id}&type={api_type}&action=update"
+MAX_RUNNERS = 18
+
+# 券種 → (API の type, 応答の odds 内のキー, 馬番の数, 順序あり)
+BET_TYPE_API = {
+    "単勝": ("1", "1", 1, True),
+    "複勝": ("1", "2", 1, True),
+    "馬連": ("4", "4", 2, False),
+    "ワイド": ("5", "5", 2, False),
+    "馬単": ("6", "6", 2, True),
+    "3連複": ("7", "7", 3, False),
+    "3連単": ("8", "8", 3, True),
+}
+DEFAULT_BET_TYPES = ("複勝", "ワイド", "馬連", "馬単", "3連複", "3連単")
+
+
+def _odds_value(value):
+    """ "12.3" / "1,234.5" → float。発売前・取消 ("---.-" や "") は NaN """
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return math.nan
+
+
+def combination_index(numbers, ordered):
+    """ 馬番の組み合わせ (形状 (m, k) の配列) → 配列の位置。範囲外の馬番は -1 """
+    numbers = np.asarray(numbers, dtype=np.intp)
+    if not ordered:
+        numbers = np.sort(numbers, axis=1)
+    valid = ((numbers >= 1) & (numbers <= MAX_RUNNERS)).all(axis=1)
+    index = np.zeros(len(numbers), dtype=np.intp)
+    for col in range(numbers.shape[1]):
+        index = index * MAX_RUNNERS + (numbers[:, col] - 1)
+    return np.where(valid, index, -1)
+
+
+def parse_odds_response(content, bet_type):
+    """ オッズAPIの応答 (JSON) から券種の全組み合わせのオッズ配列を返す。該当券種がなければ None """
+    _, key, size, ordered = BET_TYPE_API[bet_type]
+    data = json.loads(content)
+    table = ((data.get("data") or {}).get("odds") or {}).get(key)
+    if not table:
+        return None
+    # キーは馬番2桁の連結 ("0103" = 1-3、"010307" = 1-3-7)
+    codes = np.fromiter((int(k) for k in table), dtype=np.int64, count=len(table))
+    numbers = np.stack([codes // 100 ** (size - 1 - pos) % 100 for pos in range(size)], axis=1)
+    values = np.fromiter((_odds_value(v[0] if isinstance(v, list) else v) for v in table.values()),
+                         dtype=np.float32, count=len(table))
+    index = combination_index(numbers, ordered)
+    odds = np.full(MAX_RUNNERS ** size, np.nan, dtype=np.float32)
+    odds[index[index >= 0]] = values[index >= 0]
+    return odds
+
+
+class RaceOdds:
+    """ 1レース分の券種 → オッズ配列 """
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def __bool__(self):
+        return bool(self.tables)
+
+    def lookup(self, bet_type, numbers):
+        """ 馬番の組み合わせ (形状 (m, k)) のオッズを返す。取得できなかった組み合わせは NaN """
+        table = self.tables.get(bet_type)
+        if table is None:
+            return np.full(len(numbers), np.nan)
+        index = combination_index(numbers, BET_TYPE_API[bet_type][3])
+        return np.where(index >= 0, table[np.maximum(index, 0)], np.nan).astype(float)
+
+
+class LiveOdds:
+    """ 1回の実行の間、レースごとの組み合わせオッズを共有する (スレッドセーフ) """
+
+    def __init__(self, executor=None, bet_types=DEFAULT_BET_TYPES):
+        self.executor = executor
+        self.bet_types = bet_types
+        self._lock = threading.Lock()
+        self._races = {}
+
+    def prefetch(self, race_id):
+        """ レースの全券種の取得を先行投入し、RaceOdds を返す関数を返す """
+        race_id = race_id.split('&')[0]
+        with self._lock:
+            if race_id in self._races:
+                cached = self._races[race_id]
+                return lambda: cached
+        api_types = sorted({BET_TYPE_API[t][0] for t in self.bet_types})
+        pages = {api_type: prefetch(self.executor, ODDS_API_URL.format(race_id=race_id, api_type=api_type))
+                 for api_type in api_types}
+
+        def load():
+            tables = {}
+            for bet_type in self.bet_types:
+                try:
+                    r = pages[BET_TYPE_API[bet_type][0]]()
+                    if r.status_code != 200:
+                        continue
+                    with instrumentation.stage("live_odds"):
+                        odds = parse_odds_response(r.content, bet_type)
+                    if odds is not None:
+                        tables[bet_type] = odds
+                except Exception as e:
+                    print(f"組み合わせオッズ取得エラー ({bet_type}): {e}")
+            race_odds = RaceOdds(tables)
+            with self._lock:
+                self._races[race_id] = race_odds
+            return race_odds
+        return load
@@ -0,0 +1,93 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from archive_store import normalize_race_id
+
+# ==========================================
+# 競馬場・コースのメタデータ索引
+# - netkeiba の race_id (YYYY + 場コード2桁 + 回 + 日 + R) の場コードで競馬場を引く (JRA 10場)
+# - 競馬場ごとのコース形状 (S: 直線の長さ, H: 坂, R: コーナーのきつさ) と、
+#   (場コード, 馬場, 距離) ごとの枠番 1〜8 の枠順バイアス表を持つ
+# - (場コード, 馬場, 距離) → コースのプロファイルは初回に組み立ててキャッシュし、以後は表を引くだけにする
+# ==========================================
+
+FRAMES = 8
+DISTANCE_PATTERN = re.compile(r'([芝ダ障])?(\d+)')
+
+# 場コード → (競馬場名, S_straight, H_slope, R_corner)
+VENUE_PROFILES = {
+    "01": ("札幌", 0.3, 0.1, 0.7),
+    "02": ("函館", 0.2, 0.3, 0.9),
+    "03": ("福島", 0.3, 0.3, 0.8),
+    "04": ("新潟", 1.0, 0.0, 0.2),
+    "05": ("東京", 1.0, 0.5, 0.3),
+    "06": ("中山", 0.4, 1.0, 0.8),
+    "07": ("中京", 0.7, 0.8, 0.5),
+    "08": ("京都", 0.7, 0.2, 0.5),
+    "09": ("阪神", 0.6, 0.9, 0.5),
+    "10": ("小倉", 0.3, 0.2, 0.9),
+}
+DEFAULT_VENUE = ("JRA", 0.5, 0.5, 0.5)
+
+# 坂の影響を強める競馬場 (C_i の beta)
+STEEP_SLOPE_VENUES = {"06"}
+
+# 枠順バイアス (枠番 1〜8 の加点)。(場コード, 馬場, 距離) で引き、馬場を問わない場合は馬場を None にする
+INNER_FAVORED = (0.5, 0.5, 0.5, 0.5, 0.0, 0.0, -0.3, -0.3)
+OUTER_FAVORED = (-0.3, -0.3, 0.0, 0.0, 0.0, 0.0, 0.5, 0.5)
+DRAW_BIAS = {
+    # 小回りの短距離は内枠有利・外枠不利
+    ("06", None, 1200): INNER_FAVORED,
+    ("09", None, 1200): INNER_FAVORED,
+    # 1コーナーまでが短い
+    ("06", "芝", 1600): INNER_FAVORED,
+    ("05", "芝", 2000): INNER_FAVORED,
+    # 芝スタートのダート・直線競馬は外枠有利
+    ("05", "ダ", 1600): OUTER_FAVORED,
+    ("04", "芝", 1000): OUTER_FAVORED,
+}
+NO_DRAW_BIAS = np.zeros(FRAMES)
+NO_DRAW_BIAS.flags.writeable = False
+
+
+def course_key(race_info):
+    """ race_info から (場コード, 馬場 ('芝'/'ダ'/'障'、不明は ''), 距離 (不明は 0)) を返す """
+    race_id = normalize_race_id(race_info.get("id", ""))
+    m = DISTANCE_PATTERN.search(race_info.get("distance", ""))
+    return race_id[4:6], (m.group(1) or "") if m else "", int(m.group(2)) if m else 0
+
+
+@lru_cache(maxsize=None)
+def course_profile(venue_code, surface, distance):
+    """
+    コースのプロファイル (C_i の係数と枠順バイアス表) を返す。
+    {"venue", "alpha", "beta", "gamma", "course": (S, H, R), "draw_bias": 枠番1〜8の配列}
+    """
+    name, s_straight, h_slope, r_corner = VENUE_PROFILES.get(venue_code, DEFAULT_VENUE)
+    table = DRAW_BIAS.get((venue_code, surface, distance)) or DRAW_BIAS.get((venue_code, None, distance))
+    draw_bias = NO_DRAW_BIAS
+    if table is not None:
+        draw_bias = np.array(table, dtype=float)
+        draw_bias.flags.writeable = False
+    return {
+        "venue": name,
+        # 距離に応じて直線要求度などを変える (マイルは直線の比重を上げる)
+        "alpha": 1.0 if distance == 1600 else 0.8,
+        "beta": 1.2 if venue_code in STEEP_SLOPE_VENUES else 0.8,
+        "gamma": 1.0,
+        "course": (s_straight, h_slope, r_corner),
+        "draw_bias": draw_bias,
+    }
+
+
+def lookup(race_info):
+    """ race_info のコースのプロファイル """
+    return course_profile(*course_key(race_info))
+
+
+def draw_bias(profile, frames):
+    """ 枠番の配列 → 枠順バイアスの配列 (範囲外の枠番は端の枠として扱う) """
+    index = np.clip(np.asarray(frames, dtype=float), 1, FRAMES).astype(np.intp) - 1
+    return profile["draw_bias"][index]
@@ -0,0 +1,186 @@
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+
+import fetcher
+import instrumentation
+from fetcher import fetch
+from html_parsing import make_soup
+
+# ==========================================
+# レース一覧の取得 (開催日単位)
+# - 指定した日付範囲の race_list_sub.html を取得し、レースID・開催日・競馬場・グレード・発走時刻を持つ
+#   レース記述子 (dict) のリストを返す
+# - 過去の開催日の一覧は以後変化しないため、パース済みの記述子を開催日ごとのJSONとしてキャッシュし再取得しない
+# - キャッシュにない開催日は executor で並行取得する
+# ==========================================
+
+LIST_URL = fetcher.NETKEIBA_BASE_URL + "/top/race_list_sub.html?kaisai_date={}"
+DEFAULT_LISTING_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'listings')
+DEFAULT_DAY_OFFSETS = (-2, 2)  # 既定の取得範囲 (今日からの日数)
+
+# race_id[4:6] の競馬場コード
+VENUES = {
+    "01": "札幌", "02": "函館", "03": "福島", "04": "新潟", "05": "東京",
+    "06": "中山", "07": "中京", "08": "京都", "09": "阪神", "10": "小倉",
+}
+# 重賞アイコンクラス (Icon_GradeType1: G1, Type2: G2, Type3: G3)
+GRADE_CLASSES = {"Icon_GradeType1": "G1", "Icon_GradeType2": "G2", "Icon_GradeType3": "G3"}
+GRADED = tuple(GRADE_CLASSES.values())
+
+
+def race_descriptor(url, race_date, name=None, grade=None, post_time=None):
+    """ 出馬表URLと開催日 ('YYYY-MM-DD') からレース記述子を作る """
+    race_id = url.split('race_id=')[-1].split('&')[0]
+    return {
+        "race_id": race_id,
+        "url": url,
+        "date": race_date,
+        "venue_code": race_id[4:6],
+        "venue": VENUES.get(race_id[4:6], "JRA"),
+        "race_number": int(race_id[10:12]) if race_id[10:12].isdigit() else None,
+        "name": name,
+        "grade": grade,
+        "post_time": post_time,
+        # 発走時刻 (スケジューラ用)。不明な場合は None
+        "start_at": f"{race_date}T{post_time}" if race_date and post_time else None,
+    }
+
+
+def parse_race_list(soup, race_date):
+    """ レース一覧 (race_list_sub) から全レースの記述子を掲載順に返す """
+    races = []
+    seen = set()
+    for a in soup.find_all('a', href=True):
+        if 'shutuba.html' not in a['href']:
+            continue
+        full_url = a['href'] if a['href'].startswith('http') else fetcher.NETKEIBA_BASE_URL + a['href'].lstrip('..')
+        if full_url in seen:
+            continue
+        seen.add(full_url)
+        item = a.find_parent('li') or a.parent
+        grade = None
+        for icon in item.select('.Icon_GradeType1, .Icon_GradeType2, .Icon_GradeType3'):
+            grade = next((GRADE_CLASSES[c] for c in icon.get('class', []) if c in GRADE_CLASSES), None)
+            if grade:
+                break
+        title = item.select_one('.ItemTitle')
+        time_el = item.select_one('.RaceList_Itemtime')
+        m = re.search(r'(\d{1,2}):(\d{2})', time_el.text) if time_el else None
+        races.append(race_descriptor(
+            full_url, race_date,
+            name=title.text.strip() if title else None,
+            grade=grade,
+            post_time=f"{int(m.group(1)):02d}:{m.group(2)}" if m else None,
+        ))
+    return races
+
+
+def date_range(start, end):
+    """ start〜end (date, 両端含む) の日付を順に返す """
+    days = (end - start).days
+    return [start + timedelta(days=i) for i in range(days + 1)]
+
+
+def default_date_range(today=None):
+    today = today or date.today()
+    return today + timedelta(days=DEFAULT_DAY_OFFSETS[0]), today + timedelta(days=DEFAULT_DAY_OFFSETS[1])
+
+
+class ListingCache:
+    """ 過去の開催日のレース記述子を開催日ごとのJSONとして保存する (開催日が過ぎた一覧は変化しない) """
+
+    def __init__(self, cache_dir=DEFAULT_LISTING_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, day):
+        return os.path.join(self.cache_dir, f"{day.strftime('%Y%m%d')}.json")
+
+    def load(self, day):
+        try:
+            with open(self._path(day), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def store(self, day, races):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(day)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(races, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def fetch_race_list(day):
+    """ 1開催日分のレース一覧を取得し、全レースの記述子を返す。200 以外の応答は例外にする """
+    url = LIST_URL.format(day.strftime('%Y%m%d'))
+    r = fetch(url)
+    if r.status_code != 200:
+        # エラーページは空の一覧としてパースされてしまうため、一覧のキャッシュにも確定扱いにもせず次回に再取得する
+        raise ValueError(f"HTTP {r.status_code}")
+    races = parse_race_list(make_soup(r.content), day.strftime('%Y-%m-%d'))
+    if day < date.today():
+        fetcher.mark_final(url)
+    return races
+
+
+def discover_races(start=None, end=None, executor=None, cache=None, grades=GRADED, today=None):
+    """
+    start〜end の開催日のレース記述子を開催日順・掲載順に返す。grades=None なら全レース。
+    cache (ListingCache) があれば過去の開催日はキャッシュから読み、取得した過去の開催日を保存する。
+    """
+    today = today or date.today()
+    if start is None or end is None:
+        default_start, default_end = default_date_range(today)
+        start, end = start or default_start, end or default_end
+    days = date_range(start, end)
+
+    listings = {}
+    pending = []
+    for day in days:
+        cached = cache.load(day) if cache and day < today else None
+        if cached is not None:
+            listings[day] = cached
+        else:
+            pending.append(day)
+
+    def load(day):
+        try:
+            return day, fetch_race_list(day)
+        except Exception as e:
+            print(f"[{day.strftime('%Y%m%d')}] レース一覧取得エラー: {e}")
+            return day, None
+
+    if executor is not None and len(pending) > 1:
+        fetched = list(executor.map(instrumentation.wrap_context(load), pending))
+    else:
+        fetched = [load(day) for day in pending]
+    for day, races in fetched:
+        if races is None:
+            continue
+        listings[day] = races
+        if cache and day < today:
+            cache.store(day, races)
+
+    result = []
+    seen = set()
+    for day in days:
+        day_races = [r for r in listings.get(day) or [] if (grades is None or r["grade"] in grades)
+                     and r["url"] not in seen]
+        seen.update(r["url"] for r in day_races)
+        if day_races:
+            print(f"[{day.strftime('%Y%m%d')}] の{'重賞' if grades else ''}レースを {len(day_races)} 件発見しました。")
+        result.extend(day_races)
+    return result
+
+
+def parse_date(value):
+    """ argparse 用: 'YYYY-MM-DD' または 'YYYYMMDD' を date に変換する """
+    for fmt in ('%Y-%m-%d', '%Y%m%d'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"日付の形式が不正です: {value}")
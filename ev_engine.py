@@ -0,0 +1,186 @@
+import re
+
+import numpy as np
+
+import course_index
+from model_params import DEFAULT_PARAMS
+
+# ==========================================
+# 期待値（EV）算出モデルのベクトル化エンジン
+# 1レースを列 (オッズ・上がり3F・推定持ち時計・枠・馬体重・増減・着順…) の配列として受け取り、
+# S_i・推定勝率・期待値を配列演算で一括計算する。複数レースをまとめて渡すとバックテスト等で一度に処理できる。
+# ==========================================
+
+# build_race_columns の列の構成を変えたら上げる (sweep.py の特徴量キャッシュを作り直すため)
+COLUMNS_VERSION = 3
+
+# 係数ウェイト・温度・オッズ上限・欠損値ペナルティは model_params.ModelParams で指定する
+MIN_WIN_PROB = 0.001
+MISSING_PLACEMENT = 8.0  # 着順欠損時は平均8着相当
+TOP_JOCKEY_PLACE_RATE = 0.4  # J_i が満点になる騎手の複勝率 (feature_store の平滑化済みの値)
+MISSING_JOCKEY_SCORE = 0.5  # 特徴量ストアに記録のない騎手
+
+
+def build_race_columns(raw_horses, race_info):
+    """
+    出走馬 (race_model.Horse の並び) をモデル入力の列配列に変換する。
+    各馬の値はパース時に型をそろえてある (不明は None) ため、ここでは欠損を NaN に置き換えるだけで、
+    スコア計算はすべて数値配列で行う。
+    """
+    # 競馬場・コースは race_id の場コードと馬場・距離から引く (C_i の係数と枠順バイアス表)
+    profile = course_index.lookup(race_info)
+
+    current_distance_match = re.search(r'\d+', race_info.get("distance", "2000"))
+    current_distance = int(current_distance_match.group()) if current_distance_match else 2000
+
+    n = len(raw_horses)
+    odds = np.empty(n)
+    last_3f = np.full(n, np.nan)
+    best_time = np.full(n, np.nan)
+    frame = np.empty(n)
+    a_i = np.empty(n)
+    heavy = np.zeros(n, dtype=bool)
+    placement_mean = np.full(n, np.nan)
+    jockey_place_rate = np.full(n, np.nan)
+    weight_change = np.empty(n)
+    odds_drift = np.zeros(n)
+
+    for i, h in enumerate(raw_horses):
+        odds[i] = h.odds
+        if h.last_3f is not None:
+            last_3f[i] = h.last_3f
+        # 持ち時計（T_i）: 過去走のタイムを今回距離に換算した最速値
+        estimates = [pt["time_sec"] * (current_distance / pt["distance"])
+                     for pt in h.past_times or () if pt["distance"] > 0]
+        if estimates:
+            best_time[i] = min(estimates)
+        elif h.horse_best_time is not None:
+            # 過去5走に同条件がなくても、特徴量ストアに同じ馬場・距離の持ち時計があれば使う
+            best_time[i] = h.horse_best_time
+        frame[i] = h.frame
+        a_i[i] = h.a_i or 0.0
+        heavy[i] = h.weight > 500
+        if h.recent_placements:
+            placement_mean[i] = sum(h.recent_placements) / len(h.recent_placements)
+        # 騎手の複勝率 (feature_store.FeatureStore.annotate が付けた場合のみ)
+        if h.jockey_place_rate is not None:
+            jockey_place_rate[i] = h.jockey_place_rate
+        # 馬体重の増減 (不明は NaN)
+        weight_change[i] = np.nan if h.weight_change is None else h.weight_change
+        # オッズ推移 (archive_store.OddsSeries の記録がある場合のみ)
+        if h.odds_drift is not None:
+            odds_drift[i] = h.odds_drift
+
+    return {
+        "odds": odds,
+        "last_3f": last_3f,
+        "best_time_est": best_time,
+        "frame": frame,
+        "a_i": a_i,
+        "heavy": heavy,
+        "placement_mean": placement_mean,
+        "jockey_place_rate": jockey_place_rate,
+        "weight_change": weight_change,
+        "odds_drift": odds_drift,
+        # レース単位のスカラー
+        "current_distance": current_distance,
+        # C_i のベース係数 (アルファ、ベータ、ガンマ) とコース形状
+        "alpha": profile["alpha"],
+        "beta": profile["beta"],
+        "gamma": profile["gamma"],
+        "course": profile["course"],
+        # B_draw (枠順バイアス): コースの枠番別の表から引いた馬ごとの値
+        "draw_bias": course_index.draw_bias(profile, frame),
+    }
+
+
+def _segment_zscores(values, seg, n_races, default_mean, clip=None, missing=None):
+    """ レース (seg) ごとの平均・母標準偏差で Z スコア化する。NaN は欠損として統計から除外する """
+    valid = ~np.isnan(values)
+    x = np.where(valid, values, 0.0)
+    count = np.bincount(seg, weights=valid, minlength=n_races)
+    mean = np.where(count > 0, np.bincount(seg, weights=x, minlength=n_races) / np.maximum(count, 1), default_mean)
+    dev = np.where(valid, values - mean[seg], 0.0)
+    std = np.sqrt(np.bincount(seg, weights=dev * dev, minlength=n_races) / np.maximum(count, 1))
+    std = np.where((count > 1) & (std != 0), std, 1.0)
+    z = (mean[seg] - x) / std[seg]
+    if clip is not None:
+        z = np.clip(z, -clip, clip)
+    if missing is not None:
+        z = np.where(valid, z, missing)
+    return z
+
+
+def score_races(races, params=None):
+    """
+    build_race_columns の結果のリストを受け取り、レースごとに
+    {"score_si", "win_probability", "expected_return"} の配列を返す。
+    全レースの馬を1本の配列に連結し、レース内の統計量は bincount / reduceat で計算する。
+    params (ModelParams) を省略すると既定の係数を使う。
+    """
+    p = params or DEFAULT_PARAMS
+    if not races:
+        return []
+    sizes = np.array([len(r["odds"]) for r in races])
+    n_races = len(races)
+    seg = np.repeat(np.arange(n_races), sizes)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    def col(key):
+        return np.concatenate([r[key] for r in races])
+
+    def per_race(key):
+        return np.repeat(np.array([r[key] for r in races], dtype=float), sizes)
+
+    odds = col("odds")
+    a_i = col("a_i")
+    course = np.repeat(np.array([r["course"] for r in races]), sizes, axis=0)
+    s_straight, h_slope, r_corner = course[:, 0], course[:, 1], course[:, 2]
+
+    # 1. T_i (走破タイム/能力スコア) / 2. F_i (上り3ハロン)
+    t_default = np.array([r["current_distance"] * 0.06 for r in races])
+    t_z = _segment_zscores(col("best_time_est"), seg, n_races, t_default, clip=3.0, missing=p.missing_time_z)
+    f_z = _segment_zscores(col("last_3f"), seg, n_races, 35.0, clip=3.0, missing=p.missing_last_3f_z)
+
+    # 3. C_i (コース適性スコアと枠順バイアス)
+    b_draw = col("draw_bias")
+    # 【Ver 3.0】枠順バイアスの地力（A_i）による相殺
+    b_draw = np.where(b_draw < 0, b_draw * (1.0 - a_i), b_draw)
+    c_i = (per_race("alpha") * s_straight) + (per_race("beta") * h_slope) + (per_race("gamma") * r_corner) + b_draw
+    # 大きな馬体重は坂に強い等
+    c_i = c_i + np.where(col("heavy"), 0.2 * h_slope, 0.0)
+
+    # 4. R_i (直近3走着順) & 5. J_i (騎手) & 6. W_i (コンディション)
+    placement = col("placement_mean")
+    r_score = 1.0 / np.where(np.isnan(placement), MISSING_PLACEMENT, placement)
+    jockey_rate = col("jockey_place_rate")
+    j_score = np.where(np.isnan(jockey_rate), MISSING_JOCKEY_SCORE,
+                       np.clip(np.nan_to_num(jockey_rate) / TOP_JOCKEY_PLACE_RATE, 0.0, 1.0))
+    wc = col("weight_change")
+    # 異常な増減(-10kg以下、+15kg以上)はペナルティ
+    w_score = np.where((wc <= -10) | (wc >= 15), 0.5, 1.0)
+
+    # 【Ver 3.0】実績ペナルティの動的緩和ロジック
+    w_4_i = np.where(c_i >= p.theta, p.w4 * 0.2, p.w4)
+    s_i = (p.w1 * t_z) + (p.w2 * f_z) + (p.w3 * c_i) + (w_4_i * r_score * 10) + (p.w5 * j_score) + (p.w6 * w_score)
+    if p.w_drift:
+        # 7. D_i (オッズ推移): 前回までの記録からオッズが下がっている (売れている) 馬を加点する
+        s_i = s_i - p.w_drift * col("odds_drift")
+
+    # Softmax関数による推定勝率 P_i: S_i をレース内で Z スコア化してから温度 tau で変換する
+    s_z = -_segment_zscores(s_i, seg, n_races, 0.0)
+    exp_scores = np.exp((s_z - np.maximum.reduceat(s_z, offsets)[seg]) / p.tau)
+    win_prob = exp_scores / np.bincount(seg, weights=exp_scores, minlength=n_races)[seg]
+    win_prob = np.maximum(win_prob, MIN_WIN_PROB)
+    expected_return = win_prob * np.minimum(odds, p.odds_cap)
+
+    return [{
+        "score_si": s_i[start:start + size],
+        "win_probability": win_prob[start:start + size],
+        "expected_return": expected_return[start:start + size],
+    } for start, size in zip(offsets, sizes)]
+
+
+def score_race(raw_horses, race_info, params=None):
+    """ 1レース分のスコアを計算する (calculate_expected_values から利用) """
+    return score_races([build_race_columns(raw_horses, race_info)], params)[0]
@@ -0,0 +1,223 @@
+import argparse
+import os
+import threading
+
+import archive_store
+import course_index
+
+# ==========================================
+# 馬・騎手の過去成績の特徴量ストア (SQLite)
+# - 確定したレースを1回だけ取り込み、馬・騎手ごとの出走数・勝利数・複勝数、
+#   馬場・距離ごとの持ち時計、競馬場ごとの成績を集計値として加算していく (取り込み済みレースは記録して二重計上しない)
+# - 着順は結果ページの上位3頭 (results["top3"]) だけから取る。4着以下は着外として数え、
+#   上位3頭の着順が取れなかった馬 (同着で4頭目になった馬など) も着外になる
+# - 集計値は馬名・騎手名を主キーとする表に持ち、出走馬の分だけ索引で引く
+# - annotate() でモデル入力用の値 (出走数で平滑化した率など) を出走馬 (race_model.Horse) に書き込む
+# ==========================================
+
+DEFAULT_FEATURE_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive', 'features.sqlite3')
+
+# 率の平滑化 (出走数の少ない馬・騎手は全体の平均に寄せる)
+PRIOR_STARTS = 20
+PRIOR_WIN_RATE = 0.07
+PRIOR_PLACE_RATE = 0.21
+PLACE_RANK = 3  # 複勝圏
+
+
+def smoothed_rate(hits, starts, prior_rate):
+    return (hits + prior_rate * PRIOR_STARTS) / (starts + PRIOR_STARTS)
+
+
+class FeatureStore:
+    """ 馬・騎手ごとの集計値を持つ SQLite ストア (スレッドセーフ) """
+
+    def __init__(self, path=DEFAULT_FEATURE_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = archive_store.connect(path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS ingested_races (
+                race_id TEXT PRIMARY KEY,
+                race_date TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS horse_stats (
+                name TEXT PRIMARY KEY,
+                starts INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                places INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jockey_stats (
+                name TEXT PRIMARY KEY,
+                starts INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                places INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS course_records (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                venue_code TEXT NOT NULL,
+                starts INTEGER NOT NULL,
+                wins INTEGER NOT NULL,
+                places INTEGER NOT NULL,
+                PRIMARY KEY (kind, name, venue_code)
+            );
+            CREATE TABLE IF NOT EXISTS horse_best_times (
+                name TEXT NOT NULL,
+                surface TEXT NOT NULL,
+                distance INTEGER NOT NULL,
+                best_time REAL NOT NULL,
+                PRIMARY KEY (name, surface, distance)
+            );
+        """)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def ingest(self, entries):
+        """ 確定済みのレース (出力と同じ形式) のうち未取り込みのものを集計に加え、取り込んだレース数を返す """
+        ingested = 0
+        with self._lock:
+            for entry in entries:
+                race_info = entry["race_info"]
+                results = race_info.get("results")
+                if race_info.get("status") != "finished" or not results:
+                    continue
+                race_id = archive_store.normalize_race_id(race_info["id"])
+                cur = self._db.execute("INSERT OR IGNORE INTO ingested_races VALUES (?, ?)",
+                                       (race_id, race_info.get("date", "")))
+                if cur.rowcount == 0:
+                    continue
+                self._ingest_race(race_info, entry["horses"], results)
+                ingested += 1
+            self._db.commit()
+        return ingested
+
+    def _ingest_race(self, race_info, horses, results):
+        venue, _, _ = course_index.course_key(race_info)
+        ranks = {r["number"]: r["rank"] for r in results.get("top3", []) if isinstance(r.get("rank"), int)}
+        horse_rows, jockey_rows, course_rows, time_rows = [], [], [], []
+        for h in horses:
+            rank = ranks.get(h["number"])
+            # 着順は上位3頭分しかないため、それ以外の馬は着外として数える
+            win, place = int(rank == 1), int(rank is not None and rank <= PLACE_RANK)
+            horse_rows.append((h["name"], win, place))
+            jockey_rows.append((h["jockey"], win, place))
+            course_rows.append(("horse", h["name"], venue, win, place))
+            course_rows.append(("jockey", h["jockey"], venue, win, place))
+            for pt in (h.get("features") or {}).get("past_times") or ():
+                time_rows.append((h["name"], pt.get("surface", ""), pt["distance"], pt["time_sec"]))
+        self._db.executemany(
+            "INSERT INTO horse_stats VALUES (?, 1, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+            "starts = starts + 1, wins = wins + excluded.wins, places = places + excluded.places",
+            horse_rows)
+        self._db.executemany(
+            "INSERT INTO jockey_stats VALUES (?, 1, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+            "starts = starts + 1, wins = wins + excluded.wins, places = places + excluded.places",
+            jockey_rows)
+        self._db.executemany(
+            "INSERT INTO course_records VALUES (?, ?, ?, 1, ?, ?) ON CONFLICT(kind, name, venue_code) DO UPDATE SET "
+            "starts = starts + 1, wins = wins + excluded.wins, places = places + excluded.places",
+            course_rows)
+        self._db.executemany(
+            "INSERT INTO horse_best_times VALUES (?, ?, ?, ?) ON CONFLICT(name, surface, distance) DO UPDATE SET "
+            "best_time = MIN(best_time, excluded.best_time)",
+            time_rows)
+
+    def _lookup(self, query, names, *params):
+        if not names:
+            return {}
+        placeholders = ", ".join("?" * len(names))
+        with self._lock:
+            rows = self._db.execute(query.format(names=placeholders), (*params, *names)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def horse_stats(self, names):
+        """ 馬名 → (出走数, 勝利数, 複勝数) """
+        return self._lookup("SELECT name, starts, wins, places FROM horse_stats WHERE name IN ({names})", names)
+
+    def jockey_stats(self, names):
+        """ 騎手名 → (騎乗数, 勝利数, 複勝数) """
+        return self._lookup("SELECT name, starts, wins, places FROM jockey_stats WHERE name IN ({names})", names)
+
+    def course_records(self, kind, names, venue_code):
+        """ 馬名/騎手名 → その競馬場での (出走数, 勝利数, 複勝数) """
+        return self._lookup("SELECT name, starts, wins, places FROM course_records "
+                            "WHERE kind = ? AND venue_code = ? AND name IN ({names})", names, kind, venue_code)
+
+    def best_times(self, names, surface, distance):
+        """ 馬名 → 同じ馬場・距離の持ち時計 (秒) """
+        return self._lookup("SELECT name, best_time FROM horse_best_times "
+                            "WHERE surface = ? AND distance = ? AND name IN ({names})", names, surface, distance)
+
+    def annotate(self, race_info, raw_horses):
+        """
+        出走馬 (race_model.Horse の並び) にモデル入力用の過去成績を書き込む。記録のない馬・騎手の項目は None のままにする。
+        jockey_place_rate / jockey_win_rate / horse_place_rate / horse_course_place_rate / jockey_course_place_rate /
+        horse_best_time (同じ馬場・距離)
+        """
+        venue, surface, distance = course_index.course_key(race_info)
+        horse_names = list({h.name for h in raw_horses})
+        jockey_names = list({h.jockey for h in raw_horses})
+        horses = self.horse_stats(horse_names)
+        jockeys = self.jockey_stats(jockey_names)
+        horse_course = self.course_records("horse", horse_names, venue)
+        jockey_course = self.course_records("jockey", jockey_names, venue)
+        times = self.best_times(horse_names, surface, distance)
+        for h in raw_horses:
+            if h.jockey in jockeys:
+                starts, wins, places = jockeys[h.jockey]
+                h.jockey_win_rate = smoothed_rate(wins, starts, PRIOR_WIN_RATE)
+                h.jockey_place_rate = smoothed_rate(places, starts, PRIOR_PLACE_RATE)
+            if h.jockey in jockey_course:
+                starts, _, places = jockey_course[h.jockey]
+                h.jockey_course_place_rate = smoothed_rate(places, starts, PRIOR_PLACE_RATE)
+            if h.name in horses:
+                starts, _, places = horses[h.name]
+                h.horse_place_rate = smoothed_rate(places, starts, PRIOR_PLACE_RATE)
+            if h.name in horse_course:
+                starts, _, places = horse_course[h.name]
+                h.horse_course_place_rate = smoothed_rate(places, starts, PRIOR_PLACE_RATE)
+            if h.name in times:
+                h.horse_best_time = times[h.name][0]
+        return raw_horses
+
+    def counts(self):
+        with self._lock:
+            return {table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("ingested_races", "horse_stats", "jockey_stats", "course_records", "horse_best_times")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="馬・騎手の過去成績の特徴量ストアの操作")
+    parser.add_argument("--db", default=DEFAULT_FEATURE_STORE_PATH, help="特徴量ストア (SQLite) のパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_ingest = sub.add_parser("ingest", help="アーカイブの確定済みレースのうち未取り込みのものを集計に加える")
+    p_ingest.add_argument("--archive-db", default=archive_store.DEFAULT_ARCHIVE_PATH, help="アーカイブ (SQLite) のパス")
+    sub.add_parser("stats", help="集計済みの件数を表示する")
+    p_jockey = sub.add_parser("jockey", help="騎手の成績を表示する")
+    p_jockey.add_argument("names", nargs="+")
+    args = parser.parse_args(argv)
+
+    store = FeatureStore(args.db)
+    try:
+        if args.command == "ingest":
+            archive = archive_store.RaceArchive(args.archive_db)
+            try:
+                ingested = store.ingest(archive.latest_entries())
+            finally:
+                archive.close()
+            print(f"{ingested} レースを取り込みました: {args.db}")
+        elif args.command == "stats":
+            for table, count in store.counts().items():
+                print(f"{table:<18}{count:>8}")
+        else:
+            for name, (starts, wins, places) in store.jockey_stats(args.names).items():
+                print(f"{name}  {starts}戦{wins}勝  勝率 {wins / starts:.1%}  複勝率 {places / starts:.1%}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import fixtures
+import http_cache
+import instrumentation
+
+# ==========================================
+# HTTP取得レイヤー
+# - 共有セッションによるホスト単位の keep-alive 接続プール
+# - 5xx / タイムアウト時の指数バックオフ (ジッター付き) リトライ
+# - 同時接続数・ホスト単位のレート制御
+# - リクエストごとのレイテンシ・リトライ回数の記録
+# - ディスクキャッシュ (http_cache) による再取得の省略と条件付きリクエスト
+# - HTMLフィクスチャ (fixtures) への記録と、ネットワークを使わない再生
+# - 接続先の差し替え (負荷試験用のスタンドインサーバーなど)。URL は本番のまま扱い、送信時だけ接続先を置き換える
+# ==========================================
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5  # 秒。n回目のリトライ前に BACKOFF_BASE * 2**n + ジッター だけ待つ
+RETRY_STATUS = {429, 500, 502, 503, 504}
+NETKEIBA_BASE_URL = "https://race.netkeiba.com"
+KEIBALAB_BASE_URL = "https://www.keibalab.jp"
+
+
+class HostRateLimiter:
+    """ ホストごとにリクエスト間隔の下限を守らせる (netkeiba への負荷配慮) """
+
+    def __init__(self, requests_per_sec=None):
+        self.min_interval = 1.0 / requests_per_sec if requests_per_sec else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, host):
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _build_session(pool_size):
+    """ race.netkeiba.com / www.keibalab.jp などホストごとに接続を使い回すセッション """
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# 既定は逐次実行と同じ挙動 (制限なし)。並列モードでは configure() で上書きする
+_concurrency = threading.BoundedSemaphore(1024)
+_rate_limiter = HostRateLimiter()
+_session = _build_session(10)
+_max_retries = DEFAULT_RETRIES
+_cache = None
+_offline = False
+_record_dir = None
+_replay_dir = None
+_base_urls = {}
+
+_stats_lock = threading.Lock()
+_stats = []
+
+
+def configure(max_connections=None, host_rate=None, retries=None):
+    """ 全体の同時リクエスト数、ホスト単位のレート(req/sec)、リトライ回数を設定する """
+    global _concurrency, _rate_limiter, _session, _max_retries
+    if max_connections:
+        _concurrency = threading.BoundedSemaphore(max_connections)
+        _session = _build_session(max_connections)
+    _rate_limiter = HostRateLimiter(host_rate)
+    if retries is not None:
+        _max_retries = retries
+
+
+def enable_cache(cache_dir=http_cache.DEFAULT_CACHE_DIR, max_bytes=http_cache.DEFAULT_MAX_BYTES, offline=False):
+    """
+    ディスクキャッシュを有効にする。
+    offline=True の場合はネットワークに一切アクセスせず、TTL切れでもキャッシュから返す (デバッグ用の再実行)。
+    """
+    global _cache, _offline
+    _cache = http_cache.ResponseCache(cache_dir, max_bytes)
+    _offline = offline
+
+
+def enable_recording(fixture_dir=fixtures.DEFAULT_FIXTURE_DIR):
+    """ 以後取得したページをフィクスチャとして保存する """
+    global _record_dir
+    _record_dir = fixture_dir
+
+
+def enable_replay(fixture_dir=fixtures.DEFAULT_FIXTURE_DIR):
+    """ ネットワークの代わりにフィクスチャからページを返す (存在しないページは 404) """
+    global _replay_dir
+    _replay_dir = fixture_dir
+
+
+def configure_base_urls(netkeiba=None, keibalab=None):
+    """
+    netkeiba・競馬ラボへのリクエストの接続先を差し替える (例: "http://127.0.0.1:8765/netkeiba")。
+    キャッシュ・フィクスチャ・出力のURLは本番のまま。None の場合は本番に接続する。
+    """
+    global _base_urls
+    _base_urls = {canonical: base.rstrip('/') for canonical, base in
+                  ((NETKEIBA_BASE_URL, netkeiba), (KEIBALAB_BASE_URL, keibalab)) if base}
+
+
+def resolve_url(url):
+    """ 実際に接続するURL (configure_base_urls の差し替えを反映したもの) """
+    for canonical, base in _base_urls.items():
+        if url.startswith(canonical):
+            return base + url[len(canonical):]
+    return url
+
+
+def mark_final(url):
+    """ 以後変化しないページ (確定済みレースの結果など) を無期限キャッシュにする """
+    if _cache:
+        _cache.mark_final(url)
+
+
+def _record(url, status, elapsed, retries, size, error=None, cache=None):
+    stage, race = instrumentation.current_labels()
+    key = fixtures.fixture_key(url)
+    with _stats_lock:
+        _stats.append({
+            "url": url,
+            "page": key[0] if key else None,
+            "stage": stage,
+            "race": race,
+            "status": status,
+            "elapsed": round(elapsed, 3),
+            "retries": retries,
+            "bytes": size,
+            "error": error,
+            "cache": cache,
+        })
+
+
+def get_fetch_stats():
+    """ これまでのリクエストごとの記録 (url, page, stage, race, status, elapsed, retries, bytes, error, cache) を返す """
+    with _stats_lock:
+        return list(_stats)
+
+
+def take_fetch_stats():
+    """ これまでの記録を返して消去する (ワーカープロセスから親プロセスへ記録を送るため) """
+    global _stats
+    with _stats_lock:
+        stats, _stats = _stats, []
+    return stats
+
+
+def add_fetch_stats(stats):
+    """ 別プロセスで記録したリクエストの記録を加える """
+    with _stats_lock:
+        _stats.extend(stats)
+
+
+def summarize_fetch_stats():
+    stats = get_fetch_stats()
+    if not stats:
+        return "HTTPリクエストなし"
+    total_time = sum(s["elapsed"] for s in stats)
+    retries = sum(s["retries"] for s in stats)
+    failures = sum(1 for s in stats if s["error"])
+    cached = sum(1 for s in stats if s["cache"])
+    downloaded = sum(s["bytes"] for s in stats if s["cache"] != "hit")
+    slowest = max(stats, key=lambda s: s["elapsed"])
+    return (f"HTTP {len(stats)} 件 (キャッシュ利用 {cached} 件, 受信 {downloaded / 1024:.0f}KB) / 合計 {total_time:.1f}s"
+            f" / リトライ {retries} 回 / 失敗 {failures} 件 / 最遅 {slowest['elapsed']:.2f}s ({slowest['url']})")
+
+
+def _backoff(attempt):
+    return BACKOFF_BASE * (2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+
+
+def fetch(url, timeout=DEFAULT_TIMEOUT, ttl=None):
+    """
+    キャッシュ・レート制御・リトライ付きで1ページ取得する。
+    ttl (秒) を省略した場合は http_cache.PAGE_TTLS のページ種別ごとの値を使う。
+    5xx / 429 / タイムアウト / 接続エラーはバックオフしながら再試行し、
+    最後まで失敗した場合は例外を送出する (呼び出し側で該当データの取得失敗として扱う)。
+    """
+    if _replay_dir:
+        return _replay(url)
+    r = _fetch(url, timeout, ttl)
+    if _record_dir and r.status_code == 200:
+        fixtures.save_fixture(_record_dir, url, r.content)
+    return r
+
+
+def _replay(url):
+    started = time.monotonic()
+    content = fixtures.load_fixture(_replay_dir, url)
+    status = 200 if content is not None else 404
+    _record(url, status, time.monotonic() - started, 0, len(content or b''), cache="fixture")
+    return http_cache.build_response(url, {"content": content or b'', "content_type": 'text/html'}, status)
+
+
+def _fetch(url, timeout, ttl):
+    started = time.monotonic()
+    if ttl is None:
+        ttl = http_cache.ttl_for_url(url)
+    entry = _cache.lookup(url) if _cache else None
+    if entry and (entry["fresh"] or _offline):
+        _record(url, 200, time.monotonic() - started, 0, len(entry["content"]), cache="hit")
+        return http_cache.build_response(url, entry)
+    if _offline:
+        _record(url, None, time.monotonic() - started, 0, 0, error="offline")
+        raise requests.ConnectionError(f"オフラインモードでキャッシュに存在しません: {url}")
+
+    # 期限切れのキャッシュがあれば条件付きリクエストで再検証する
+    conditional = {}
+    if entry and entry["etag"]:
+        conditional['If-None-Match'] = entry["etag"]
+    if entry and entry["last_modified"]:
+        conditional['If-Modified-Since'] = entry["last_modified"]
+
+    target = resolve_url(url)
+    host = urlsplit(target).netloc
+    attempt = 0
+    while True:
+        try:
+            # 間隔待ちの間は接続枠を占有せず、枠は実際の通信の間だけ持つ
+            _rate_limiter.wait(host)
+            with _concurrency:
+                r = _session.get(target, timeout=timeout, headers=conditional)
+            if r.status_code == 304 and entry:
+                _cache.touch(url)
+                _record(url, 304, time.monotonic() - started, attempt, 0, cache="revalidated")
+                return http_cache.build_response(url, entry)
+            if r.status_code not in RETRY_STATUS:
+                _record(url, r.status_code, time.monotonic() - started, attempt, len(r.content))
+                if _cache and ttl and r.status_code == 200:
+                    _cache.store(url, r, ttl)
+                return r
+            if attempt >= _max_retries:
+                _record(url, r.status_code, time.monotonic() - started, attempt, len(r.content),
+                        error=f"HTTP {r.status_code}")
+                r.raise_for_status()
+        except (requests.Timeout, requests.ConnectionError) as e:
+            if attempt >= _max_retries:
+                _record(url, None, time.monotonic() - started, attempt, 0, error=type(e).__name__)
+                raise
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def prefetch(executor, url):
+    """
+    executor があればページ取得を先行投入し、結果を受け取る関数を返す。
+    executor が None の場合は呼び出し時点で同期取得する (逐次実行と同じ順序)。
+    """
+    if executor is None:
+        return lambda: fetch(url)
+    # 計測用の段階名・レースIDを取得スレッドに引き継ぐ
+    return executor.submit(instrumentation.wrap_context(fetch), url).result
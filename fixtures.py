@@ -0,0 +1,76 @@
+import glob
+import os
+import re
+
+# ==========================================
+# HTMLフィクスチャの記録・再生
+# 取得したページを fixtures/html/{ページ種別}_{キー}.html として保存し、
+# ネットワークなしでパーサーやモデルのベンチマーク・デバッグに再利用する
+# ==========================================
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'html')
+
+# URLパターン → ページ種別。上から順に判定する (shutuba_past は shutuba より先)
+FIXTURE_PATTERNS = [
+    (re.compile(r'race_list_sub\.html\?kaisai_date=(\d{8})'), 'race_list_sub'),
+    (re.compile(r'shutuba_past\.html\?race_id=(\d+)'), 'shutuba_past'),
+    (re.compile(r'shutuba\.html\?race_id=(\d+)'), 'shutuba'),
+    (re.compile(r'result\.html\?race_id=(\d+)'), 'result'),
+    (re.compile(r'mark_list\.html\?race_id=(\d+)'), 'mark_list'),
+    (re.compile(r'api_get_jra_odds\.html\?race_id=(\d+)&type=(\d+)'), 'odds'),
+    (re.compile(r'/db/race/(\d{8})/?$'), 'keibalab_list'),
+    (re.compile(r'/db/race/(\d{9,})/?'), 'keibalab'),
+]
+PAGE_TYPES = [page for _, page in FIXTURE_PATTERNS]
+
+
+def fixture_key(url):
+    """ URL から (ページ種別, キー) を返す。対象外のURLは None (キーが複数部分ならば '_' で連結する) """
+    for pattern, page in FIXTURE_PATTERNS:
+        m = pattern.search(url)
+        if m:
+            return page, '_'.join(m.groups())
+    return None
+
+
+def fixture_path(fixture_dir, page, key):
+    return os.path.join(fixture_dir, f"{page}_{key}.html")
+
+
+def save_fixture(fixture_dir, url, content):
+    """ 取得したページ本文 (バイト列) を保存する。対象外のURLは無視する """
+    key = fixture_key(url)
+    if not key:
+        return
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = fixture_path(fixture_dir, *key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def load_fixture(fixture_dir, url):
+    """ URL に対応するフィクスチャの本文を返す。存在しなければ None """
+    key = fixture_key(url)
+    if not key:
+        return None
+    try:
+        with open(fixture_path(fixture_dir, *key), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def list_fixtures(fixture_dir):
+    """ ページ種別 → {キー: パス} の辞書を返す """
+    found = {page: {} for page in PAGE_TYPES}
+    # 長いページ種別名から判定する (shutuba_past_ を shutuba_ と誤認しないため)
+    pages = sorted(PAGE_TYPES, key=len, reverse=True)
+    for path in sorted(glob.glob(os.path.join(fixture_dir, '*.html'))):
+        name = os.path.basename(path)[:-len('.html')]
+        for page in pages:
+            if name.startswith(page + '_'):
+                found[page][name[len(page) + 1:]] = path
+                break
+    return found
@@ -1,5 +1,7 @@
 ﻿document.addEventListener('DOMContentLoaded', () => {
-    let allRacesData = [];
+    let raceIndex = []; // index.json のレース要約 (詳細は選択時に races/{id}.json から読み込む)
+    const raceCache = new Map();
+    let selectedRaceId = null;
     let currentRaceData = null;
     let currentStrategy = 'strategy_a';
     // 要素の取得
@@ -15,18 +17,18 @@
 
     async function init() { // Renamed to loadData in snippet, but keeping original name as per instruction context
         try {
-            const response = await fetch('./data/data.json');
+            const response = await fetch('./data/index.json', { cache: 'no-cache' });
             if (!response.ok) throw new Error('Network error');
-            allRacesData = await response.json();
+            raceIndex = await response.json();
 
-            if (!allRacesData || allRacesData.length === 0) {
+            if (!raceIndex || raceIndex.length === 0) {
                 raceListEl.innerHTML = `<li class="race-item">データがありません</li>`;
                 raceDetailsEl.innerHTML = `<p>表示できるレースデータがありません。</p>`;
                 throw new Error('Data empty');
             }
 
             setupRaceSelector();
-            selectRace(0);
+            await selectRace(0);
 
             document.getElementById('calculate-btn').addEventListener('click', handleCalculate);
 
@@ -50,14 +52,14 @@
         raceListEl.innerHTML = '';
 
         // 日付順にソートしておく
-        allRacesData.sort((a, b) => a.race_info.date.localeCompare(b.race_info.date));
+        raceIndex.sort((a, b) => a.date.localeCompare(b.date));
 
         let currentDateGroup = null;
 
-        allRacesData.forEach((raceItem, index) => {
+        raceIndex.forEach((raceItem, index) => {
             // 日付が変わったらヘッダーを挿入
-            if (raceItem.race_info.date !== currentDateGroup) {
-                currentDateGroup = raceItem.race_info.date;
+            if (raceItem.date !== currentDateGroup) {
+                currentDateGroup = raceItem.date;
                 const headerLi = document.createElement('li');
                 headerLi.className = 'race-date-header';
                 headerLi.textContent = currentDateGroup;
@@ -69,12 +71,12 @@
             li.dataset.index = index;
 
             // 開催済みレースのバッジ
-            const statusBadge = raceItem.race_info.status === 'finished'
+            const statusBadge = raceItem.status === 'finished'
                 ? '<span style="font-size: 0.6rem; background: var(--text-muted); color: white; padding: 2px 6px; border-radius: 4px; margin-left: 8px; vertical-align: middle;">決着済み</span>'
                 : '';
 
             li.innerHTML = `
-                <div class="race-list-name">${raceItem.race_info.track} ${raceItem.race_info.distance} - ${raceItem.race_info.name} ${statusBadge}</div>
+                <div class="race-list-name">${raceItem.track} ${raceItem.distance} - ${raceItem.name} ${statusBadge}</div>
             `;
 
             li.addEventListener('click', () => {
@@ -89,8 +91,18 @@
         });
     }
 
-    function selectRace(index) {
-        currentRaceData = allRacesData[index];
+    async function loadRace(summary) {
+        // レース詳細は選択されたときに1回だけ取得する (hash が変わればブラウザキャッシュも無効になる)
+        if (!raceCache.has(summary.id)) {
+            const response = await fetch(`./data/races/${summary.id}.json?v=${summary.hash}`);
+            if (!response.ok) throw new Error('Network error');
+            raceCache.set(summary.id, await response.json());
+        }
+        return raceCache.get(summary.id);
+    }
+
+    async function selectRace(index) {
+        const summary = raceIndex[index];
 
         // Ensure the correct item is active visually (especially for initialization)
         const items = document.querySelectorAll('.race-item');
@@ -98,7 +110,22 @@
             items.forEach(el => el.classList.remove('active'));
             items[index].classList.add('active');
         }
-        if (!currentRaceData) return;
+        if (!summary) return;
+
+        selectedRaceId = summary.id;
+        currentRaceData = null;
+        raceDetailsEl.classList.add('loading');
+        let raceData;
+        try {
+            raceData = await loadRace(summary);
+        } catch (error) {
+            console.error('Fetch error:', error);
+            raceDetailsEl.innerHTML = `<span style="color:var(--danger)">レースデータの読み込みに失敗しました</span>`;
+            return;
+        }
+        // 読み込み中に別のレースが選択された場合は描画しない
+        if (selectedRaceId !== summary.id) return;
+        currentRaceData = raceData;
 
         allocationResultsEl.innerHTML = `<p style="color:var(--text-muted); font-size:0.875rem">予算を入力し、戦略を選択して計算ボタンを押してください。</p>`;
 
@@ -245,6 +272,28 @@
 
     function calculateAllocations(totalBudget, bets) {
         if (!bets || bets.length === 0) return [];
+        // 購入額 (stake) が計算済みの場合は、購入する買い目だけをその比率のまま予算に合わせて配分する
+        // (100円単位の最大剰余法。合計は予算を超えず、100円に満たない買い目は購入しない)
+        const staked = bets.filter(bet => bet.stake > 0);
+        if (staked.length > 0) {
+            const sumStake = staked.reduce((sum, bet) => sum + bet.stake, 0);
+            const units = Math.floor(totalBudget / 100);
+            const shares = staked.map(bet => units * bet.stake / sumStake);
+            const counts = shares.map(share => Math.floor(share));
+            let leftover = units - counts.reduce((sum, c) => sum + c, 0);
+            shares
+                .map((share, i) => ({ i: i, remainder: share - counts[i] }))
+                .sort((x, y) => y.remainder - x.remainder)
+                .forEach(({ i }) => {
+                    if (leftover > 0) {
+                        counts[i] += 1;
+                        leftover -= 1;
+                    }
+                });
+            return staked
+                .map((bet, i) => ({ ...bet, amount: counts[i] * 100, potentialReturn: Math.floor(counts[i] * 100 * bet.odds) }))
+                .filter(bet => bet.amount > 0);
+        }
         let sumInverseOdds = 0;
         bets.forEach((bet) => {
             // ケリー基準ベースの資金管理。オッズに対し期待値エッジが大きいものほど比重を置く
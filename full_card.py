@@ -0,0 +1,93 @@
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fetcher
+import instrumentation
+import race_shards
+
+# ==========================================
+# 全レース (フルカード) モードのプロセスプール実行
+# - 1開催日36レース×複数日を multiprocessing.Pool のワーカープロセスに1レースずつ割り当てる
+#   (パースとモデル計算は CPU を使うため、スレッドではなくプロセスで並列化する)
+# - maxtasksperchild でワーカーを一定レース数ごとに作り直し、パース木やキャッシュの蓄積でメモリが増え続けないようにする
+# - 結果は完了した順に1レースずつ親プロセスへ返し (imap_unordered)、親はレースの出力と計測記録だけを保持する
+# - 実行時間の上限 (cron の30分間隔に収まる値) を超えたら処理中のワーカーを止め、未完了のレースは前回出力で補う
+# ==========================================
+
+DEFAULT_PROCESSES = 4
+DEFAULT_TASKS_PER_CHILD = 8
+DEFAULT_TIME_BUDGET_MIN = 25.0  # 30分間隔の cron のうち、一覧取得と出力の時間を残した値
+
+# ワーカープロセスごとの共有状態 (_init_worker で1回だけ作る)
+_worker = None
+
+
+def _init_worker(args):
+    """ ワーカープロセスの初期化: 取得レイヤー・ページ取得用スレッドプール・共有オブジェクトを作る """
+    global _worker
+    # scraper は __main__ として実行されていることがあるため、ワーカー内で読み込む
+    import archive_store
+    import combo_odds
+    import feature_store
+    import keibalab
+    import scraper
+
+    processes = max(1, args.processes)
+    scraper.configure_fetcher(args)
+    # 同時接続数とホスト単位のレートはプロセス全体で元の値に収まるよう等分する
+    max_connections = max(2, args.max_connections // processes)
+    fetcher.configure(max_connections=max_connections, host_rate=args.host_rate / processes if args.host_rate else None,
+                      retries=args.retries)
+    page_executor = ThreadPoolExecutor(max_workers=max_connections)
+    _worker = {
+        "process_race": scraper.process_race,
+        "page_executor": page_executor,
+        "params": scraper.model_params_from_args(args),
+        "keibalab_index": keibalab.KeibaLabIndex(page_executor),
+        "live_odds": None if args.no_live_odds else combo_odds.LiveOdds(page_executor),
+        "odds_series": None if args.no_archive else archive_store.OddsSeries(args.archive_db),
+        "features": None if args.no_archive else feature_store.FeatureStore(args.feature_db),
+    }
+
+
+def _process_race(task):
+    """ 1レース分を処理し、(レース記述子, 出力, HTTPの記録, 段階の記録) を返す """
+    race, data_dir = task
+    w = _worker
+    try:
+        with instrumentation.stage("race", race["race_id"]):
+            # 差分更新では前回出力のうちこのレースのレース別データだけを読む
+            previous = race_shards.read_shard(data_dir, race["race_id"]) if data_dir else None
+            entry = w["process_race"](race["url"], race["date"], w["page_executor"], previous, w["odds_series"],
+                                      w["params"], w["keibalab_index"], live_odds=w["live_odds"],
+                                      features=w["features"])
+    except Exception as e:
+        print(f"[{race['race_id']}] 処理エラー: {e}")
+        entry = None
+    # 計測記録はレースごとに親へ送り、ワーカー側には溜めない
+    return race, entry, fetcher.take_fetch_stats(), instrumentation.take_records()
+
+
+def run_races(args, tasks):
+    """
+    tasks ((レース記述子, 前回出力のディレクトリ or None) のリスト) をプロセスプールで処理し、完了した順に (レース記述子, 出力) を返すジェネレータ。
+    ディレクトリを渡したレースは、ワーカーがそのレースのレース別データ (race_shards) だけを読んで差分更新する。
+    実行時間の上限を超えた時点で打ち切り、処理中のレースは返さない。
+    """
+    deadline = time.monotonic() + args.time_budget_min * 60
+    # fork は親のスレッド (ページ取得用プール) の状態を引き継ぐため spawn でワーカーを起動する
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.processes, initializer=_init_worker, initargs=(args,),
+                  maxtasksperchild=args.tasks_per_child) as pool:
+        results = pool.imap_unordered(_process_race, tasks)
+        for done in range(len(tasks)):
+            try:
+                race, entry, fetch_stats, records = results.next(timeout=max(0.0, deadline - time.monotonic()))
+            except multiprocessing.TimeoutError:
+                print(f"実行時間の上限 ({args.time_budget_min:g}分) に達したため {len(tasks) - done} レースの処理を打ち切ります。")
+                break
+            fetcher.add_fetch_stats(fetch_stats)
+            instrumentation.add_records(records)
+            yield race, entry
+    # with を抜けると Pool.terminate() で処理中のワーカーも停止する
@@ -0,0 +1,81 @@
+import re
+import time
+
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
+
+import instrumentation
+
+# ==========================================
+# HTMLパーサーのバックエンド切り替え
+# - lxml がインストールされていれば lxml、なければ標準の html.parser を使う
+# - ページ種別ごとに必要な部分木 (出馬表・結果表・払戻表・過去走) だけを構築する
+# ==========================================
+
+try:
+    import lxml  # noqa: F401
+    FAST_BACKEND = 'lxml'
+except ImportError:
+    FAST_BACKEND = None
+
+FALLBACK_BACKEND = 'html.parser'
+
+
+def _class_strainer(*class_names):
+    """
+    指定クラスを持つ要素の部分木だけを残す SoupStrainer。
+    パース時点の class 属性は 'Shutuba_Table Shutuba_Past5_Table' のような空白区切りの文字列のため正規表現で判定する
+    """
+    pattern = re.compile(r'(?:^|\s)(?:' + '|'.join(map(re.escape, class_names)) + r')(?:\s|$)')
+    return SoupStrainer(class_=pattern)
+
+
+# ページ種別 → 構築する部分木。None は文書全体
+SUBTREES = {
+    # .RaceName / .RaceData01 (レース情報) と .Shutuba_Table (出走馬)
+    'shutuba': lambda: _class_strainer('RaceName', 'RaceData01', 'Shutuba_Table'),
+    # td.Past を含む .Shutuba_Table
+    'shutuba_past': lambda: _class_strainer('Shutuba_Table'),
+    # #All_Result_Table と .Payout_Detail_Table はいずれも table 要素
+    'result': lambda: SoupStrainer('table'),
+    'mark_list': lambda: _class_strainer('YosoTableWrap'),
+}
+
+_backend = FAST_BACKEND or FALLBACK_BACKEND
+_use_subtrees = True
+
+
+def configure(backend=None, subtrees=True):
+    """ パーサーを明示的に切り替える (ベンチマーク比較用)。backend=None で自動選択 """
+    global _backend, _use_subtrees
+    _backend = backend or FAST_BACKEND or FALLBACK_BACKEND
+    _use_subtrees = subtrees
+
+
+def current_backend():
+    return _backend, _use_subtrees
+
+
+def make_soup(markup, page=None):
+    """ page にページ種別 (SUBTREES のキー) を渡すと必要な部分木のみをパースする """
+    strainer = SUBTREES[page]() if _use_subtrees and page in SUBTREES else None
+    started = time.perf_counter()
+    soup = BeautifulSoup(markup, _backend, parse_only=strainer)
+    instrumentation.record_parse(page, time.perf_counter() - started)
+    return soup
+
+
+def split_text_by_br(tag):
+    """
+    要素内のテキストを <br> 区切りのまとまりごとに返す。
+    HTML文字列を '<br/>' で分割して断片ごとに再パースする代わりに、子孫ノードを一度だけ走査する。
+    """
+    segments = []
+    current = []
+    for node in tag.descendants:
+        if getattr(node, 'name', None) == 'br':
+            segments.append(''.join(current))
+            current = []
+        elif type(node) is NavigableString:
+            current.append(str(node))
+    segments.append(''.join(current))
+    return segments
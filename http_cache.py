@@ -0,0 +1,163 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# ==========================================
+# HTTPレスポンスのディスクキャッシュ
+# - 本文は内容のハッシュ (sha256) をキーにした blob として保存し、URL → blob の対応を SQLite で管理する
+# - ページ種別ごとの TTL、ETag / Last-Modified による条件付き再検証
+# - 合計サイズの上限を超えたら最終アクセスが古いものから削除する (LRU)
+# ==========================================
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'http')
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+FOREVER = -1
+
+# URLに含まれる文字列 → TTL(秒)。上から順に判定する
+PAGE_TTLS = [
+    ('shutuba_past.html', 12 * 3600),   # 過去走は当日中に変わらない
+    ('result.html', 10 * 60),           # 確定後は mark_final() で無期限に切り替える
+    ('shutuba.html', 2 * 60),           # オッズ・馬体重が変わるため短め (常駐モードの発走直前の更新間隔に合わせる)
+    ('mark_list.html', 5 * 60),
+    ('api_get_jra_odds.html', 2 * 60),  # 組み合わせオッズ (shutuba.html と同じ間隔)
+    ('race_list_sub.html', 30 * 60),
+    ('keibalab.jp/db/race/', 60 * 60),
+]
+
+
+def ttl_for_url(url):
+    for pattern, ttl in PAGE_TTLS:
+        if pattern in url:
+            return ttl
+    return 0
+
+
+class ResponseCache:
+    """ URLをキーにしたレスポンスキャッシュ (スレッドセーフ) """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.max_bytes = max_bytes
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                blob TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                ttl INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)")
+        self._db.commit()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def lookup(self, url):
+        """ キャッシュ項目 (dict) を返す。本文が失われている場合は None """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT blob, content_type, etag, last_modified, fetched_at, ttl FROM entries WHERE url = ?",
+                (url,)).fetchone()
+            if not row:
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+        blob, content_type, etag, last_modified, fetched_at, ttl = row
+        try:
+            with open(self._blob_path(blob), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return {
+            "content": content,
+            "content_type": content_type,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": ttl == FOREVER or time.time() - fetched_at < ttl,
+        }
+
+    def store(self, url, response, ttl):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        now = time.time()
+        with self._lock:
+            prev = self._db.execute("SELECT ttl FROM entries WHERE url = ?", (url,)).fetchone()
+            if prev and prev[0] == FOREVER:
+                ttl = FOREVER
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, len(content), response.headers.get('Content-Type'),
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'), now, ttl, now))
+            self._db.commit()
+        self._evict_if_needed()
+
+    def touch(self, url):
+        """ 304 Not Modified で再検証できた項目の取得時刻を更新する """
+        with self._lock:
+            now = time.time()
+            self._db.execute("UPDATE entries SET fetched_at = ?, last_access = ? WHERE url = ?", (now, now, url))
+            self._db.commit()
+
+    def mark_final(self, url):
+        """ 確定済みレースの結果ページなど、以後変化しないページを無期限キャッシュにする """
+        with self._lock:
+            self._db.execute("UPDATE entries SET ttl = ? WHERE url = ?", (FOREVER, url))
+            self._db.commit()
+
+    def _evict_if_needed(self):
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # 上限の9割まで古い順に削除し、どのURLからも参照されなくなった blob を消す
+            target = self.max_bytes * 0.9
+            removed_blobs = set()
+            for url, blob, size in self._db.execute(
+                    "SELECT url, blob, size FROM entries ORDER BY last_access").fetchall():
+                if total <= target:
+                    break
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                removed_blobs.add(blob)
+                total -= size
+            for blob in removed_blobs:
+                still_used = self._db.execute("SELECT 1 FROM entries WHERE blob = ? LIMIT 1", (blob,)).fetchone()
+                if not still_used:
+                    try:
+                        os.remove(self._blob_path(blob))
+                    except FileNotFoundError:
+                        pass
+            self._db.commit()
+
+
+def build_response(url, entry, status_code=200):
+    """ キャッシュ項目から requests.Response 互換のオブジェクトを組み立てる """
+    r = Response()
+    r.status_code = status_code
+    r.url = url
+    r._content = entry["content"]
+    r.headers = CaseInsensitiveDict()
+    if entry["content_type"]:
+        r.headers['Content-Type'] = entry["content_type"]
+    r.encoding = get_encoding_from_headers(r.headers)
+    return r
@@ -0,0 +1,223 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==========================================
+# 実行時の計測 (段階別・レース別)
+# - stage() で囲んだ区間の所要時間を記録し、その区間内のHTTPリクエスト (fetcher) とHTMLパース (html_parsing)
+#   を段階名・レースIDに紐付けて集計する。段階名とレースIDは contextvars で先行取得スレッドにも引き継ぐ
+# - 任意で cProfile (メインスレッドのCPUプロファイル) と tracemalloc (メモリ確保の多い箇所) を併用する
+# - 集計結果は data.json と同じ場所に run_report.json として書き出す
+# ==========================================
+
+REPORT_FILENAME = 'run_report.json'
+PROFILE_TOP_N = 30
+
+_current = contextvars.ContextVar('instrumentation_stage', default=None)
+_lock = threading.Lock()
+_stages = []
+_parses = []
+_profiler = None
+_trace_memory = False
+
+
+def reset():
+    global _stages, _parses
+    with _lock:
+        _stages = []
+        _parses = []
+
+
+def current_labels():
+    """ 実行中の (段階名, レースID)。stage() の外では (None, None) """
+    rec = _current.get()
+    return (rec["stage"], rec["race"]) if rec else (None, None)
+
+
+@contextmanager
+def stage(name, race=None):
+    """ with stage("model", race_id): ... の区間を計測する。race を省略すると外側の stage のレースIDを引き継ぐ """
+    parent = _current.get()
+    rec = {"stage": name, "race": race or (parent["race"] if parent else None)}
+    token = _current.set(rec)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _current.reset(token)
+        with _lock:
+            _stages.append({"stage": name, "race": rec["race"], "elapsed": elapsed})
+
+
+def record_parse(page, elapsed):
+    """ html_parsing.make_soup から呼ばれ、パース時間を現在の段階に紐付けて記録する """
+    stage_name, race = current_labels()
+    with _lock:
+        _parses.append({"stage": stage_name, "race": race, "page": page or "html", "elapsed": elapsed})
+
+
+def take_records():
+    """ 段階・パースの記録を返して消去する (ワーカープロセスから親プロセスへ記録を送るため) """
+    global _stages, _parses
+    with _lock:
+        records = (_stages, _parses)
+        _stages, _parses = [], []
+    return records
+
+
+def add_records(records):
+    """ 別プロセスで take_records() した記録を加える """
+    stages, parses = records
+    with _lock:
+        _stages.extend(stages)
+        _parses.extend(parses)
+
+
+def wrap_context(fn):
+    """ 別スレッドで実行する関数に現在の段階名・レースIDを引き継ぐ (executor.map で同時に呼ばれても良いよう呼び出しごとに複製する) """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+
+def start_profiling(cpu=False, memory=False):
+    global _profiler, _trace_memory
+    if cpu:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    if memory:
+        _trace_memory = True
+        tracemalloc.start()
+
+
+def stop_profiling(profile_path=None):
+    """ プロファイルを停止し、レポートに含める要約を返す。profile_path があれば pstats 形式でも保存する """
+    global _profiler, _trace_memory
+    summary = {}
+    if _profiler is not None:
+        _profiler.disable()
+        if profile_path:
+            _profiler.dump_stats(profile_path)
+            summary["cpu_profile_path"] = profile_path
+        stream = io.StringIO()
+        stats = pstats.Stats(_profiler, stream=stream)
+        top = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in sorted(
+                stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_N]:
+            top.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "calls": nc,
+                "tottime_s": round(tt, 4),
+                "cumtime_s": round(ct, 4),
+            })
+        summary["cpu_top_cumulative"] = top
+        _profiler = None
+    if _trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        summary["memory"] = {
+            "current_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "top_allocations": [{"location": str(s.traceback[0]), "size_kb": round(s.size / 1024, 1), "count": s.count}
+                                for s in snapshot.statistics('lineno')[:PROFILE_TOP_N]],
+        }
+        _trace_memory = False
+    return summary
+
+
+def _http_bucket():
+    return {"requests": 0, "bytes": 0, "http_s": 0.0, "retries": 0, "errors": 0, "cache_hits": 0, "statuses": {}}
+
+
+def _add_http(bucket, s):
+    bucket["requests"] += 1
+    bucket["http_s"] += s["elapsed"]
+    bucket["retries"] += s["retries"]
+    if s["cache"] != "hit":
+        bucket["bytes"] += s["bytes"]
+    else:
+        bucket["cache_hits"] += 1
+    if s["error"]:
+        bucket["errors"] += 1
+    status = str(s["status"])
+    bucket["statuses"][status] = bucket["statuses"].get(status, 0) + 1
+
+
+def _rounded(bucket):
+    return {k: round(v, 4) if isinstance(v, float) else v for k, v in bucket.items()}
+
+
+def build_report(fetch_stats, wall_time, extra=None):
+    """ 段階別・レース別・ページ種別ごとの集計をまとめたレポート (dict) を返す """
+    with _lock:
+        stages, parses = list(_stages), list(_parses)
+
+    by_stage, by_race, by_page = {}, {}, {}
+
+    def stage_bucket(name):
+        return by_stage.setdefault(name or "(none)", {"calls": 0, "wall_s": 0.0, "parse_s": 0.0, **_http_bucket()})
+
+    def race_bucket(race):
+        return by_race.setdefault(race, {"wall_s": 0.0, "parse_s": 0.0, "stages": {}, **_http_bucket()})
+
+    def page_bucket(page):
+        return by_page.setdefault(page or "other", {"parse_s": 0.0, "parses": 0, **_http_bucket()})
+
+    for s in stages:
+        b = stage_bucket(s["stage"])
+        b["calls"] += 1
+        b["wall_s"] += s["elapsed"]
+        if s["race"]:
+            r = race_bucket(s["race"])
+            if s["stage"] == "race":
+                r["wall_s"] += s["elapsed"]
+            else:
+                r["stages"][s["stage"]] = round(r["stages"].get(s["stage"], 0.0) + s["elapsed"], 4)
+    for s in fetch_stats:
+        _add_http(stage_bucket(s.get("stage")), s)
+        _add_http(page_bucket(s.get("page")), s)
+        if s.get("race"):
+            _add_http(race_bucket(s["race"]), s)
+    for p in parses:
+        stage_bucket(p["stage"])["parse_s"] += p["elapsed"]
+        pb = page_bucket(p["page"])
+        pb["parse_s"] += p["elapsed"]
+        pb["parses"] += 1
+        if p["race"]:
+            race_bucket(p["race"])["parse_s"] += p["elapsed"]
+
+    totals = _http_bucket()
+    for s in fetch_stats:
+        _add_http(totals, s)
+    report = {
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "wall_s": round(wall_time, 3),
+        "http": _rounded(totals),
+        "parse_s": round(sum(p["elapsed"] for p in parses), 4),
+        "stages": {k: _rounded(v) for k, v in by_stage.items()},
+        "races": {k: _rounded(v) for k, v in by_race.items()},
+        "pages": {k: _rounded(v) for k, v in by_page.items()},
+        "slowest_requests": sorted(fetch_stats, key=lambda s: s["elapsed"], reverse=True)[:10],
+    }
+    if extra:
+        report.update(extra)
+    return report
+
+
+def write_report(path, report):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
@@ -0,0 +1,166 @@
+import re
+import threading
+
+import fetcher
+import instrumentation
+from fetcher import fetch
+from html_parsing import make_soup
+
+# ==========================================
+# 競馬ラボ連携 (上がり3Fの補完)
+# - 開催日ページ (/db/race/YYYYMMDD/) は開催日ごとに1回だけ取得し、(場コード, レース番号) → レースページURL の索引を作る
+#   (競馬ラボのレースIDは 開催日8桁 + 場コード2桁 + レース番号2桁 で、場コードは netkeiba の race_id[4:6] と共通)
+# - netkeiba の各レースは索引から対応ページを1件だけ取得し、出走馬名の一致で同一レースかを確認する
+# - 索引で見つからない場合のみ、未取得のレースページを並行取得して馬名 → ページの索引から探す
+# ==========================================
+
+BASE_URL = fetcher.KEIBALAB_BASE_URL
+MIN_NAME_MATCHES = 3  # 同一レースとみなす出走馬名の一致数
+LAB_RACE_KEY = re.compile(r'/db/race/\d{8}(\d{2})(\d{2})/?')
+
+
+def parse_keibalab_race_links(soup_lab, lab_date_str):
+    """ 競馬ラボの開催日ページから各レースページへのリンクを返す """
+    return [a['href'] for a in soup_lab.find_all('a', href=True) if f"/db/race/{lab_date_str}" in a['href'] and len(a['href'].split('/')) > 4]
+
+
+def parse_keibalab_horse_names(s_l):
+    """ 競馬ラボのレースページから出走馬名を掲載順に返す """
+    bamei_elements = s_l.select('.bamei')
+    lab_horses = []
+    for b_el in bamei_elements:
+        # aタグがあればそのテキスト、なければ自要素のテキスト
+        a_tag = b_el.find('a')
+        name = a_tag.text.strip() if a_tag else b_el.text.strip()
+        if name:
+            lab_horses.append(name)
+    return lab_horses
+
+
+def parse_keibalab_last_3f(s_l, lab_horses):
+    """ 競馬ラボのレースページの前走欄から 馬名 → 上がり3F (秒) を返す """
+    last_3f_by_name = {}
+    zensou_rows = s_l.select('.megamoriTable tr.zensou1')
+    for idx, z_row in enumerate(zensou_rows):
+        if idx < len(lab_horses):
+            horse_name = lab_horses[idx]
+            tds = z_row.find_all('td')
+            for td in tds:
+                text = td.text.strip().replace('\n', '')
+                match = re.search(r'([34]\d\.\d)[HMS]?(?:\d+kg)?', text[-15:])
+                if match and float(match.group(1)) > 30.0:
+                    last_3f_by_name[horse_name] = float(match.group(1))
+                    break
+    return last_3f_by_name
+
+
+def lab_date(race_date):
+    """ race_info["date"] ('2026-05-17') → 競馬ラボの開催日 ('20260517') """
+    return race_date.replace('-', '')
+
+
+def race_key(race_id):
+    """ netkeiba の race_id (YYYY 場 回 日 R) → (場コード, レース番号) """
+    race_id = race_id.split('&')[0]
+    return race_id[4:6], race_id[10:12]
+
+
+class KeibaLabIndex:
+    """
+    1回の実行の間、競馬ラボの開催日ページ・レースページの取得結果を共有する (スレッドセーフ)。
+    executor を渡すとレースページを netkeiba のページと並行して先行取得する。
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._date_locks = {}
+        self._listings = {}  # 開催日 → {(場コード, レース番号): URL}
+        self._pages = {}  # URL → {"names": [...], "last_3f": {馬名: 上がり3F}}
+        self._races_by_name = {}  # 馬名 → {URL}
+
+    def listing(self, date_str):
+        """ 開催日のレースページ索引を返す (開催日ごとに1回だけ取得する) """
+        with self._lock:
+            date_lock = self._date_locks.setdefault(date_str, threading.Lock())
+        with date_lock:
+            if date_str not in self._listings:
+                r_lab = fetch(f"{BASE_URL}/db/race/{date_str}/")
+                links = parse_keibalab_race_links(make_soup(r_lab.content), date_str)
+                index = {}
+                for link in links:
+                    m = LAB_RACE_KEY.search(link)
+                    if m:
+                        index.setdefault((m.group(1), m.group(2)), BASE_URL + m.group(0))
+                self._listings[date_str] = index
+            return self._listings[date_str]
+
+    def page(self, url):
+        """ レースページを取得・パースし、出走馬名と上がり3Fを返す (URLごとに1回だけ取得する) """
+        with self._lock:
+            if url in self._pages:
+                return self._pages[url]
+        s_l = make_soup(fetch(url).content)
+        names = parse_keibalab_horse_names(s_l)
+        parsed = {"names": names, "last_3f": parse_keibalab_last_3f(s_l, names)}
+        with self._lock:
+            self._pages[url] = parsed
+            for name in names:
+                self._races_by_name.setdefault(name, set()).add(url)
+        return parsed
+
+    def _load_race_page(self, race_id, race_date):
+        url = self.listing(lab_date(race_date)).get(race_key(race_id))
+        return (url, self.page(url)) if url else (None, None)
+
+    def prefetch(self, race_id, race_date):
+        """ netkeiba のレースに対応するレースページの取得を先行投入し、(URL, ページ) を返す関数を返す """
+        if self.executor is None:
+            return lambda: self._load_race_page(race_id, race_date)
+        return self.executor.submit(instrumentation.wrap_context(self._load_race_page), race_id, race_date).result
+
+    def _match_by_names(self, names, candidates):
+        """ 取得済みのレースページ (candidates 内) から出走馬名の一致数が最も多いものを返す """
+        votes = {}
+        with self._lock:
+            for name in names:
+                for url in self._races_by_name.get(name, ()):
+                    if url in candidates:
+                        votes[url] = votes.get(url, 0) + 1
+        if not votes:
+            return None
+        url, count = max(votes.items(), key=lambda item: item[1])
+        return url if count >= MIN_NAME_MATCHES else None
+
+    def resolve(self, race_info, horse_names, prefetched=None):
+        """ netkeiba のレースに対応するレースページ ({"names", "last_3f"}) を返す。見つからなければ None """
+        names = set(horse_names)
+        url, page = (prefetched or self.prefetch(race_info["id"], race_info["date"]))()
+        if page and len(names.intersection(page["names"])) >= MIN_NAME_MATCHES:
+            return page
+
+        # 場コード・レース番号で対応が取れない場合は、同じ開催日のレースページの馬名索引から探す
+        candidates = set(self.listing(lab_date(race_info["date"])).values())
+        url = self._match_by_names(names, candidates)
+        if url is None:
+            with self._lock:
+                pending = [u for u in candidates if u not in self._pages]
+            if self.executor is not None:
+                list(self.executor.map(instrumentation.wrap_context(self.page), pending))
+            else:
+                for u in pending:
+                    self.page(u)
+            url = self._match_by_names(names, candidates)
+        return self.page(url) if url else None
+
+    def merge_last_3f(self, race_info, horses_data, prefetched=None):
+        """ 競馬ラボの出馬表から直近の上がり3Fを取得し、horses_data (race_model.Runners) の表示用の上がり3Fにする """
+        try:
+            page = self.resolve(race_info, [h.name for h in horses_data], prefetched)
+            if page:
+                for name, last_3f in page["last_3f"].items():
+                    h = horses_data.by_name(name)
+                    if h is not None:
+                        h.lab_last_3f = last_3f
+        except Exception as e:
+            print(f"競馬ラボ連携エラー: {e}")
@@ -0,0 +1,54 @@
+import dataclasses
+from dataclasses import dataclass
+
+# ==========================================
+# 期待値モデル・買い目生成のパラメータ
+# これまで ev_engine / generate_portfolios に直書きしていた係数をまとめたもの。
+# 期待値モデルの既定値は従来の定数と同じで、パラメータ探索 (sweep.py) では replace() で一部を差し替えて使う。
+# ==========================================
+
+
+@dataclass(frozen=True)
+class ModelParams:
+    # --- 期待値モデル (ev_engine.score_races) ---
+    # 係数ウェイト (Ver 3.0): S_i = w1*T_i + w2*F_i + w3*C_i + w4*(1/R_i)*10 + w5*J_i + w6*W_i
+    w1: float = 0.20
+    w2: float = 0.25
+    w3: float = 0.30
+    w4: float = 0.15
+    w5: float = 0.05
+    w6: float = 0.05
+    tau: float = 1.5  # 温度パラメータ (Ver 3.1 修正: オッズに依存せず能力差が勝率に直結するようメリハリを強める)
+    theta: float = 1.5  # 環境バイアス合致の閾値
+    odds_cap: float = 50.0  # Ver 3.0: 期待値計算時のオッズ上限
+    missing_time_z: float = -0.5  # 持ち時計 (T_i) 欠損時のペナルティ
+    missing_last_3f_z: float = -0.5  # 上がり3F (F_i) 欠損時のペナルティ
+    # オッズ推移 (D_i = -log(現在のオッズ / 最初に記録したオッズ)、売れているほど正)。0 で無効
+    w_drift: float = 0.0
+
+    # --- 買い目生成 (scraper.generate_portfolios) ---
+    # 着順モデル (bet_probabilities): 2着・3着の強さは勝率の γ 乗 (Henery 型、1.0 で Harville モデル)
+    henery_gamma2: float = 0.81
+    henery_gamma3: float = 0.65
+    # 戦略A (単勝・複勝・ワイド): 推定オッズ・期待値 (的中確率 × 推定オッズ) の下限
+    safe_min_odds: float = 1.2  # トリガミ回避ライン
+    safe_min_ev: float = 1.0
+    # 戦略B (馬連・馬単・ワイド・3連複・3連単)
+    value_min_odds: float = 2.5
+    value_min_ev: float = 1.2
+    portfolio_size: int = 20  # 戦略ごとの最大点数 (フロントエンドは予算に応じて先頭から使う)
+    # 購入額 (stake_optimizer): 資金 × ケリー係数 × 最適賭け率 をレースごとの予算以内に収める
+    kelly_fraction: float = 0.25
+    bankroll: float = 100000.0
+    race_budget: float = 10000.0
+    max_hit_probability: float = 0.99
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+DEFAULT_PARAMS = ModelParams()
+PARAM_NAMES = [f.name for f in dataclasses.fields(ModelParams)]
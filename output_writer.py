@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import textwrap
+
+import archive_store
+import feature_store
+import race_shards
+
+# ==========================================
+# レースデータの逐次出力 (ストリーミング + アトミックな置き換え)
+# - 1レースの計算が終わるたびに write() でレース別シャード・アーカイブ・特徴量ストアへ書き出し、
+#   呼び出し側はレースデータを保持しない (レース数が増えてもメモリは一定)
+# - data.json は close() でシャードを1件ずつ読み直しながら一時ファイルに書き、内容が変わった場合だけ rename で置き換える
+#   (書式は json.dump(output_array, indent=2) と同じ)
+# - 途中で例外が起きた場合は data.json を前回のまま残し、書き出し済みのレースだけを index.json に反映する
+# ==========================================
+
+CHUNK_SIZE = 1 << 16
+
+
+def _file_hash(path):
+    """ ファイルの sha256 (存在しなければ None) """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+class OutputWriter:
+    """
+    with OutputWriter(...) as writer: writer.write(entry) ... の形で使う。
+    archive_path / feature_path を省略するとアーカイブ・特徴量ストアには書き込まない。
+    """
+
+    def __init__(self, data_dir, output_path, archive_path=None, export_dir=None, feature_path=None):
+        self.data_dir = data_dir
+        self.output_path = output_path
+        self.export_dir = export_dir
+        self.shards = race_shards.ShardWriter(data_dir)
+        self.archive = archive_store.RaceArchive(archive_path) if archive_path else None
+        self.features = feature_store.FeatureStore(feature_path) if feature_path else None
+        self.dates = set()
+        self.ingested = 0
+        self.count = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.closed:
+            if exc_type is not None:
+                # 書き出し済みのレースは残し、前回の data.json・他のレースのシャードには触れない
+                self.shards.close(prune=False)
+            self._close_stores()
+        return False
+
+    def write(self, entry):
+        """ 1レース分をシャード・アーカイブ・特徴量ストアへ書き出す """
+        self.shards.write(entry)
+        if self.archive is not None and self.archive.append(entry) is not None:
+            self.dates.add(entry["race_info"].get("date", ""))
+        if self.features is not None:
+            # 確定したレースの結果を1回だけ集計値に加える
+            self.ingested += self.features.ingest([entry])
+        self.count += 1
+
+    def close(self, order=None):
+        """
+        index.json と data.json を order (レースIDの並び。省略時は書き出した順) で書き出し、開催日別JSONを更新する。
+        data.json を書き直した場合は True を返す。
+        """
+        ids = self.shards.close(order)
+        changed = self._write_output_json(ids)
+        if self.archive is not None:
+            archive_store.export_dates(self.archive, self.export_dir, self.dates)
+        self._close_stores()
+        return changed
+
+    def _write_output_json(self, ids):
+        tmp_path = f"{self.output_path}.tmp"
+        digest = hashlib.sha256()
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            def emit(text):
+                f.write(text)
+                digest.update(text.encode('utf-8'))
+            emit('[')
+            written = 0
+            for race_id in ids:
+                entry = race_shards.read_shard(self.data_dir, race_id)
+                if entry is None:
+                    # 読めないシャードは null として書かずに飛ばす (フロントエンドはレースとして扱ってしまう)
+                    print(f"[{race_id}] レース別データを読み込めないため data.json から除外します")
+                    continue
+                emit((',\n' if written else '\n') + textwrap.indent(json.dumps(entry, ensure_ascii=False, indent=2), '  '))
+                written += 1
+            emit('\n]' if written else ']')
+        if digest.hexdigest() == _file_hash(self.output_path):
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, self.output_path)
+        return True
+
+    def _close_stores(self):
+        self.closed = True
+        if self.archive is not None:
+            self.archive.close()
+        if self.features is not None:
+            self.features.close()
@@ -0,0 +1,186 @@
+import re
+
+# ==========================================
+# 出走馬のデータモデル
+# - 出馬表・過去走ページのパース時に1回だけ型をそろえ (馬体重は int、増減は int、上がり3F は float。不明は 0 / None)、
+#   以後のモデル計算・買い目生成では文字列の判定をしない
+# - Horse は __slots__ で属性を固定し、1頭あたりのメモリを dict より小さくする (バックテストで大量のレースを保持するため)
+# - Runners は1レースの出走馬を並び順のリストと馬番・馬名の索引で持ち、馬の突合を線形探索せずに行う
+# - data.json 用の dict への変換 (to_dict) は従来の出力と同じ形 ("-" の欠損表記や増減の "+4" 表記) にする
+# ==========================================
+
+MISSING = "-"  # 出力上の欠損表記
+LAST_3F_PATTERN = re.compile(r'\d{2}\.\d')
+
+# 差分更新時に前回出力の "features" から引き継ぐ過去走由来の特徴量
+STABLE_FEATURE_KEYS = ("past_times", "recent_placements", "a_i", "last_3f")
+
+
+def parse_last_3f(value):
+    """ 上がり3F の表記 (33.5 / "33.5" / "-") → float。不明は None """
+    if isinstance(value, float):
+        return value
+    m = LAST_3F_PATTERN.search(value) if isinstance(value, str) else None
+    return float(m.group()) if m else None
+
+
+def format_weight_change(weight_change):
+    """ 馬体重の増減 (int) → 出力の表記 ("+4" / "-10" / "0"、不明は "-") """
+    if weight_change is None:
+        return MISSING
+    return f"{weight_change:+d}" if weight_change else "0"
+
+
+class Horse:
+    """
+    1頭分の入力 (出馬表・過去走・特徴量ストア・オッズ推移) とモデルの出力。
+    記録のない項目は None (馬体重は 0) とする。
+    """
+    __slots__ = (
+        # 出馬表
+        "frame", "number", "name", "jockey", "odds", "popularity", "weight", "weight_change",
+        # オッズ・人気が予想ページからも取れず仮の値で埋めたか (archive_store.OddsSeries に記録しない)
+        "odds_estimated", "popularity_estimated",
+        # 過去走 (STABLE_FEATURE_KEYS)
+        "past_times", "recent_placements", "a_i", "last_3f",
+        # オッズ推移 (archive_store.OddsSeries)・過去成績の集計値 (feature_store.FeatureStore)
+        "odds_drift", "jockey_win_rate", "jockey_place_rate", "jockey_course_place_rate",
+        "horse_place_rate", "horse_course_place_rate", "horse_best_time",
+        # モデルの出力
+        "win_probability", "expected_return", "score_si", "classification",
+        # 競馬ラボ由来の表示用の上がり3F (モデルの入力には使わない)
+        "lab_last_3f",
+    )
+
+    def __init__(self, number, name="不明", frame=0, jockey="不明", odds=0.0, popularity=0, weight=0,
+                 weight_change=None):
+        self.frame = frame
+        self.number = number
+        self.name = name
+        self.jockey = jockey
+        self.odds = odds
+        self.popularity = popularity
+        self.weight = weight
+        self.weight_change = weight_change
+        self.odds_estimated = False
+        self.popularity_estimated = False
+        self.past_times = None
+        self.recent_placements = None
+        self.a_i = None
+        self.last_3f = None
+        self.odds_drift = None
+        self.jockey_win_rate = None
+        self.jockey_place_rate = None
+        self.jockey_course_place_rate = None
+        self.horse_place_rate = None
+        self.horse_course_place_rate = None
+        self.horse_best_time = None
+        self.win_probability = None
+        self.expected_return = None
+        self.score_si = None
+        self.classification = None
+        self.lab_last_3f = None
+
+    def __repr__(self):
+        return f"Horse({self.number}, {self.name!r})"
+
+    @property
+    def display_weight(self):
+        """ 出力の馬体重 (不明は "-") """
+        return self.weight if self.weight > 0 else MISSING
+
+    @property
+    def display_weight_change(self):
+        return format_weight_change(self.weight_change)
+
+    @property
+    def display_last_3f(self):
+        """ 出力の上がり3F: 競馬ラボの値 (文字列) > 直近の過去走の値 > "-" """
+        if self.lab_last_3f is not None:
+            return f"{self.lab_last_3f:.1f}"
+        return self.last_3f if self.last_3f is not None else MISSING
+
+    def stable_features(self):
+        """ 差分更新で引き継ぐ過去走由来の特徴量 (出力の "features") """
+        features = {}
+        if self.past_times is not None:
+            features["past_times"] = self.past_times
+        if self.recent_placements is not None:
+            features["recent_placements"] = self.recent_placements
+        if self.a_i is not None:
+            features["a_i"] = self.a_i
+        features["last_3f"] = self.last_3f if self.last_3f is not None else MISSING
+        return features
+
+    def restore_features(self, features):
+        """ 前回出力の "features" を引き継ぐ """
+        if "past_times" in features:
+            self.past_times = features["past_times"]
+        if "recent_placements" in features:
+            self.recent_placements = features["recent_placements"]
+        if "a_i" in features:
+            self.a_i = features["a_i"]
+        if "last_3f" in features:
+            self.last_3f = parse_last_3f(features["last_3f"])
+
+    def to_dict(self):
+        """ data.json の出走馬 dict (archive_store.HORSE_COLUMNS の順 + "features") """
+        return {
+            "number": self.number,
+            "name": self.name,
+            "jockey": self.jockey,
+            "odds": self.odds,
+            "popularity": self.popularity,
+            "win_probability": self.win_probability,
+            "expected_return": self.expected_return,
+            "score_si": self.score_si,
+            "classification": self.classification,
+            "weight": self.display_weight,
+            "weight_change": self.display_weight_change,
+            "last_3f": self.display_last_3f,
+            "speed_index": MISSING,  # 有料データ
+            "condition_score": MISSING,  # 有料データ
+            "features": self.stable_features(),
+        }
+
+
+class Runners:
+    """
+    1レースの出走馬 (Horse) のリストと、馬番・馬名 → Horse の索引。
+    索引は追加時に作り、並べ替え (sort) では作り直さない。同じ馬番・馬名が重複する場合は先に追加した馬を引く。
+    """
+    __slots__ = ("horses", "_by_number", "_by_name")
+
+    def __init__(self, horses=()):
+        self.horses = []
+        self._by_number = {}
+        self._by_name = {}
+        for h in horses:
+            self.append(h)
+
+    def append(self, horse):
+        self.horses.append(horse)
+        self._by_number.setdefault(horse.number, horse)
+        self._by_name.setdefault(horse.name, horse)
+
+    def __len__(self):
+        return len(self.horses)
+
+    def __iter__(self):
+        return iter(self.horses)
+
+    def __getitem__(self, index):
+        return self.horses[index]
+
+    def by_number(self, number):
+        return self._by_number.get(number)
+
+    def by_name(self, name):
+        return self._by_name.get(name)
+
+    def sort(self, key, reverse=False):
+        self.horses.sort(key=key, reverse=reverse)
+
+    def to_output(self):
+        """ data.json の "horses" (並び順のまま) """
+        return [h.to_dict() for h in self.horses]
@@ -0,0 +1,113 @@
+import json
+import os
+
+from archive_store import content_hash, dumps_compact, normalize_race_id
+
+# ==========================================
+# フロントエンド向けのレース別出力 (シャード)
+# - {data_dir}/index.json にレース一覧の要約 (ID・レース名・開催日・状態・期待値上位の馬) だけを書き出し、
+#   出走馬・払戻・買い目を含む詳細は {data_dir}/races/{レースID}.json に1レース1ファイルで書き出す
+# - index.json に各シャードの内容ハッシュを持たせ、内容が変わったシャードだけを書き直す (一時ファイル + rename)
+# - シャードは1レースの計算が終わるたびに書き出し (ShardWriter)、index.json は最後にまとめて書き出す
+# - 一覧から外れたレースのシャードは削除する
+# ==========================================
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend', 'data')
+INDEX_FILENAME = 'index.json'
+SHARD_DIRNAME = 'races'
+TOP_PICKS = 3  # 要約に含める期待値上位の馬の数
+HASH_LENGTH = 12
+
+
+def race_summary(entry, digest):
+    """ index.json に載せるレースの要約 """
+    info = entry["race_info"]
+    picks = sorted(entry["horses"], key=lambda h: h["expected_return"], reverse=True)[:TOP_PICKS]
+    return {
+        "id": normalize_race_id(info["id"]),
+        "name": info["name"],
+        "date": info["date"],
+        "track": info.get("track"),
+        "distance": info.get("distance"),
+        "status": info.get("status", "upcoming"),
+        "hash": digest[:HASH_LENGTH],
+        "top_picks": [
+            {k: h.get(k) for k in ("number", "name", "odds", "expected_return", "classification")}
+            for h in picks
+        ],
+    }
+
+
+def load_index(data_dir=DEFAULT_DATA_DIR):
+    """ 前回書き出した index.json をレースID → 要約の辞書として返す """
+    try:
+        with open(os.path.join(data_dir, INDEX_FILENAME), encoding='utf-8') as f:
+            return {s["id"]: s for s in json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+        return {}
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def shard_path(data_dir, race_id):
+    return os.path.join(data_dir, SHARD_DIRNAME, f"{normalize_race_id(race_id)}.json")
+
+
+def read_shard(data_dir, race_id):
+    """ 書き出し済みのレース別データを読み込む。存在しなければ None """
+    try:
+        with open(shard_path(data_dir, race_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class ShardWriter:
+    """
+    レースデータを1レースずつ受け取り、レース別シャードを即座に書き出す (内容が前回と同じなら書かない)。
+    保持するのは要約だけで、close() で index.json の書き出しと一覧から外れたシャードの削除を行う。
+    """
+
+    def __init__(self, data_dir=DEFAULT_DATA_DIR):
+        self.data_dir = data_dir
+        self.shard_dir = os.path.join(data_dir, SHARD_DIRNAME)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.previous = load_index(data_dir)
+        self.summaries = {}
+        self.written = []
+
+    def write(self, entry):
+        """ 1レース分を書き出し (内容が変わった場合のみ)、レースIDを返す """
+        summary = race_summary(entry, content_hash(entry))
+        path = shard_path(self.data_dir, summary["id"])
+        prev = self.previous.get(summary["id"])
+        if prev is None or prev.get("hash") != summary["hash"] or not os.path.exists(path):
+            _write_atomic(path, dumps_compact(entry))
+            self.written.append(summary["id"])
+        self.summaries[summary["id"]] = summary
+        return summary["id"]
+
+    def close(self, order=None, prune=True):
+        """
+        index.json を order (レースIDの並び。省略時は書き出した順) で書き出す。
+        prune=False の場合 (途中で失敗した実行) は今回書き出さなかったレースも前回の要約のまま残し、シャードも削除しない。
+        """
+        ids = list(order) if order is not None else list(self.summaries)
+        summaries = [self.summaries[race_id] for race_id in ids if race_id in self.summaries]
+        if not prune:
+            summaries += [s for race_id, s in self.previous.items() if race_id not in self.summaries]
+        index_path = os.path.join(self.data_dir, INDEX_FILENAME)
+        if self.written or list(self.previous) != [s["id"] for s in summaries] or not os.path.exists(index_path):
+            _write_atomic(index_path, dumps_compact(summaries))
+        if prune:
+            # 一覧から外れたレースのシャードを削除する
+            current = {f"{s['id']}.json" for s in summaries}
+            for name in os.listdir(self.shard_dir):
+                if name.endswith('.json') and name not in current:
+                    os.remove(os.path.join(self.shard_dir, name))
+        return [s["id"] for s in summaries]
@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# ==========================================
+# 発走時刻に合わせた更新スケジューラ (scraper.py --daemon 用)
+# - レースごとの次回更新時刻を優先度付きキュー (heapq) で管理する
+# - 発走が近づくほどオッズ・馬体重の更新間隔を短くし、発走後は確定を待って結果ページを取得する
+# - 結果が確定したレースはキューから外し、以後は取得しない
+# ==========================================
+
+JST = ZoneInfo("Asia/Tokyo")
+
+# (発走までの残り時間の下限, 更新間隔)。上から順に判定する
+REFRESH_INTERVALS = [
+    (timedelta(hours=3), timedelta(minutes=60)),
+    (timedelta(hours=1), timedelta(minutes=30)),
+    (timedelta(minutes=30), timedelta(minutes=10)),
+    (timedelta(minutes=10), timedelta(minutes=5)),
+    (timedelta(0), timedelta(minutes=2)),
+]
+LAST_CALL = timedelta(minutes=1)  # 発走直前の最終更新 (発走の何分前か)
+UNKNOWN_POST_INTERVAL = timedelta(minutes=30)  # 発走時刻が分からないレースの更新間隔
+RESULT_DELAY = timedelta(minutes=15)  # 発走から確定までの目安
+RESULT_RETRY = timedelta(minutes=5)
+RESULT_GIVE_UP = timedelta(minutes=90)  # 発走からこの時間を過ぎても確定しなければ打ち切る
+
+# 更新の種類
+FULL = "full"  # 過去走を含む全ページの取得 (初回)
+ODDS = "odds"  # 出馬表 (オッズ・人気・馬体重) のみ
+RESULT = "result"  # 結果ページのみ
+
+
+def now_jst():
+    return datetime.now(JST)
+
+
+def post_time(race):
+    """ レース記述子の発走時刻 (JST の datetime)。不明な場合は None """
+    if not race.get("start_at"):
+        return None
+    return datetime.fromisoformat(race["start_at"]).replace(tzinfo=JST)
+
+
+def next_refresh(race, now):
+    """ 直前の更新を終えたレースの (次回更新時刻, 更新の種類) を返す。打ち切る場合は None """
+    start = post_time(race)
+    if start is None:
+        return now + UNKNOWN_POST_INTERVAL, ODDS
+    remaining = start - now
+    if remaining <= timedelta(0):
+        if remaining < -RESULT_GIVE_UP:
+            return None
+        return max(start + RESULT_DELAY, now + RESULT_RETRY), RESULT
+    for threshold, interval in REFRESH_INTERVALS:
+        if remaining >= threshold:
+            # 更新間隔が発走を跨ぐ場合は発走直前 (既に直前なら発走時刻) に合わせる
+            due = min(now + interval, start - LAST_CALL)
+            return (due if due > now else start), ODDS
+    return now + REFRESH_INTERVALS[-1][1], ODDS
+
+
+class RefreshScheduler:
+    """ (次回更新時刻, 発走時刻, 登録順) をキーにしたレースの優先度付きキュー """
+
+    def __init__(self, now_fn=now_jst):
+        self.now_fn = now_fn
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = threading.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, race, due, kind):
+        start = post_time(race) or due
+        heapq.heappush(self._heap, (due, start, next(self._counter), race, kind))
+
+    def reschedule(self, race, kind_done, finished):
+        """ 更新を終えたレースを次回の更新時刻で登録し直す。確定済み・打ち切りの場合は登録しない """
+        if finished:
+            return None
+        nxt = next_refresh(race, self.now_fn())
+        if nxt is None:
+            print(f"[{race['race_id']}] 発走から {int(RESULT_GIVE_UP.total_seconds() // 60)} 分を過ぎても確定しないため更新を終了します。")
+            return None
+        self.push(race, *nxt)
+        return nxt
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, deadline=None):
+        """
+        次の更新時刻まで待ち、その時点で更新時刻を過ぎているレースを [(レース記述子, 更新の種類)] で返す。
+        deadline を過ぎる場合は待たずに空のリストを返す。
+        """
+        if not self._heap:
+            return []
+        due = self._heap[0][0]
+        if deadline is not None and due > deadline:
+            return []
+        wait = (due - self.now_fn()).total_seconds()
+        if wait > 0:
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+        now = self.now_fn()
+        batch = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, _, race, kind = heapq.heappop(self._heap)
+            batch.append((race, kind))
+        return batch
+
+    def stop(self):
+        """ 待機中の pop_due を起こす """
+        self._wakeup.set()
@@ -1,9 +1,33 @@
+import argparse
 import json
 import os
 import re
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+
+import numpy as np
+
+import archive_store
+import bet_probabilities
+import combo_odds
+import discovery
+import ev_engine
+import feature_store
+import fetcher
+import full_card
+import http_cache
+import instrumentation
+import keibalab
+import output_writer
+import race_model
+import race_shards
+import scheduler
+import stake_optimizer
+from fetcher import fetch, prefetch
+from html_parsing import make_soup, split_text_by_br
+from model_params import DEFAULT_PARAMS
 
 # ==========================================
 # 競馬データ取得・期待値計算バッチスクリプト (実データ・スクレイピング版)
@@ -11,350 +35,350 @@ from datetime import datetime, timedelta
 
 FRONTEND_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend', 'data')
 OUTPUT_JSON_PATH = os.path.join(FRONTEND_DATA_DIR, 'data.json')
-HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
 
-def get_upcoming_race_urls():
-    """ 本日および明日のレース一覧から、重賞レース (G1~G3) のURLを取得する """
-    links = {}
+# 並列取得モードの既定値 (--workers 1 の場合は従来通りの逐次実行)
+DEFAULT_MAX_CONNECTIONS = 6
+DEFAULT_HOST_RATE = 4.0  # 1ホストあたりの最大リクエスト数/秒
+DEFAULT_DAEMON_MAX_HOURS = 5.5  # 常駐モードの最大実行時間 (GitHub Actions のジョブ上限 6 時間に収める)
+
+# 出馬表の馬体重 "480(+4)"
+WEIGHT_PATTERN = re.compile(r'(\d+)\s*(?:\(\s*([+-]?\d+)\s*\))?')
+
+def get_upcoming_races(start=None, end=None, executor=None, listing_cache=None, grades=discovery.GRADED):
+    """
+    start〜end (既定: 今日の前後2日) のレース一覧から、重賞レース (G1~G3) のレース記述子を取得する。
+    grades=None の場合は全レース (フルカード) を対象にする。
+    過去の開催日の一覧は listing_cache から読み、未取得の開催日は executor で並行取得する。
+    """
+    races = discovery.discover_races(start, end, executor, listing_cache, grades=grades)
+
+    if not races:
+        print(f"本日・翌日の{'重賞' if grades else ''}レースは見つかりませんでした。")
+
+    # Ocean Stakes (2/28) を手動で追加して日付グルーピングテスト用とする
+    ocean_s_url = f"{fetcher.NETKEIBA_BASE_URL}/race/shutuba.html?race_id=202606020111&rf=race_list"
+    if all(race["url"] != ocean_s_url for race in races):
+        races.append(discovery.race_descriptor(ocean_s_url, "2026-02-28", name="オーシャンS", grade="G3"))
+        print("[2026-02-28] オーシャンS をテスト用に追加しました。")
+
+    return races
+
+def parse_race_header(soup, race_url, race_date_str):
+    """ 出馬表ページからレース名・距離・天候・馬場を取り出す """
+    race_info = {"id": race_url.split('race_id=')[-1]}
     
-    # 0日後(今日)と1日後(明日)の両方をチェック
-    for day_offset in [-2, -1, 0, 1, 2]:
-        target_date = datetime.now() + timedelta(days=day_offset)
-        date_str_formatted = target_date.strftime('%Y-%m-%d')
-        date_str = target_date.strftime('%Y%m%d')
-        url = f"https://race.netkeiba.com/top/race_list_sub.html?kaisai_date={date_str}"
-        
-        try:
-            r = requests.get(url, headers=HEADERS, timeout=10)
-            soup = BeautifulSoup(r.content, 'html.parser')
+    race_name_el = soup.select_one('.RaceName')
+    race_name = race_name_el.text.strip() if race_name_el else "レース名不明"
+    
+    race_data1_el = soup.select_one('.RaceData01')
+    race_details = race_data1_el.text.strip().replace('\n', ' ') if race_data1_el else "詳細不明"
+    
+    # 開催地の簡易抽出 (例: 14:25発走 / 芝2400m (右) / 天候:晴 / 馬場:良)
+    # 実際にはHTML構造から細かく取る
+    distance_match = re.search(r'([芝ダ]\d+m)', race_details)
+    distance = distance_match.group(1) if distance_match else "距離不明"
+    
+    weather_match = re.search(r'天候:(\S+)', race_details)
+    weather = weather_match.group(1) if weather_match else "-"
+    
+    condition_match = re.search(r'馬場:(\S+)', race_details)
+    condition = condition_match.group(1) if condition_match else "-"
+
+    race_info.update({
+        "name": race_name,
+        "date": race_date_str, 
+        "track": "JRA",
+        "distance": distance,
+        "weather": weather,
+        "condition": condition,
+    })
+    return race_info
+
+def parse_race_result(res_soup):
+    """ 結果ページから (status, results) を返す。未確定の場合は ("upcoming", None) """
+    result_rows = res_soup.select('#All_Result_Table tr')
+    if len(result_rows) <= 1:
+        return "upcoming", None
+
+    top3 = []
+    for row in result_rows[1:4]:
+        tds = row.find_all('td')
+        if len(tds) > 10:
+            top3.append({
+                "rank": int(tds[0].text.strip()) if tds[0].text.strip().isdigit() else tds[0].text.strip(),
+                "number": int(tds[2].text.strip()),
+                "name": tds[3].text.strip(),
+                "popularity": int(tds[9].text.strip()) if tds[9].text.strip().isdigit() else tds[9].text.strip()
+            })
+    
+    payouts = {}
+    for table in res_soup.select('.Payout_Detail_Table'):
+        for tr in table.select('tr'):
+            th = tr.select_one('th')
+            if not th: continue
+            kind = th.text.strip()
+            td_res = tr.select_one('td.Result')
+            td_pay = tr.select_one('td.Payout')
             
-            day_links = []
-            for a in soup.find_all('a', href=True):
-                if 'shutuba.html' in a['href']:
-                    # 重賞アイコンクラスを持つ要素を探す (Icon_GradeType1: G1, Type2: G2, Type3: G3)
-                    parent = a.find_parent('li') or a.parent
-                    grade_icon = parent.select_one('.Icon_GradeType1, .Icon_GradeType2, .Icon_GradeType3')
+            if td_res and td_pay:
+                # 組み合わせ(馬連やワイド)の数字をパース
+                nums = []
+                # <ul>ごとにグループ化されている場合 (ワイドなど)
+                ul_elements = td_res.find_all('ul')
+                if ul_elements:
+                    for ul in ul_elements:
+                        # li をハイフンでつなぐ
+                        n = "-".join([li.text.strip() for li in ul.find_all('li') if li.text.strip()])
+                        if n: nums.append(n)
+                else:
+                    # div区切りの場合や単一行の場合をフォールバックとして処理
+                    for raw_n in split_text_by_br(td_res):
+                        n = "-".join(raw_n.split())
+                        if n: nums.append(n)
+                        
+                # 単独のテキストしかない場合 (単勝など)
+                if not nums:
+                    nums = ["-".join(td_res.text.strip().replace('\n', ' ').split())]
                     
-                    if grade_icon:
-                        full_url = a['href'] if a['href'].startswith('http') else "https://race.netkeiba.com" + a['href'].lstrip('..')
-                        if full_url not in links and full_url not in day_links:
-                            day_links.append(full_url)
-                            links[full_url] = date_str_formatted
-            
-            if day_links:
-                print(f"[{date_str}] の重賞レースを {len(day_links)} 件発見しました。")
+                # 配当金(円区切り)
+                pays = [p + "円" for p in td_pay.text.strip().split('円') if p.strip()]
                 
-        except Exception as e:
-            print(f"[{date_str}] レース一覧取得エラー: {e}")
-            
-    if not links:
-        print("本日・翌日の重賞レースは見つかりませんでした。")
+                payouts[kind] = {
+                    "numbers": ", ".join(nums),
+                    "payout": ", ".join(pays)
+                }
+                
+    return "finished", {
+        "top3": top3,
+        "payouts": payouts
+    }
+
+def parse_shutuba_horses(soup):
+    """ 出馬表の各行から枠・馬番・馬名・騎手・オッズ・人気・馬体重を取り出し、出走馬 (race_model.Runners) を返す """
+    raw_horses = race_model.Runners()
+    rows = soup.select('.Shutuba_Table tr.HorseList')
+    for row in rows:
+        tds = row.find_all('td')
+        if not tds or len(tds) < 10: continue
         
-    # Ocean Stakes (2/28) を手動で追加して日付グルーピングテスト用とする
-    ocean_s_url = "https://race.netkeiba.com/race/shutuba.html?race_id=202606020111&rf=race_list"
-    if ocean_s_url not in links:
-        links[ocean_s_url] = "2026-02-28"
-        print("[2026-02-28] オーシャンS をテスト用に追加しました。")
+        # 枠番 (tds[0])
+        frame_text = tds[0].text.strip()
+        frame = int(frame_text) if frame_text.isdigit() else 0
+        
+        # 馬番 (tds[1])
+        num_text = tds[1].text.strip()
+        if not num_text.isdigit():
+            continue
+        number = int(num_text)
+        
+        # 馬名 (tds[3])
+        name_el = tds[3].find('a')
+        name = name_el.text.strip() if name_el else tds[3].text.strip()
+        if not name: name = "不明"
+        
+        # 騎手 (tds[6])
+        jockey_el = tds[6].find('a')
+        jockey = jockey_el.text.strip() if jockey_el else tds[6].text.strip()
+        if not jockey: jockey = "不明"
+        
+        # オッズと人気順 (tds[9], tds[10])
+        odds_str = tds[9].text.strip()
+        pop_str = tds[10].text.strip() if len(tds) > 10 else "**"
+        
+        odds_base = 0.0
+        popularity = 0
+        try:
+            odds_base = float(odds_str)
+        except ValueError:
+            pass
+        
+        if pop_str.isdigit():
+            popularity = int(pop_str)
+
+        # 馬体重 (tds[8]): "480(+4)" → 480, +4。計不・増減なしなどの数値でない部分は不明 (0 / None) とする
+        weight_match = WEIGHT_PATTERN.match(tds[8].text.strip())
+        weight = int(weight_match.group(1)) if weight_match else 0
+        weight_change = int(weight_match.group(2)) if weight_match and weight_match.group(2) else None
         
-    return links
+        raw_horses.append(race_model.Horse(
+            number, name, frame=frame, jockey=jockey, odds=odds_base, popularity=popularity,
+            weight=weight, weight_change=weight_change,
+        ))
+    return raw_horses
+
+def parse_yoso_odds(sy):
+    """ 予想ページ (mark_list) から馬番順の予想単勝オッズと人気のリストを返す """
+    dls = sy.select('.YosoTableWrap dl')
+    
+    yoso_odds = []
+    yoso_pops = []
+    
+    for dl in dls:
+        dt = dl.find('dt')
+        if not dt: continue
+        text = dt.text.strip().replace('\n', '')
+        if "単勝オッズ" in text:
+            yoso_odds = [li.text.strip() for li in dl.find_all('li')]
+        elif "人気" == text:
+            yoso_pops = [li.text.strip() for li in dl.find_all('li')]
+    return yoso_odds, yoso_pops
 
-def scrape_race_data(race_url, race_date_str):
-    """ 個別の出馬表ページをスクレイピングする """
+def apply_yoso_odds(raw_horses, race_id):
+    """ リアルタイムオッズが不在の場合、予想ページ (mark_list) のオッズ・人気で補完する """
+    if not any(h.odds == 0.0 for h in raw_horses):
+        return
     try:
-        r = requests.get(race_url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(r.content, 'html.parser')
+        yoso_url = f"{fetcher.NETKEIBA_BASE_URL}/yoso/mark_list.html?race_id={race_id}"
+        ry = fetch(yoso_url)
+        yoso_odds, yoso_pops = parse_yoso_odds(make_soup(ry.content, 'mark_list'))
+                
+        for i, h in enumerate(raw_horses):
+            if h.odds == 0.0:
+                try:
+                    # 予想オッズを適用
+                    h.odds = float(yoso_odds[i])
+                except:
+                    # 取得できなかった場合のフォールバック（現実離れを防ぐためハッシュ値などで分散）
+                    # 実際のオッズではないため、オッズの時系列には記録しない
+                    h.odds = round(10.0 + (len(h.name) * h.number % 20), 1)
+                    h.odds_estimated = True
+            if h.popularity == 0:
+                try:
+                    h.popularity = int(yoso_pops[i])
+                except:
+                    h.popularity = h.number
+                    h.popularity_estimated = True
+    except Exception as e:
+        print(f"予想オッズ取得エラー: {e}")
+
+def parse_past_performance(sp, raw_horses):
+    """ shutuba_past ページから各馬の直近着順・持ち時計・クラス実績(A_i)・上がり3Fを取り出して raw_horses (Runners) に反映する """
+    p_rows = sp.select('.Shutuba_Table tr.HorseList')
+    
+    # 各馬ごとに最新の上がり3Fを抽出
+    for p_row in p_rows:
+        tds = p_row.find_all('td')
+        if not tds or len(tds) < 4: continue
         
-        # レース情報
-        race_info = {"id": race_url.split('race_id=')[-1]}
+        # 馬番で突合
+        num_text = tds[1].text.strip()
+        if not num_text.isdigit(): continue
+        horse_num = int(num_text)
         
-        race_name_el = soup.select_one('.RaceName')
-        race_name = race_name_el.text.strip() if race_name_el else "レース名不明"
+        target_horse = raw_horses.by_number(horse_num)
+        if not target_horse: continue
         
-        race_data1_el = soup.select_one('.RaceData01')
-        race_details = race_data1_el.text.strip().replace('\n', ' ') if race_data1_el else "詳細不明"
+        # --- 過去走データ (上がり3F, 着順, 持ち時計) の抽出 ---
+        past_tds = p_row.select('td.Past')
+        placements = []
+        past_times = []
+        highest_class_score = 0.0 # A_i用
         
-        # 開催地の簡易抽出 (例: 14:25発走 / 芝2400m (右) / 天候:晴 / 馬場:良)
-        # 実際にはHTML構造から細かく取る
-        distance_match = re.search(r'([芝ダ]\d+m)', race_details)
-        distance = distance_match.group(1) if distance_match else "距離不明"
+        for past in past_tds:
+            # 着順の取得 (R_i 用)
+            num_span = past.select_one('.Data01 .Num')
+            if num_span and num_span.text.strip().isdigit():
+                placements.append(int(num_span.text.strip()))
+            
+            # 走破タイムと距離の取得 (T_i 用)
+            data05 = past.select_one('.Data05')
+            if data05:
+                text05 = data05.text
+                time_match = re.search(r'(\d{1,2}):(\d{2}\.\d)', text05)
+                dist_match = re.search(r'([芝ダ])(\d+)m?', text05)
+                if time_match and dist_match:
+                    mins = int(time_match.group(1))
+                    secs = float(time_match.group(2))
+                    total_seconds = (mins * 60) + secs
+                    past_distance = int(dist_match.group(2))
+                    past_times.append({
+                        "surface": dist_match.group(1),
+                        "distance": past_distance,
+                        "time_sec": total_seconds
+                    })
+                    
+            # 過去のクラス取得 (A_i 用)
+            data02 = past.select_one('.Data02')
+            if data02:
+                race_name = data02.text
+                if "GI" in race_name and "GIII" not in race_name and "GII" not in race_name:
+                    highest_class_score = max(highest_class_score, 0.8)
+                elif "GII" in race_name or "GIII" in race_name:
+                    highest_class_score = max(highest_class_score, 0.5)
+                elif "OP" in race_name or "L" in race_name:
+                    highest_class_score = max(highest_class_score, 0.3)
+                    
+        # 直近3走の着順を保存
+        if placements:
+            target_horse.recent_placements = placements[:3]
         
-        weather_match = re.search(r'天候:(\S+)', race_details)
-        weather = weather_match.group(1) if weather_match else "-"
+        # 持ち時計情報の保存
+        if past_times:
+            target_horse.past_times = past_times
+            
+        # 基礎能力値(A_i)の保存
+        target_horse.a_i = highest_class_score
+
+        # 最新の上がり3Fを取得
+        if past_tds:
+            latest_past = past_tds[0]
+            data06 = latest_past.select_one('.Data06')
+            if data06:
+                f3_match = re.search(r'\((\d{2}\.\d)\)', data06.text)
+                if f3_match:
+                    target_horse.last_3f = float(f3_match.group(1))
+
+def scrape_race_data(race_url, race_date_str, executor=None):
+    """
+    個別の出馬表ページをスクレイピングする
+    executor を渡すと結果ページ・過去走ページを出馬表と並行して先行取得する。
+    """
+    try:
+        result_url = race_url.replace('shutuba.html', 'result.html')
+        past_url = race_url.replace('shutuba.html', 'shutuba_past.html')
+        get_result_page = prefetch(executor, result_url)
+        get_past_page = prefetch(executor, past_url)
+
+        r = fetch(race_url)
+        soup = make_soup(r.content, 'shutuba')
         
-        condition_match = re.search(r'馬場:(\S+)', race_details)
-        condition = condition_match.group(1) if condition_match else "-"
+        # レース情報
+        race_info = parse_race_header(soup, race_url, race_date_str)
         
         # 結果ページを試行して取得
-        result_url = race_url.replace('shutuba.html', 'result.html')
         race_status = "upcoming"
         race_results = None
         
         try:
-            res_r = requests.get(result_url, headers=HEADERS, timeout=10)
-            res_soup = BeautifulSoup(res_r.content, 'html.parser')
-            result_rows = res_soup.select('#All_Result_Table tr')
-            
-            if len(result_rows) > 1:
-                race_status = "finished"
-                top3 = []
-                for row in result_rows[1:4]:
-                    tds = row.find_all('td')
-                    if len(tds) > 10:
-                        top3.append({
-                            "rank": int(tds[0].text.strip()) if tds[0].text.strip().isdigit() else tds[0].text.strip(),
-                            "number": int(tds[2].text.strip()),
-                            "name": tds[3].text.strip(),
-                            "popularity": int(tds[9].text.strip()) if tds[9].text.strip().isdigit() else tds[9].text.strip()
-                        })
-                
-                payouts = {}
-                for table in res_soup.select('.Payout_Detail_Table'):
-                    for tr in table.select('tr'):
-                        th = tr.select_one('th')
-                        if not th: continue
-                        kind = th.text.strip()
-                        td_res = tr.select_one('td.Result')
-                        td_pay = tr.select_one('td.Payout')
-                        
-                        if td_res and td_pay:
-                            # 組み合わせ(馬連やワイド)の数字をパース
-                            nums = []
-                            # <ul>ごとにグループ化されている場合 (ワイドなど)
-                            ul_elements = td_res.find_all('ul')
-                            if ul_elements:
-                                for ul in ul_elements:
-                                    # li をハイフンでつなぐ
-                                    n = "-".join([li.text.strip() for li in ul.find_all('li') if li.text.strip()])
-                                    if n: nums.append(n)
-                            else:
-                                # div区切りの場合や単一行の場合をフォールバックとして処理
-                                for span_block in str(td_res).split('<br/>'):
-                                    raw_n = BeautifulSoup(span_block, 'html.parser').text.strip()
-                                    n = "-".join(raw_n.split())
-                                    if n: nums.append(n)
-                                    
-                            # 単独のテキストしかない場合 (単勝など)
-                            if not nums:
-                                nums = ["-".join(td_res.text.strip().replace('\n', ' ').split())]
-                                
-                            # 配当金(円区切り)
-                            pays = [p + "円" for p in td_pay.text.strip().split('円') if p.strip()]
-                            
-                            payouts[kind] = {
-                                "numbers": ", ".join(nums),
-                                "payout": ", ".join(pays)
-                            }
-                            
-                race_results = {
-                    "top3": top3,
-                    "payouts": payouts
-                }
+            res_r = get_result_page()
+            res_soup = make_soup(res_r.content, 'result')
+            race_status, race_results = parse_race_result(res_soup)
+            if race_status == "finished":
+                # 確定済みの結果ページは以後変化しないため無期限キャッシュにする
+                fetcher.mark_final(result_url)
         except Exception as e:
             print(f"結果取得エラー: {e}")
 
-        # 不要な再代入を避け、取得した情報を個別にアップデートする
         race_info.update({
-            "name": race_name,
-            "date": race_date_str, 
-            "track": "JRA",
-            "distance": distance,
-            "weather": weather,
-            "condition": condition,
             "status": race_status,
             "results": race_results
         })
         
         # 出走馬情報
-        raw_horses = []
-        rows = soup.select('.Shutuba_Table tr.HorseList')
-        for row in rows:
-            tds = row.find_all('td')
-            if not tds or len(tds) < 10: continue
-            
-            # 枠番 (tds[0])
-            frame_text = tds[0].text.strip()
-            frame = int(frame_text) if frame_text.isdigit() else 0
-            
-            # 馬番 (tds[1])
-            num_text = tds[1].text.strip()
-            if not num_text.isdigit():
-                continue
-            number = int(num_text)
-            
-            # 馬名 (tds[3])
-            name_el = tds[3].find('a')
-            name = name_el.text.strip() if name_el else tds[3].text.strip()
-            if not name: name = "不明"
-            
-            # 騎手 (tds[6])
-            jockey_el = tds[6].find('a')
-            jockey = jockey_el.text.strip() if jockey_el else tds[6].text.strip()
-            if not jockey: jockey = "不明"
-            
-            # オッズと人気順 (tds[9], tds[10])
-            odds_str = tds[9].text.strip()
-            pop_str = tds[10].text.strip() if len(tds) > 10 else "**"
-            
-            odds_base = 0.0
-            popularity = 0
-            try:
-                odds_base = float(odds_str)
-            except ValueError:
-                pass
-            
-            if pop_str.isdigit():
-                popularity = int(pop_str)
-
-            # 馬体重 (tds[8])
-            weight_text = tds[8].text.strip()
-            
-            weight = 0
-            weight_change = "-"
-            if '(' in weight_text:
-                parts = weight_text.split('(')
-                try:
-                    weight = int(parts[0])
-                    weight_change = parts[1].replace(')', '')
-                    if not weight_change.startswith('-') and weight_change != '0':
-                        weight_change = '+' + weight_change
-                except:
-                    pass
-            elif weight_text.isdigit():
-                weight = int(weight_text)
-            
-            raw_horses.append({
-                "frame": frame,
-                "number": number,
-                "name": name,
-                "jockey": jockey,
-                "odds_base": odds_base,
-                "popularity": popularity,
-                "weight": weight if weight > 0 else "-",
-                "weight_change": weight_change,
-                "last_3f": "-", # 過去のレース結果ではないので取得不可
-                "speed_index": "-", # 有料データ
-                "condition_score": "-", # 有料データ
-            })
+        raw_horses = parse_shutuba_horses(soup)
             
         # リアルタイムオッズが不在の場合、予想ページから取得する
-        if any(h["odds_base"] == 0.0 for h in raw_horses):
-            try:
-                yoso_url = f"https://race.netkeiba.com/yoso/mark_list.html?race_id={race_info['id']}"
-                ry = requests.get(yoso_url, headers=HEADERS, timeout=10)
-                sy = BeautifulSoup(ry.content, 'html.parser')
-                dls = sy.select('.YosoTableWrap dl')
-                
-                yoso_odds = []
-                yoso_pops = []
-                
-                for dl in dls:
-                    dt = dl.find('dt')
-                    if not dt: continue
-                    text = dt.text.strip().replace('\n', '')
-                    if "単勝オッズ" in text:
-                        yoso_odds = [li.text.strip() for li in dl.find_all('li')]
-                    elif "人気" == text:
-                        yoso_pops = [li.text.strip() for li in dl.find_all('li')]
-                        
-                for i, h in enumerate(raw_horses):
-                    if h["odds_base"] == 0.0:
-                        try:
-                            # 予想オッズを適用
-                            h["odds_base"] = float(yoso_odds[i])
-                        except:
-                            # 取得できなかった場合のフォールバック（現実離れを防ぐためハッシュ値などで分散）
-                            h["odds_base"] = round(10.0 + (len(h["name"]) * h["number"] % 20), 1)
-                    if h["popularity"] == 0:
-                        try:
-                            h["popularity"] = int(yoso_pops[i])
-                        except:
-                            h["popularity"] = h["number"]
-            except Exception as e:
-                print(f"予想オッズ取得エラー: {e}")
+        apply_yoso_odds(raw_horses, race_info['id'])
 
         # 予想オッズ等の取得後、過去の成績（上がり3F等）を取得するため shutuba_past もフェッチする
         try:
-            past_url = race_url.replace('shutuba.html', 'shutuba_past.html')
-            rp = requests.get(past_url, headers=HEADERS, timeout=10)
+            rp = get_past_page()
             rp.encoding = 'euc-jp'
-            sp = BeautifulSoup(rp.text, 'html.parser')
-            
-            p_rows = sp.select('.Shutuba_Table tr.HorseList')
+            sp = make_soup(rp.text, 'shutuba_past')
+            parse_past_performance(sp, raw_horses)
             
-            # 各馬ごとに最新の上がり3Fを抽出
-            for p_row in p_rows:
-                tds = p_row.find_all('td')
-                if not tds or len(tds) < 4: continue
-                
-                # 馬番で突合
-                num_text = tds[1].text.strip()
-                if not num_text.isdigit(): continue
-                horse_num = int(num_text)
-                
-                target_horse = next((h for h in raw_horses if h["number"] == horse_num), None)
-                if not target_horse: continue
-                
-                # --- 過去走データ (上がり3F, 着順, 持ち時計) の抽出 ---
-                past_tds = p_row.select('td.Past')
-                placements = []
-                past_times = []
-                highest_class_score = 0.0 # A_i用
-                
-                for past in past_tds:
-                    # 着順の取得 (R_i 用)
-                    num_span = past.select_one('.Data01 .Num')
-                    if num_span and num_span.text.strip().isdigit():
-                        placements.append(int(num_span.text.strip()))
-                    
-                    # 走破タイムと距離の取得 (T_i 用)
-                    data05 = past.select_one('.Data05')
-                    if data05:
-                        text05 = data05.text
-                        time_match = re.search(r'(\d{1,2}):(\d{2}\.\d)', text05)
-                        dist_match = re.search(r'([芝ダ])(\d+)m?', text05)
-                        if time_match and dist_match:
-                            mins = int(time_match.group(1))
-                            secs = float(time_match.group(2))
-                            total_seconds = (mins * 60) + secs
-                            past_distance = int(dist_match.group(2))
-                            past_times.append({
-                                "distance": past_distance,
-                                "time_sec": total_seconds
-                            })
-                            
-                    # 過去のクラス取得 (A_i 用)
-                    data02 = past.select_one('.Data02')
-                    if data02:
-                        race_name = data02.text
-                        if "GI" in race_name and "GIII" not in race_name and "GII" not in race_name:
-                            highest_class_score = max(highest_class_score, 0.8)
-                        elif "GII" in race_name or "GIII" in race_name:
-                            highest_class_score = max(highest_class_score, 0.5)
-                        elif "OP" in race_name or "L" in race_name:
-                            highest_class_score = max(highest_class_score, 0.3)
-                            
-                # 直近3走の着順を保存
-                if placements:
-                    target_horse["recent_placements"] = placements[:3]
-                
-                # 持ち時計情報の保存
-                if past_times:
-                    target_horse["past_times"] = past_times
-                    
-                # 基礎能力値(A_i)の保存
-                target_horse["a_i"] = highest_class_score
-
-                # 最新の上がり3Fを取得
-                if past_tds:
-                    latest_past = past_tds[0]
-                    data06 = latest_past.select_one('.Data06')
-                    if data06:
-                        f3_match = re.search(r'\((\d{2}\.\d)\)', data06.text)
-                        if f3_match:
-                            target_horse["last_3f"] = float(f3_match.group(1))
-                            
             # 全馬の過去データ取得に成功したフラグをrace_infoに持たせる
-            race_info["has_past_data"] = sum(1 for h in raw_horses if "recent_placements" in h) > 0
+            race_info["has_past_data"] = any(h.recent_placements is not None for h in raw_horses)
             
         except Exception as e:
             print(f"過去走データ取得エラー: {e}")
@@ -364,392 +388,584 @@ def scrape_race_data(race_url, race_date_str):
         print(f"レースデータ取得エラー ({race_url}): {e}")
         return None, None
 
-import math
+def refresh_race_data(race_url, race_date_str, previous, executor=None, fetch_result=True):
+    """
+    差分更新用: 出馬表 (オッズ・人気・馬体重) と結果ページのみを取得し、
+    過去走由来の安定した特徴量 (past_times, recent_placements, a_i, last_3f) は前回出力から引き継ぐ。
+    fetch_result=False の場合は結果ページを取得せず、前回の状態を引き継ぐ (発走前の定期更新用)。
+    """
+    try:
+        result_url = race_url.replace('shutuba.html', 'result.html')
+        get_result_page = prefetch(executor, result_url) if fetch_result else None
+
+        r = fetch(race_url)
+        soup = make_soup(r.content, 'shutuba')
+        race_info = parse_race_header(soup, race_url, race_date_str)
+
+        race_status = previous["race_info"].get("status", "upcoming")
+        race_results = previous["race_info"].get("results")
+        if get_result_page is not None:
+            try:
+                res_soup = make_soup(get_result_page().content, 'result')
+                race_status, race_results = parse_race_result(res_soup)
+                if race_status == "finished":
+                    fetcher.mark_final(result_url)
+            except Exception as e:
+                race_status, race_results = "upcoming", None
+                print(f"結果取得エラー: {e}")
+
+        race_info.update({
+            "status": race_status,
+            "results": race_results
+        })
+        if "has_past_data" in previous["race_info"]:
+            race_info["has_past_data"] = previous["race_info"]["has_past_data"]
+
+        raw_horses = parse_shutuba_horses(soup)
+        apply_yoso_odds(raw_horses, race_info['id'])
+
+        for prev in previous["horses"]:
+            h = raw_horses.by_number(prev["number"])
+            if h is not None and prev["name"] == h.name:
+                h.restore_features(prev.get("features", {}))
+        return race_info, raw_horses
+    except Exception as e:
+        print(f"レースデータ取得エラー ({race_url}): {e}")
+        return None, None
+
+def refresh_race_result(entry, race_url):
+    """ 結果ページのみを取得し、確定していれば entry の race_info を更新する。確定したかどうかを返す """
+    result_url = race_url.replace('shutuba.html', 'result.html')
+    try:
+        race_status, race_results = parse_race_result(make_soup(fetch(result_url).content, 'result'))
+    except Exception as e:
+        print(f"結果取得エラー: {e}")
+        return False
+    if race_status != "finished":
+        return False
+    fetcher.mark_final(result_url)
+    entry["race_info"].update({"status": race_status, "results": race_results})
+    return True
 
-def calculate_expected_values(raw_horses, race_info):
+def calculate_expected_values(raw_horses, race_info, params=None):
     """
     期待値（EV）算出モデル Ver 2.0
     各馬のファクターを正規化（Zスコア化）またはスコア化し、ウェイトを掛けて総合期待値スコア(S_i)を算出する。
     $$S_i = w_1(T_i) + w_2(F_i) + w_3 C_i + w_4(1/R_i) + w_5 J_i + w_6 W_i$$
+    S_i・Softmax による推定勝率・期待値の計算は ev_engine で列配列としてまとめて行う。
+    係数は params (model_params.ModelParams) で指定する。
+    結果は raw_horses (race_model.Runners) の各馬に書き込み、馬番順に並べ替えて返す。
     """
-    horses = []
-    
-    # --- コース適性プロファイル (Ci) 定義 ---
-    # 実際は全競馬場分用意するが、主要デモとして代表的な値
-    course_profiles = {
-        "東京": {"S_straight": 1.0, "H_slope": 0.5, "R_corner": 0.3},
-        "中山": {"S_straight": 0.4, "H_slope": 1.0, "R_corner": 0.8},
-        "京都": {"S_straight": 0.7, "H_slope": 0.2, "R_corner": 0.5},
-        "阪神": {"S_straight": 0.6, "H_slope": 0.9, "R_corner": 0.5},
-        # デフォルト
-        "JRA": {"S_straight": 0.5, "H_slope": 0.5, "R_corner": 0.5},
-    }
-    
-    track_name = race_info.get("name", "JRA")
-    # レース名や場所詳細から競馬場を推測（簡易）
-    cp = course_profiles["JRA"]
-    for k in course_profiles.keys():
-        if k in track_name or k in race_info.get("track", ""):
-            cp = course_profiles[k]
-            break
-            
-    # C_i のベース係数 (アルファ、ベータ、ガンマ)
-    # 距離に応じて直線要求度などを変えるのがAI的
-    alpha = 1.0 if "1600" in race_info["distance"] else 0.8
-    beta = 1.2 if "中山" in track_name else 0.8
-    gamma = 1.0
-
-    # 基礎変数抽出と統計用リスト
-    implied_probs = []
-    f3_values = []
-    t_values = []
-    current_distance_match = re.search(r'\d+', race_info.get("distance", "2000"))
-    current_distance = int(current_distance_match.group()) if current_distance_match else 2000
-    
-    for h in raw_horses:
-        implied_probs.append(1.0 / h["odds_base"] if h["odds_base"] > 0 else 0)
-        # 上がり3Fの抽出
-        if isinstance(h.get("last_3f"), float):
-            f3_values.append(h["last_3f"])
-            
-        # 持ち時計（T_i）の抽出
-        if h.get("past_times"):
-            best_t = float('inf')
-            for pt in h["past_times"]:
-                if pt["distance"] > 0:
-                    est_time = pt["time_sec"] * (current_distance / pt["distance"])
-                    if est_time < best_t:
-                        best_t = est_time
-            if best_t != float('inf'):
-                h["best_time_est"] = best_t
-                t_values.append(best_t)
-        
-    sum_probs = sum(implied_probs) if sum(implied_probs) > 0 else 1.0
-    normalized_probs = [p / sum_probs for p in implied_probs]
-    
-    # Fi の平均値と標準偏差を計算
-    f3_mean = sum(f3_values) / len(f3_values) if f3_values else 35.0
-    f3_std = math.sqrt(sum((x - f3_mean)**2 for x in f3_values) / len(f3_values)) if len(f3_values) > 1 else 1.0
-    if f3_std == 0: f3_std = 1.0
-    
-    # Ti の平均値と標準偏差を計算
-    t_mean = sum(t_values) / len(t_values) if t_values else current_distance * 0.06
-    t_std = math.sqrt(sum((x - t_mean)**2 for x in t_values) / len(t_values)) if len(t_values) > 1 else 1.0
-    if t_std == 0: t_std = 1.0
-    
-    # 係数ウェイト (Ver 3.0)
-    w1, w2, w3, w4, w5, w6 = 0.20, 0.25, 0.30, 0.15, 0.05, 0.05
+    scored = ev_engine.score_race(raw_horses, race_info, params)
 
-    # 第1パス: 総合能力スコア S_i の算出
-    horse_scores = []
     for i, h in enumerate(raw_horses):
-        base_win_prob = normalized_probs[i]
-        
-        # 1. T_i (走破タイム/能力スコア)
-        if "best_time_est" in h:
-            t_zscore = (t_mean - h["best_time_est"]) / t_std
-            t_zscore = max(-3.0, min(3.0, t_zscore))
-        else:
-            t_zscore = -0.5 # 欠損値ペナルティ
-        
-        # 2. F_i (上り3ハロン)
-        if isinstance(h.get("last_3f"), float):
-            f_zscore = (f3_mean - h["last_3f"]) / f3_std
-            f_zscore = max(-3.0, min(3.0, f_zscore))
-        else:
-            f_zscore = -0.5 # 欠損値ペナルティ
-        
-        # 3. C_i (コース適性スコアと枠順バイアス)
-        b_draw = 0
-        distance_str = race_info.get("distance", "")
-        # B_draw (枠順バイアス): 例として小回り短距離は内枠有利、外枠不利
-        if ("中山" in track_name or "阪神" in track_name) and "1200" in distance_str:
-            if h.get("frame", 5) <= 4: b_draw = 0.5
-            elif h.get("frame", 5) >= 7: b_draw = -0.3
-            
-        # 【Ver 3.0】枠順バイアスの地力（A_i）による相殺
-        a_i = h.get("a_i", 0.0)
-        if b_draw < 0:
-            b_draw = b_draw * (1.0 - a_i)
-            
-        delta = 1.0
-        c_i = (alpha * cp["S_straight"]) + (beta * cp["H_slope"]) + (gamma * cp["R_corner"]) + (delta * b_draw)
-        
-        # 大きな馬体重は坂に強い等
-        if type(h.get("weight")) == int and h["weight"] > 500:
-            c_i += 0.2 * cp["H_slope"]
-            
-        # 4. R_i (直近3走着順) & 5. J_i (騎手) & 6. W_i (コンディション)
-        if h.get("recent_placements"):
-            r_i = sum(h["recent_placements"]) / len(h["recent_placements"])
-            r_score = 1.0 / r_i
-        else:
-            r_score = 1.0 / 8.0 # 平均8着相当の代替ペナルティ
-            
-        j_score = 1.0 if "ルメール" in h["jockey"] or "川田" in h["jockey"] else 0.5
-        
-        w_score = 1.0
-        if isinstance(h["weight_change"], str):
-            if h["weight_change"] == "-" or h["weight_change"] == "0":
-                w_score = 1.0
-            else:
-                try:
-                    wc = int(h["weight_change"].replace('+', ''))
-                    # 異常な増減(-10kg以下、+15kg以上)はペナルティ
-                    if wc <= -10 or wc >= 15: w_score = 0.5
-                except: pass
-
-        # 【Ver 3.0】実績ペナルティの動的緩和ロジック
-        w_4_i = w4
-        theta = 1.5 # 環境バイアス合致の閾値
-        if c_i >= theta:
-            w_4_i = w4 * 0.2
-            
-        # S_i の計算 (純粋な能力スコア)
-        s_i = (w1 * t_zscore) + (w2 * f_zscore) + (w3 * c_i) + (w_4_i * r_score * 10) + (w5 * j_score) + (w6 * w_score)
-        horse_scores.append(s_i)
-        
-    # 第2パス: Softmax関数による推定勝率 P_i の算出と EV 計算
-    # S_i の分散をレース内で正規化（Zスコア化）し、極端な平準化を防ぐ
-    s_mean = sum(horse_scores) / len(horse_scores) if horse_scores else 0.0
-    s_std = math.sqrt(sum((s - s_mean)**2 for s in horse_scores) / len(horse_scores)) if len(horse_scores) > 1 else 1.0
-    if s_std == 0: s_std = 1.0
-    
-    s_zscores = [(s - s_mean) / s_std for s in horse_scores]
-    
-    tau = 1.5 # 温度パラメータ (Ver 3.1 修正: オッズに依存せず能力差が勝率に直結するようメリハリを強める)
-    exp_scores = [math.exp(z / tau) for z in s_zscores]
-    sum_exp = sum(exp_scores) if sum(exp_scores) > 0 else 1.0
-    
-    for i, h in enumerate(raw_horses):
-        s_i = horse_scores[i]
-        win_prob = exp_scores[i] / sum_exp
-        if win_prob < 0.001: win_prob = 0.001 # 最低保証勝率0.5%
-        
-        # Ver 3.0: 期待値計算時にオッズのキャップ(最大50倍)を適用
-        capped_odds = min(h["odds_base"], 50.0)
-        expected_return = win_prob * capped_odds
-
-        horses.append({
-            "number": h["number"],
-            "name": h["name"],
-            "jockey": h["jockey"],
-            "odds": h["odds_base"],
-            "popularity": h.get("popularity", i + 1),  
-            "win_probability": round(win_prob, 3),
-            "expected_return": round(expected_return, 2),
-            "score_si": round(s_i, 2), # Ver 3.0 スコア
-            "classification": "一般馬", # 第3パスで設定
-            "weight": h["weight"],
-            "weight_change": h["weight_change"],
-            "last_3f": h["last_3f"],
-            "speed_index": h["speed_index"],
-            "condition_score": h["condition_score"],
-        })
+        h.win_probability = round(float(scored["win_probability"][i]), 3)
+        h.expected_return = round(float(scored["expected_return"][i]), 2)
+        h.score_si = round(float(scored["score_si"][i]), 2) # Ver 3.0 スコア
+        h.classification = "一般馬" # 第3パスで設定
 
     # 第3パス: 評価カテゴリの振り分け (Ver 3.0 Classification)
     # 一時的に勝率順でソートしてトップ3を特定する
-    sorted_by_prob = sorted(horses, key=lambda x: x["win_probability"], reverse=True)
-    top3_names = [h["name"] for h in sorted_by_prob[:3]]
+    sorted_by_prob = sorted(raw_horses, key=lambda x: x.win_probability, reverse=True)
+    top3_names = {h.name for h in sorted_by_prob[:3]}
     
-    for h in horses:
-        if h["expected_return"] < 0.8 and h["odds"] <= 5.0:
-            h["classification"] = "危険な人気馬"
-        elif h["name"] in top3_names and h["expected_return"] >= 0.9:
-            h["classification"] = "絶対軸"
-        elif h["expected_return"] >= 1.2 and h["win_probability"] >= 0.02:
-            h["classification"] = "高EV伏兵"
+    for h in raw_horses:
+        if h.expected_return < 0.8 and h.odds <= 5.0:
+            h.classification = "危険な人気馬"
+        elif h.name in top3_names and h.expected_return >= 0.9:
+            h.classification = "絶対軸"
+        elif h.expected_return >= 1.2 and h.win_probability >= 0.02:
+            h.classification = "高EV伏兵"
 
     # オッズや人気順が正しく設定されていない場合のみ、ソートして付け直す
-    if any(h["popularity"] == 0 for h in horses):
-        horses.sort(key=lambda x: x["odds"])
-        for idx, h in enumerate(horses):
-            h["popularity"] = idx + 1
+    if any(h.popularity == 0 for h in raw_horses):
+        raw_horses.sort(key=lambda x: x.odds)
+        for idx, h in enumerate(raw_horses):
+            h.popularity = idx + 1
             
-    horses.sort(key=lambda x: x["number"])
-    return horses
+    raw_horses.sort(key=lambda x: x.number)
+    return raw_horses
+
+# 戦略ごとの対象券種
+SAFE_BET_TYPES = ("単勝", "複勝", "ワイド")
+VALUE_BET_TYPES = ("馬連", "馬単", "ワイド", "3連複", "3連単")
 
-def generate_portfolios(horses_data):
+def _select_bets(tables, bet_types, numbers, min_odds, min_ev, size, max_hit_probability):
     """
-    EV Ver 4.0 ポートフォリオ生成ロジック (的中率・勝率重視型)
-    全馬の「推定勝率 (win_probability)」をベースに、トリガミを回避しつつ最も当たる確率が高い買い目を生成する。
+    対象券種の全組み合わせから、推定オッズ・期待値の下限を満たすものを的中確率の高い順に size 点まで返す。
+    オッズが推定できない (NaN・無限大の) 組み合わせは選ばない。
     """
-    strategy_a = []
-    strategy_b = []
-    
-    # 勝率順でソートしたリストを作成
-    sorted_by_prob = sorted(horses_data, key=lambda x: x["win_probability"], reverse=True)
-    if not sorted_by_prob:
-        return {"strategy_a": [], "strategy_b": []}
-        
-    # 勝率トップを絶対軸（本命）に設定
-    axis_horse = sorted_by_prob[0]
-    
-    # === 戦略A (超堅実・鉄板回収型) ===
-    # 本命馬の単勝、および勝率2位〜4位へのワイド（少点数）
-    
-    # 1. 本命の単勝 (トリガミ判定: オッズが1.0倍超であること)
-    if axis_horse["odds"] > 1.0:
-        strategy_a.append({
-            "type": "単勝", 
-            "numbers": [axis_horse["number"]], 
-            "odds": axis_horse["odds"], 
-            "hit_probability": axis_horse["win_probability"]
-        })
-        
-    # 2. 本命から対抗(勝率2位〜4位)へのワイド
-    targets_a = sorted_by_prob[1:4]
-    for tgt in targets_a:
-        # 当たる確率の簡便な掛け合わせモデル (軸馬勝率 × 相手勝率 × 定数)
-        combo_hit_prob = round(axis_horse["win_probability"] * tgt["win_probability"] * 3.0, 3) 
-        combo_odds_wide = round(axis_horse["odds"] * tgt["odds"] * 0.15, 1)
-        
-        # オッズが1.2倍以上（トリガミ回避ライン）を満たす堅い買い目のみ追加
-        if combo_odds_wide >= 1.2:
-            nums_sorted = sorted([axis_horse["number"], tgt["number"]])
-            strategy_a.append({
-                "type": "ワイド", 
-                "numbers": nums_sorted, 
-                "odds": combo_odds_wide, 
-                "hit_probability": min(0.99, combo_hit_prob)
+    candidates = []
+    for bet_type in bet_types:
+        combos, probs, odds = tables[bet_type]
+        ev = probs * odds
+        idx = np.flatnonzero(np.isfinite(odds) & (odds >= min_odds) & (ev >= min_ev))
+        # 券種ごとに上位 size 点に絞ってからまとめて並べる
+        idx = idx[np.argsort(-probs[idx], kind='stable')[:size]]
+        for c in idx:
+            nums = [numbers[x] for x in combos[c]]
+            candidates.append({
+                "type": bet_type,
+                "numbers": nums if bet_type in bet_probabilities.ORDERED_BET_TYPES else sorted(nums),
+                "odds": round(float(odds[c]), 1),
+                "hit_probability": round(min(max_hit_probability, float(probs[c])), 4),
+                "expected_return": round(float(ev[c]), 2),
             })
+    candidates.sort(key=lambda b: b["hit_probability"], reverse=True)
+    return candidates[:size]
+
+def generate_portfolios(horses_data, params=None, live_odds=None, allocate=True):
+    """
+    EV Ver 5.0 ポートフォリオ生成ロジック (全組み合わせの期待値から選択)
+    推定勝率 (win_probability) から着順モデル (bet_probabilities) で全券種・全組み合わせの的中確率を求め、
+    単勝オッズから推定した各組み合わせのオッズとの積 (期待値) が下限を超える買い目を的中確率の高い順に選ぶ。
+    戦略A は単勝・複勝・ワイド、戦略B は馬連・馬単・ワイド・3連複・3連単から選ぶ。
+    各買い目には stake_optimizer で求めた購入額 (stake, 円。0 は購入しない) を付ける。
+    下限と点数は params (model_params.ModelParams) で指定する。
+    live_odds (combo_odds.RaceOdds) を渡すと、取得できた組み合わせは推定オッズの代わりに実際のオッズを使う。
+    allocate=False の場合は購入額の最適化を行わない (一律の購入額で精算するバックテスト・スイープ用)。
+    """
+    p = params or DEFAULT_PARAMS
+    if not horses_data:
+        return {"strategy_a": [], "strategy_b": []}
+
+    numbers = [h.number for h in horses_data]
+    probs = bet_probabilities.combination_probabilities(
+        [h.win_probability for h in horses_data], p.henery_gamma2, p.henery_gamma3)
+    odds = bet_probabilities.estimated_odds([h.odds for h in horses_data], p.henery_gamma2, p.henery_gamma3)
+    if live_odds:
+        number_array = np.asarray(numbers)
+        for bet_type, (combos, _) in probs.items():
+            if bet_type != "単勝":
+                live = live_odds.lookup(bet_type, number_array[combos])
+                odds[bet_type] = np.where(np.isnan(live), odds[bet_type], live)
+    tables = {t: (combos, hit, odds[t]) for t, (combos, hit) in probs.items()}
+    size = int(p.portfolio_size)
 
-    # 戦略Aを合成的中確率(hit_probability)降順でソート
-    unique_a = {str(b["numbers"]) + b["type"]: b for b in strategy_a}
-    strategy_a = sorted(unique_a.values(), key=lambda x: x["hit_probability"], reverse=True)
+    # === 戦略A (堅実・的中率重視型) ===
+    strategy_a = _select_bets(tables, SAFE_BET_TYPES, numbers, p.safe_min_odds, p.safe_min_ev, size,
+                              p.max_hit_probability)
+    # === 戦略B (高期待値・高配当狙い型) ===
+    strategy_b = _select_bets(tables, VALUE_BET_TYPES, numbers, p.value_min_odds, p.value_min_ev, size,
+                              p.max_hit_probability)
 
-    # === 戦略B (本命流し・少点数プラス確定型) ===
-    # 本命馬を軸に、勝率2位〜6位への馬連・3連複
-    targets_b = sorted_by_prob[1:6]
+    if allocate:
+        # 戦略ごとに、資金の期待対数成長率が最大でトリガミにならない購入額を付ける
+        win_probs = [h.win_probability for h in horses_data]
+        for bets in (strategy_a, strategy_b):
+            stake_optimizer.allocate_stakes(bets, win_probs, numbers, p)
+    return {"strategy_a": strategy_a, "strategy_b": strategy_b}
+
+def process_race(url, date_str, page_executor=None, previous=None, odds_series=None, params=None,
+                 keibalab_index=None, fetch_result=True, live_odds=None, features=None):
+    """
+    1レース分の取得・期待値計算・競馬ラボ連携・買い目生成を行い、出力用の辞書を返す
+    previous (前回出力のレース) を渡すと差分更新になり、確定済みならそのまま再利用する。
+    odds_series (archive_store.OddsSeries) を渡すとオッズ・人気・馬体重を時系列に記録し、オッズ推移を特徴量に加える。
+    keibalab_index (keibalab.KeibaLabIndex) は実行中の全レースで共有し、競馬ラボの開催日ページを1回だけ取得する。
+    live_odds (combo_odds.LiveOdds) を渡すと組み合わせ馬券のオッズを出馬表と並行して取得し、買い目の期待値に使う。
+    features (feature_store.FeatureStore) を渡すと馬・騎手の過去成績の集計値を引いてモデルの入力に加える。
+    """
+    if previous is not None and previous["race_info"].get("status") == "finished":
+        print(f"確定済みのため前回データを再利用: {url}")
+        return previous
+
+    if previous is not None and not all("features" in h for h in previous["horses"]):
+        # 特徴量を持たない旧形式の出力からは引き継げないため全件取得する
+        previous = None
+
+    get_live_odds = live_odds.prefetch(url.split('race_id=')[-1]) if live_odds is not None else None
+
+    if previous is not None:
+        print(f"差分更新中: {url}")
+        with instrumentation.stage("refresh"):
+            race_info, raw_horses = refresh_race_data(url, date_str, previous, page_executor, fetch_result)
+    else:
+        print(f"スクレイピング中: {url}")
+        keibalab_index = keibalab_index or keibalab.KeibaLabIndex(page_executor)
+        # 競馬ラボの対応ページは netkeiba のページと並行して先行取得する
+        lab_page = keibalab_index.prefetch(url.split('race_id=')[-1], date_str)
+        with instrumentation.stage("scrape"):
+            race_info, raw_horses = scrape_race_data(url, date_str, page_executor)
     
-    for tgt in targets_b:
-        # 馬連
-        combo_hit_prob_umaren = round(axis_horse["win_probability"] * tgt["win_probability"] * 1.5, 3)
-        combo_odds_umaren = round(axis_horse["odds"] * tgt["odds"] * 0.4, 1)
+    if not race_info or not raw_horses or len(raw_horses) == 0:
+        return None
         
-        # 点数を絞るためオッズ2.5倍以上を最低ラインとする
-        if combo_odds_umaren >= 2.5:
-            nums_sorted = sorted([axis_horse["number"], tgt["number"]])
-            strategy_b.append({
-                "type": "馬連", 
-                "numbers": nums_sorted, 
-                "odds": combo_odds_umaren, 
-                "hit_probability": min(0.99, combo_hit_prob_umaren)
-            })
-            
-        # 3連複 (軸 - 相手 - 相手)
-        for tgt2 in targets_b:
-            if tgt2["number"] <= tgt["number"]: continue
-            
-            base_hit_prob_3 = round(axis_horse["win_probability"] * tgt["win_probability"] * tgt2["win_probability"] * 5.0, 3)
-            base_odds_3 = float(axis_horse["odds"] * tgt["odds"] * tgt2["odds"] * 0.08)
-            
-            # オッズ5.0倍以上を条件とする
-            if base_odds_3 >= 5.0:
-                nums_3puku = sorted([axis_horse["number"], tgt["number"], tgt2["number"]])
-                strategy_b.append({
-                    "type": "3連複", 
-                    "numbers": nums_3puku, 
-                    "odds": round(base_odds_3, 1), 
-                    "hit_probability": min(0.99, base_hit_prob_3)
-                })
-
-    # 戦略Bを合成的中確率(hit_probability)降順でソート
-    unique_b = {str(b["numbers"]) + b["type"]: b for b in strategy_b}
-    strategy_b = sorted(unique_b.values(), key=lambda x: x["hit_probability"], reverse=True)
+    if odds_series is not None:
+        with instrumentation.stage("odds_series"):
+            odds_series.record(race_info["id"], raw_horses)
+            drift = odds_series.odds_drift(race_info["id"])
+        for h in raw_horses:
+            h.odds_drift = drift.get(h.number)
+
+    if features is not None:
+        with instrumentation.stage("features"):
+            features.annotate(race_info, raw_horses)
+
+    print(f"[{race_info['name']}] のデータを計算中...")
+    with instrumentation.stage("model"):
+        horses_data = calculate_expected_values(raw_horses, race_info, params)
     
-    return {"strategy_a": strategy_a, "strategy_b": strategy_b}
+    if previous is not None:
+        # 競馬ラボ由来の上がり3F表示は前回値を引き継ぐ (差分更新では再取得しない)
+        # (表示が過去走の値・"-" の場合は引き継いだ features の last_3f と同じ)
+        for prev in previous["horses"]:
+            h = horses_data.by_name(prev["name"])
+            if h is not None and isinstance(prev["last_3f"], str):
+                h.lab_last_3f = race_model.parse_last_3f(prev["last_3f"])
+    else:
+        with instrumentation.stage("keibalab"):
+            keibalab_index.merge_last_3f(race_info, horses_data, lab_page)
+
+    # ボーナス付与後に再ソート
+    horses_data.sort(key=lambda x: x.expected_return, reverse=True)
+    # 順位(popularity)を再採番 (期待値順ではなく、オッズ順のままにする場合は oddsでソート)
+    horses_data.sort(key=lambda x: x.odds)
+    for idx, h in enumerate(horses_data):
+        h.popularity = idx + 1
+    horses_data.sort(key=lambda x: x.number)
+
+    with instrumentation.stage("portfolios"):
+        portfolios = generate_portfolios(horses_data, params, get_live_odds() if get_live_odds else None)
+
+    return {
+        "race_info": race_info,
+        "horses": horses_data.to_output(),
+        "portfolios": portfolios
+    }
+
+def load_previous_output(path=None):
+    """ 前回出力した data.json をレースID → レースデータの辞書として読み込む """
+    path = path or OUTPUT_JSON_PATH
+    try:
+        with open(path, encoding='utf-8') as f:
+            return {entry["race_info"]["id"]: entry for entry in json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError) as e:
+        print(f"前回データを読み込めないため全件取得します: {e}")
+        return {}
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="netkeiba 重賞レースの取得と期待値計算")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="同時に処理するレース数 (1 の場合は逐次実行)")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="並列モード時の全体の同時リクエスト数上限")
+    parser.add_argument("--host-rate", type=float, default=DEFAULT_HOST_RATE,
+                        help="並列モード時の1ホストあたりの最大リクエスト数/秒")
+    parser.add_argument("--retries", type=int, default=fetcher.DEFAULT_RETRIES,
+                        help="5xx・タイムアウト時の最大リトライ回数")
+    parser.add_argument("--cache-dir", default=http_cache.DEFAULT_CACHE_DIR,
+                        help="HTTPレスポンスキャッシュの保存先")
+    parser.add_argument("--cache-max-mb", type=int, default=http_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="キャッシュの最大サイズ (MB)。超過分は最終アクセスが古い順に削除")
+    parser.add_argument("--no-cache", action="store_true", help="キャッシュを使わず毎回取得する")
+    parser.add_argument("--offline", action="store_true",
+                        help="ネットワークにアクセスせずキャッシュのみで再実行する (デバッグ用)")
+    parser.add_argument("--record-fixtures", metavar="DIR",
+                        help="取得したページをHTMLフィクスチャとして DIR に保存する (benchmark.py 用)")
+    parser.add_argument("--replay-fixtures", metavar="DIR",
+                        help="ネットワークの代わりに DIR のHTMLフィクスチャを使って実行する")
+    parser.add_argument("--netkeiba-base-url", metavar="URL",
+                        help=f"{fetcher.NETKEIBA_BASE_URL} の代わりに接続する先 (負荷試験用のスタンドインサーバーなど)")
+    parser.add_argument("--keibalab-base-url", metavar="URL",
+                        help=f"{fetcher.KEIBALAB_BASE_URL} の代わりに接続する先")
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回の data.json を元に、確定済みレースを省略しオッズ・人気・馬体重のみ再取得する")
+    parser.add_argument("--archive-db", default=archive_store.DEFAULT_ARCHIVE_PATH,
+                        help="取得結果のスナップショットを追記するアーカイブ (SQLite)")
+    parser.add_argument("--export-dir", default=archive_store.DEFAULT_EXPORT_DIR,
+                        help="開催日ごとの圧縮JSONの出力先")
+    parser.add_argument("--feature-db", default=feature_store.DEFAULT_FEATURE_STORE_PATH,
+                        help="馬・騎手の過去成績の集計値を持つ特徴量ストア (SQLite)")
+    parser.add_argument("--no-archive", action="store_true",
+                        help="アーカイブ・オッズ時系列・特徴量ストアへの追記と開催日別JSONの出力を行わない")
+    parser.add_argument("--from-date", type=discovery.parse_date, metavar="YYYY-MM-DD",
+                        help="レース一覧を取得する開催日の開始 (既定: 2日前)")
+    parser.add_argument("--to-date", type=discovery.parse_date, metavar="YYYY-MM-DD",
+                        help="レース一覧を取得する開催日の終了 (既定: 2日後)")
+    parser.add_argument("--listing-cache-dir", default=discovery.DEFAULT_LISTING_CACHE_DIR,
+                        help="過去の開催日のレース一覧 (パース済み) の保存先")
+    parser.add_argument("--run-report", metavar="PATH",
+                        help="段階別・レース別の計測結果 (JSON) の出力先 (既定: data.json と同じ場所の run_report.json)")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile でメインスレッドをプロファイルし、上位関数をレポートに含める (--workers 1 推奨)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="tracemalloc でメモリ確保の多い箇所をレポートに含める")
+    parser.add_argument("--odds-drift-weight", type=float, default=DEFAULT_PARAMS.w_drift,
+                        help="オッズ推移 (前回までの記録からの変化率) を S_i に加えるウェイト。0 で無効")
+    parser.add_argument("--bankroll", type=float, default=DEFAULT_PARAMS.bankroll,
+                        help="購入額の計算に使う資金 (円)")
+    parser.add_argument("--race-budget", type=float, default=DEFAULT_PARAMS.race_budget,
+                        help="1レース・1戦略あたりの購入額の上限 (円)")
+    parser.add_argument("--kelly-fraction", type=float, default=DEFAULT_PARAMS.kelly_fraction,
+                        help="ケリー基準の賭け率に掛ける係数 (1.0 でフルケリー)")
+    parser.add_argument("--no-live-odds", action="store_true",
+                        help="組み合わせ馬券のオッズを取得せず、単勝オッズからの推定オッズだけで買い目を選ぶ")
+    parser.add_argument("--full-card", action="store_true",
+                        help="重賞だけでなく全レースを対象にし、レースをプロセスプールで並列に処理する")
+    parser.add_argument("--processes", type=int, default=full_card.DEFAULT_PROCESSES,
+                        help="全レースモードのワーカープロセス数")
+    parser.add_argument("--tasks-per-child", type=int, default=full_card.DEFAULT_TASKS_PER_CHILD,
+                        help="全レースモードでワーカープロセスを作り直すまでに処理するレース数 (メモリの上限)")
+    parser.add_argument("--time-budget-min", type=float, default=full_card.DEFAULT_TIME_BUDGET_MIN,
+                        help="全レースモードの処理時間の上限 (分)。超えたレースは前回出力のまま書き出す")
+    parser.add_argument("--daemon", action="store_true",
+                        help="常駐モード: 発走時刻に合わせて発走が近いレースほど頻繁に更新し、確定後は結果を1回取得して更新を終える")
+    parser.add_argument("--daemon-max-hours", type=float, default=DEFAULT_DAEMON_MAX_HOURS,
+                        help="常駐モードの最大実行時間 (時間)")
+    return parser.parse_args(argv)
+
+def model_params_from_args(args):
+    return DEFAULT_PARAMS.replace(w_drift=args.odds_drift_weight, bankroll=args.bankroll,
+                                  race_budget=args.race_budget, kelly_fraction=args.kelly_fraction)
+
+def configure_fetcher(args):
+    """ 取得レイヤーのリトライ・キャッシュ・フィクスチャを設定する (全レースモードのワーカーも同じ設定を使う) """
+    fetcher.configure(retries=args.retries)
+    fetcher.configure_base_urls(args.netkeiba_base_url, args.keibalab_base_url)
+    if not args.no_cache:
+        fetcher.enable_cache(args.cache_dir, args.cache_max_mb * 1024 * 1024, offline=args.offline)
+    if args.record_fixtures:
+        fetcher.enable_recording(args.record_fixtures)
+    if args.replay_fixtures:
+        fetcher.enable_replay(args.replay_fixtures)
+
+def run_pipeline(args):
+    """ レース一覧の取得から data.json・アーカイブの出力までを行う """
     print("実レースデータ(netkeiba)の取得を開始します...")
-    urls_dict = get_upcoming_race_urls()
-    
-    if not urls_dict:
+    listing_cache = None if args.no_cache else discovery.ListingCache(args.listing_cache_dir)
+
+    with ExitStack() as stack:
+        page_executor = None
+        if args.workers > 1:
+            # レース単位とページ単位の2段で並列化する (ページ用プールは待ち合わせをしないためデッドロックしない)
+            fetcher.configure(max_connections=args.max_connections, host_rate=args.host_rate, retries=args.retries)
+            page_executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.max_connections))
+
+        with instrumentation.stage("discover"):
+            races = get_upcoming_races(args.from_date, args.to_date, page_executor, listing_cache)
+
+        if not races:
+            print("対象レースが見つかりませんでした。")
+            return
+
+        previous = load_previous_output() if args.incremental else {}
+        params = model_params_from_args(args)
+        keibalab_index = keibalab.KeibaLabIndex(page_executor)
+        live_odds = None if args.no_live_odds else combo_odds.LiveOdds(page_executor)
+        odds_series = None if args.no_archive else archive_store.OddsSeries(args.archive_db)
+        if odds_series is not None:
+            stack.callback(odds_series.close)
+        features = None if args.no_archive else feature_store.FeatureStore(args.feature_db)
+        if features is not None:
+            stack.callback(features.close)
+
+        def run(race):
+            race_id = race["url"].split('race_id=')[-1]
+            try:
+                with instrumentation.stage("race", race["race_id"]):
+                    return process_race(race["url"], race["date"], page_executor, previous.get(race_id), odds_series,
+                                        params, keibalab_index, live_odds=live_odds, features=features)
+            except Exception as e:
+                # 1レースの失敗で他のレースの出力を失わないよう、前回出力 (なければ出力なし) のまま続ける
+                print(f"[{race['race_id']}] 処理エラー: {e}")
+                return previous.get(race_id)
+
+        # 計算が終わったレースから順に書き出し、レースデータは保持しない (並列時もレース一覧の順序のまま出力する)
+        if page_executor is not None:
+            with ThreadPoolExecutor(max_workers=args.workers) as race_executor:
+                write_output(args, race_executor.map(run, races))
+        else:
+            write_output(args, (run(race) for race in races))
+
+def write_output(args, entries, order=None):
+    """
+    entries (レースデータのイテラブル。None は無視) を1レースずつ書き出す: レース別データ・アーカイブ・特徴量ストアへは
+    受け取るたびに、data.json・index.json・開催日別JSON は最後にまとめて書き出す (order はレースIDの並び)。
+    途中で例外が起きても書き出し済みのレースは残る。
+    """
+    archive_path = None if args.no_archive else args.archive_db
+    feature_path = None if args.no_archive else args.feature_db
+    with output_writer.OutputWriter(FRONTEND_DATA_DIR, OUTPUT_JSON_PATH, archive_path, args.export_dir,
+                                    feature_path) as writer:
+        for entry in entries:
+            if entry:
+                with instrumentation.stage("write_output"):
+                    writer.write(entry)
+        if not writer.count:
+            print("出力可能なデータがありませんでした。")
+            return
+        with instrumentation.stage("write_output"):
+            changed = writer.close(order)
+    print(f"全 {writer.count} レース分のデータ出力を完了しました: {OUTPUT_JSON_PATH}"
+          + ("" if changed else " (前回と同じ内容のため書き換えなし)"))
+    print(f"レース別データ {len(writer.shards.written)} 件を更新しました: "
+          f"{os.path.join(FRONTEND_DATA_DIR, race_shards.SHARD_DIRNAME)}")
+    if not args.no_archive:
+        print(f"アーカイブに {len(writer.dates)} 開催日分のスナップショットを追記しました: {args.archive_db}")
+        print(f"特徴量ストアに {writer.ingested} レース分の結果を取り込みました: {args.feature_db}")
+
+def run_full_card(args):
+    """
+    全レースモード: 開催日の全レースをプロセスプールで処理し、data.json・アーカイブを出力する。
+    結果は完了した順に受け取り、実行時間の上限までに終わらなかったレースは前回出力のまま書き出す。
+    """
+    print("全レースモードで実レースデータ(netkeiba)の取得を開始します...")
+    listing_cache = None if args.no_cache else discovery.ListingCache(args.listing_cache_dir)
+    fetcher.configure(max_connections=args.max_connections, host_rate=args.host_rate, retries=args.retries)
+    with ThreadPoolExecutor(max_workers=args.max_connections) as listing_executor:
+        with instrumentation.stage("discover"):
+            races = get_upcoming_races(args.from_date, args.to_date, listing_executor, listing_cache, grades=None)
+    if not races:
         print("対象レースが見つかりませんでした。")
         return
-        
-    output_array = []
-    
-    for url, date_str in urls_dict.items():
-        print(f"スクレイピング中: {url}")
-        race_info, raw_horses = scrape_race_data(url, date_str)
-        
-        if not race_info or not raw_horses or len(raw_horses) == 0:
-            continue
-            
-        print(f"[{race_info['name']}] のデータを計算中...")
-        horses_data = calculate_expected_values(raw_horses, race_info)
-        
-        # --- 競馬ラボ (KeibaLab) データマージ ---
+
+    # 前回出力は data.json 全体ではなくレース別データ (races/{レースID}.json) を必要になった時点で1レースずつ読む。
+    # 打ち切り時の補完には常に使い、差分更新には --incremental の場合だけ使う (ワーカーが自分のレースの分だけ読む)
+    index = race_shards.load_index(FRONTEND_DATA_DIR)
+    reused = []
+    tasks = []
+    for race in races:
+        summary = index.get(race["race_id"])
+        if (args.incremental and summary is not None and summary.get("status") == "finished"
+                and os.path.exists(race_shards.shard_path(FRONTEND_DATA_DIR, race["race_id"]))):
+            # 差分更新では確定済みのレースはワーカーに渡さずそのまま再利用する
+            reused.append(race)
+        else:
+            tasks.append((race, FRONTEND_DATA_DIR if args.incremental else None))
+    print(f"全 {len(races)} レース (確定済み {len(reused)} 件を除く {len(tasks)} 件) を "
+          f"{args.processes} プロセスで処理します。")
+
+    def results():
+        for race in reused:
+            yield race_shards.read_shard(FRONTEND_DATA_DIR, race["race_id"])
+        finished = set()
+        for done, (race, entry) in enumerate(full_card.run_races(args, tasks), 1):
+            if entry is not None:
+                finished.add(race["race_id"])
+            print(f"[{done}/{len(tasks)}] {race['race_id']} の処理を完了しました。")
+            yield entry
+        # 打ち切り・失敗したレースは前回出力のまま書き出す (今回は書き出していないためシャードは前回のまま)
+        for race, _ in tasks:
+            if race["race_id"] not in finished:
+                yield race_shards.read_shard(FRONTEND_DATA_DIR, race["race_id"])
+
+    # 完了した順に書き出し、data.json・index.json はレース一覧の順序で書き出す
+    write_output(args, results(), order=[race["race_id"] for race in races])
+
+def run_daemon(args):
+    """
+    常駐モード: 発走時刻に合わせてレースごとに更新する。
+    発走が近いほど出馬表 (オッズ・人気・馬体重) を頻繁に取り直し、発走後は結果ページだけを確定まで取得して以後は更新しない。
+    更新のたびに data.json・アーカイブを書き出す。
+    """
+    print("常駐モードで実レースデータ(netkeiba)の更新を開始します...")
+    listing_cache = None if args.no_cache else discovery.ListingCache(args.listing_cache_dir)
+    queue = scheduler.RefreshScheduler()
+    deadline = queue.now_fn() + timedelta(hours=args.daemon_max_hours)
+
+    with ExitStack() as stack:
+        page_executor = None
+        race_executor = None
+        if args.workers > 1:
+            fetcher.configure(max_connections=args.max_connections, host_rate=args.host_rate, retries=args.retries)
+            page_executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.max_connections))
+            race_executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.workers))
+
+        with instrumentation.stage("discover"):
+            races = get_upcoming_races(args.from_date, args.to_date, page_executor, listing_cache)
+
+        if not races:
+            print("対象レースが見つかりませんでした。")
+            return
+
+        # レースID (URLの race_id= 以降) → 最新の出力
+        entries = load_previous_output()
+        params = model_params_from_args(args)
+        keibalab_index = keibalab.KeibaLabIndex(page_executor)
+        odds_series = None if args.no_archive else archive_store.OddsSeries(args.archive_db)
+        if odds_series is not None:
+            stack.callback(odds_series.close)
+        features = None if args.no_archive else feature_store.FeatureStore(args.feature_db)
+        if features is not None:
+            stack.callback(features.close)
+
+        now = queue.now_fn()
+        for race in races:
+            race_id = race["url"].split('race_id=')[-1]
+            entry = entries.get(race_id)
+            if entry is not None and entry["race_info"].get("status") == "finished":
+                continue
+            queue.push(race, now, scheduler.ODDS if entry is not None else scheduler.FULL)
+
+        def run(job, live_odds=None):
+            race, kind = job
+            race_id = race["url"].split('race_id=')[-1]
+            entry = entries.get(race_id)
+            try:
+                with instrumentation.stage("race", race["race_id"]):
+                    if kind == scheduler.RESULT and entry is not None:
+                        print(f"結果確認中: {race['url']}")
+                        return job, entry, refresh_race_result(entry, race["url"])
+                    # 発走時刻が分からないレースは確定を検知できるよう結果ページも取得する
+                    entry = process_race(race["url"], race["date"], page_executor,
+                                         entry if kind != scheduler.FULL else None, odds_series, params,
+                                         keibalab_index,
+                                         fetch_result=kind == scheduler.FULL or scheduler.post_time(race) is None,
+                                         live_odds=live_odds, features=features)
+            except Exception as e:
+                # 失敗したレースは前回の出力のまま次回の更新で取り直す
+                print(f"[{race['race_id']}] 処理エラー: {e}")
+                return job, None, False
+            return job, entry, entry is not None and entry["race_info"].get("status") == "finished"
+
         try:
-            lab_date_str = datetime.strptime(race_info['date'], '%Y-%m-%d').strftime('%Y%m%d')
-            # 翌日の日付を取得（スクレイパーの基準日と同じにする）
-            target_date = datetime.now() + timedelta(days=1)
-            lab_date_str = target_date.strftime('%Y%m%d')
-            lab_list_url = f"https://www.keibalab.jp/db/race/{lab_date_str}/"
-            r_lab = requests.get(lab_list_url, headers=HEADERS, timeout=10)
-            soup_lab = BeautifulSoup(r_lab.content, "html.parser")
-            
-            lab_race_links = [a['href'] for a in soup_lab.find_all('a', href=True) if f"/db/race/{lab_date_str}" in a['href'] and len(a['href'].split('/')) > 4]
-            for lab_link in set(lab_race_links):
-                l_url = f"https://www.keibalab.jp{lab_link}"
-                r_l = requests.get(l_url, headers=HEADERS, timeout=10)
-                s_l = BeautifulSoup(r_l.content, "html.parser")
-                
-                # 馬名リストの取得
-                bamei_elements = s_l.select('.bamei')
-                lab_horses = []
-                for b_el in bamei_elements:
-                    # aタグがあればそのテキスト、なければ自要素のテキスト
-                    a_tag = b_el.find('a')
-                    name = a_tag.text.strip() if a_tag else b_el.text.strip()
-                    if name:
-                        lab_horses.append(name)
-                
-                # 同一レース判定 (3頭以上一致)
-                match_count = sum(1 for h in horses_data if h['name'] in lab_horses)
-                if match_count >= 3:
-                    zensou_rows = s_l.select('.megamoriTable tr.zensou1')
-                    for idx, z_row in enumerate(zensou_rows):
-                        if idx < len(lab_horses):
-                            horse_name = lab_horses[idx]
-                            tds = z_row.find_all('td')
-                            for td in tds:
-                                text = td.text.strip().replace('\n', '')
-                                match = re.search(r'([34]\d\.\d)[HMS]?(?:\d+kg)?', text[-15:])
-                                if match and float(match.group(1)) > 30.0:
-                                    last_3f = match.group(1)
-                                    for h in horses_data:
-                                        if h['name'] == horse_name:
-                                            h["last_3f"] = last_3f
-                                    break
-                    break 
-        except Exception as e:
-            print(f"競馬ラボ連携エラー: {e}")
+            while len(queue):
+                batch = queue.pop_due(deadline)
+                if not batch:
+                    print("実行時間の上限に達したため常駐モードを終了します。")
+                    break
+                # 組み合わせオッズは更新のたびに取り直す (同じバッチ内でのみ共有する)
+                live_odds = None if args.no_live_odds else combo_odds.LiveOdds(page_executor)
+                results = ([f.result() for f in [race_executor.submit(run, job, live_odds) for job in batch]]
+                           if race_executor is not None else [run(job, live_odds) for job in batch])
+                for (race, kind), entry, finished in results:
+                    if entry is not None:
+                        entries[race["url"].split('race_id=')[-1]] = entry
+                    nxt = queue.reschedule(race, kind, finished)
+                    if finished:
+                        print(f"[{race['race_id']}] の結果が確定したため更新を終了します。")
+                    elif nxt is not None:
+                        print(f"[{race['race_id']}] 次回更新: {nxt[0].strftime('%H:%M')} ({nxt[1]})")
+                # 一覧の順序のまま出力する
+                output_array = [entries[r["url"].split('race_id=')[-1]] for r in races
+                                if r["url"].split('race_id=')[-1] in entries]
+                write_output(args, output_array)
+        except KeyboardInterrupt:
+            print("中断されたため常駐モードを終了します。")
 
-        # ボーナス付与後に再ソート
-        horses_data.sort(key=lambda x: x["expected_return"], reverse=True)
-        # 順位(popularity)を再採番 (期待値順ではなく、オッズ順のままにする場合は oddsでソート)
-        horses_data.sort(key=lambda x: x["odds"])
-        for idx, h in enumerate(horses_data):
-            h["popularity"] = idx + 1
-        horses_data.sort(key=lambda x: x["number"])
+def main(argv=None):
+    args = parse_args(argv)
+    configure_fetcher(args)
 
-        portfolios = generate_portfolios(horses_data)
-        
-        output_array.append({
-            "race_info": race_info,
-            "horses": horses_data,
-            "portfolios": portfolios
-        })
-    
-    if output_array:
-        os.makedirs(FRONTEND_DATA_DIR, exist_ok=True)
-        with open(OUTPUT_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(output_array, f, ensure_ascii=False, indent=2)
-        print(f"全 {len(output_array)} レース分のデータ出力を完了しました: {OUTPUT_JSON_PATH}")
-    else:
-        print("出力可能なデータがありませんでした。")
+    report_path = args.run_report or os.path.join(FRONTEND_DATA_DIR, instrumentation.REPORT_FILENAME)
+    instrumentation.start_profiling(cpu=args.profile, memory=args.trace_memory)
+    started = time.perf_counter()
+    try:
+        if args.daemon:
+            run_daemon(args)
+        elif args.full_card:
+            run_full_card(args)
+        else:
+            run_pipeline(args)
+    finally:
+        # 失敗した実行でも原因調査のためにレポートを残す
+        profile_path = f"{os.path.splitext(report_path)[0]}.pstats" if args.profile else None
+        extra = {"args": vars(args), "profile": instrumentation.stop_profiling(profile_path)}
+        report = instrumentation.build_report(fetcher.get_fetch_stats(), time.perf_counter() - started, extra)
+        instrumentation.write_report(report_path, report)
+        print(fetcher.summarize_fetch_stats())
+        print(f"実行レポートを保存しました: {report_path}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,169 @@
+import numpy as np
+
+import bet_probabilities
+
+# ==========================================
+# 資金配分 (フラクショナル・ケリー)
+# - 買い目の組 (1レース・1戦略) について、着順モデルの 1-2-3着 の同時確率のもとで
+#   資金の期待対数成長率 E[log(1 - Σf + Σ f_b × オッズ_b × 的中_b)] を最大にする賭け率 f を求める
+# - 的中は (買い目, 着順) の疎な組で持ち、勾配は np.bincount で計算するため、買い目が数千点でも
+#   非ゼロ要素数に比例する計算量で解ける (射影勾配法 + バックトラッキング)
+# - トリガミ回避: 賭ける買い目はどれが的中しても払戻が総購入額以上 (f_b × オッズ_b ≥ Σf) であること。
+#   満たさない買い目を不足の大きい順に外して解き直し、100円単位に丸めた後も同じ条件を確認する
+# - 得られた f にケリー係数を掛け、資金 (bankroll) × f をレースごとの予算の範囲に収める
+# ==========================================
+
+STAKE_UNIT = 100
+MAX_ITERATIONS = 500
+TOLERANCE = 1e-10
+MAX_TOTAL_FRACTION = 0.999  # 全額を賭けない (log(0) を避ける)
+SCREEN_ITERATIONS = 20
+
+
+def _project_capped_simplex(f, cap):
+    """ {f ≥ 0, Σf ≤ cap} への射影 """
+    f = np.maximum(f, 0.0)
+    if f.sum() <= cap:
+        return f
+    u = np.sort(f)[::-1]
+    css = np.cumsum(u) - cap
+    positive = np.nonzero(u - css / np.arange(1, len(u) + 1) > 0)[0]
+    if not len(positive):
+        # 勾配が有限でない (NaN) など射影できない場合は賭けない
+        return np.zeros_like(f)
+    rho = positive[-1]
+    return np.maximum(f - css[rho] / (rho + 1), 0.0)
+
+
+class KellyProblem:
+    """ 買い目と着順の的中関係 (疎) と着順の確率から成る、期待対数成長率の最大化問題 """
+
+    def __init__(self, odds, bet_ids, outcome_ids, outcome_probs):
+        self.odds = np.asarray(odds, dtype=float)
+        self.outcome_probs = np.asarray(outcome_probs, dtype=float)
+        # 的中し得る着順だけを詰めて番号を振り直し、どれも的中しない着順は1つにまとめる
+        mask = self.outcome_probs[outcome_ids] > 0
+        self.bet_idx, self.outcome_ids = bet_ids[mask], outcome_ids[mask]
+        unique, self.outcome_idx = np.unique(self.outcome_ids, return_inverse=True)
+        self.probs = self.outcome_probs[unique]
+        self.miss_prob = max(0.0, 1.0 - self.probs.sum())
+        self.payout = self.odds[self.bet_idx]
+
+    def restrict(self, keep):
+        """ keep (買い目の番号の配列) の買い目だけから成る問題を返す (番号は keep の並びに振り直す) """
+        position = np.full(len(self.odds), -1, dtype=np.intp)
+        position[keep] = np.arange(len(keep))
+        mask = position[self.bet_idx] >= 0
+        return KellyProblem(self.odds[keep], position[self.bet_idx[mask]], self.outcome_ids[mask], self.outcome_probs)
+
+    def _wealth(self, f):
+        returns = np.bincount(self.outcome_idx, weights=f[self.bet_idx] * self.payout, minlength=len(self.probs))
+        return 1.0 - f.sum() + returns, 1.0 - f.sum()
+
+    def growth(self, f):
+        wealth, miss = self._wealth(f)
+        if (wealth <= 0).any() or miss <= 0:
+            return -np.inf
+        value = float(self.probs @ np.log(wealth))
+        return value + (self.miss_prob * np.log(miss) if self.miss_prob > 0 else 0.0)
+
+    def gradient(self, f):
+        wealth, miss = self._wealth(f)
+        ratio = self.probs / wealth
+        base = ratio.sum() + (self.miss_prob / miss if self.miss_prob > 0 else 0.0)
+        hit = np.bincount(self.bet_idx, weights=ratio[self.outcome_idx] * self.payout, minlength=len(f))
+        return hit - base
+
+    def solve(self, f0=None, max_iterations=MAX_ITERATIONS):
+        """ 最適な賭け率を射影勾配法で求める (f0 があればそこから始める) """
+        f = np.zeros(len(self.odds)) if f0 is None else f0
+        value = self.growth(f)
+        step = 1.0
+        for _ in range(max_iterations):
+            g = self.gradient(f)
+            while True:
+                candidate = _project_capped_simplex(f + step * g, MAX_TOTAL_FRACTION)
+                new_value = self.growth(candidate)
+                # Armijo 条件を満たすまで刻み幅を縮める
+                if new_value >= value + 1e-4 * g @ (candidate - f) or step < 1e-12:
+                    break
+                step *= 0.5
+            if new_value < value or abs(new_value - value) < TOLERANCE:
+                break
+            f, value = candidate, new_value
+            step *= 2.0
+        return f
+
+
+def kelly_fractions(problem, min_fraction=1e-6):
+    """ トリガミ回避条件のもとで期待対数成長率を最大にする賭け率 (資金に対する割合) を返す """
+    result = np.zeros(len(problem.odds))
+    active = np.arange(len(problem.odds))
+    sub, f = problem, None
+    converged = False
+    while len(active):
+        # 外す買い目を決める間は少ない反復で近似解を求め、条件を満たしたら収束するまで解いて確かめる
+        f = sub.solve(f, MAX_ITERATIONS if converged else SCREEN_ITERATIONS)
+        staked = f > min_fraction
+        total = f.sum()
+        if (f[staked] * sub.odds[staked] >= total - 1e-12).all():
+            if converged:
+                result[active[staked]] = f[staked]
+                break
+            converged = True
+            continue
+        converged = False
+        # 賭けなかった買い目と、払戻が総購入額に最も届かない買い目を外して解き直す
+        keep = staked.copy()
+        keep[np.argmin(np.where(staked, f * sub.odds / total, np.inf))] = False
+        active, f = active[keep], f[keep]
+        sub = problem.restrict(active)
+    return result
+
+
+def round_stakes(fractions, odds, bankroll, race_budget, kelly_fraction):
+    """ 賭け率を円単位の購入額 (STAKE_UNIT 単位) にし、丸めた後もトリガミにならない買い目だけを残す """
+    stakes = fractions * kelly_fraction * bankroll
+    total = stakes.sum()
+    if race_budget and total > race_budget:
+        stakes *= race_budget / total
+    stakes = np.floor(stakes / STAKE_UNIT) * STAKE_UNIT
+    while stakes.sum() > 0:
+        short = (stakes > 0) & (stakes * odds < stakes.sum())
+        if not short.any():
+            break
+        stakes[np.argmin(np.where(short, stakes, np.inf))] = 0.0
+    return stakes.astype(int)
+
+
+def allocate_stakes(bets, win_probs, numbers, params):
+    """
+    generate_portfolios の買い目リスト (1戦略分) に購入額 "stake" (円) を付ける。
+    win_probs・numbers は出走馬の推定勝率と馬番 (同じ並び)。
+    オッズが有限の正の値でない買い目 (取消馬・オッズ未取得の馬を含む組み合わせなど) は購入額 0 とし、最適化に含めない。
+    """
+    for bet in bets:
+        bet["stake"] = 0
+    valid = [bet for bet in bets if np.isfinite(bet["odds"]) and bet["odds"] > 0]
+    if not valid:
+        return bets
+    n = len(numbers)
+    position = {number: i for i, number in enumerate(numbers)}
+    _, _, P3 = bet_probabilities.finish_order_probabilities(win_probs, params.henery_gamma2, params.henery_gamma3)
+
+    bet_ids, outcome_ids = [], []
+    by_type = {}
+    for b, bet in enumerate(valid):
+        by_type.setdefault(bet["type"], []).append(b)
+    for bet_type, members in by_type.items():
+        combos = np.array([[position[x] for x in valid[b]["numbers"]] for b in members], dtype=np.intp)
+        local, outcomes = bet_probabilities.hit_outcomes(bet_type, combos, n)
+        bet_ids.append(np.asarray(members, dtype=np.intp)[local])
+        outcome_ids.append(outcomes)
+
+    odds = np.array([bet["odds"] for bet in valid], dtype=float)
+    problem = KellyProblem(odds, np.concatenate(bet_ids), np.concatenate(outcome_ids), P3.ravel())
+    stakes = round_stakes(kelly_fractions(problem), odds, params.bankroll, params.race_budget, params.kelly_fraction)
+    for bet, stake in zip(valid, stakes):
+        bet["stake"] = int(stake)
+    return bets
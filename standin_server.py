@@ -0,0 +1,214 @@
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fetcher
+import fixtures
+
+# ==========================================
+# netkeiba / 競馬ラボのスタンドインサーバー (負荷試験用)
+# - 記録済みのHTMLフィクスチャ (scraper.py --record-fixtures) を本番と同じパスで返す
+#     http://HOST:PORT/netkeiba/...  → https://race.netkeiba.com/...
+#     http://HOST:PORT/keibalab/...  → https://www.keibalab.jp/...
+#   scraper.py --netkeiba-base-url http://HOST:PORT/netkeiba --keibalab-base-url http://HOST:PORT/keibalab で接続する
+# - 応答の遅延 (対数正規分布)、エラー (503) の発生率、リクエスト数/秒の上限 (超過分は 429) を指定できる
+# - scale を指定するとレース一覧の各レースを scale 倍に複製し、レース数を増やした負荷をかけられる。
+#   複製のレースIDは年の桁に 100×複製番号 を足したもの (202606020111 の2番目の複製は 222606020111) で、
+#   元のレースのフィクスチャを返す
+# ==========================================
+
+PREFIXES = {
+    "/netkeiba": fetcher.NETKEIBA_BASE_URL,
+    "/keibalab": fetcher.KEIBALAB_BASE_URL,
+}
+DEFAULT_PORT = 8765
+COPY_YEAR_STRIDE = 100
+RACE_ID = re.compile(rb'race_id=(\d{12})')
+LIST_ITEM = re.compile(rb'<li\b[^>]*>(?:(?!</li>).)*?race_id=\d{12}.*?</li>', re.DOTALL)
+
+
+def copy_race_id(race_id, copy):
+    """ 複製番号 copy (0 は元のレース) のレースID """
+    return f"{int(race_id[:4]) + COPY_YEAR_STRIDE * copy:04d}{race_id[4:]}"
+
+
+def source_race_id(race_id):
+    """ 複製のレースID → 元のレースID """
+    year = int(race_id[:4])
+    copy = max(0, year // COPY_YEAR_STRIDE - 20)
+    return f"{year - COPY_YEAR_STRIDE * copy:04d}{race_id[4:]}"
+
+
+def expand_race_list(content, scale):
+    """ レース一覧の各レースの項目 (<li>) の後ろに、レースIDを書き換えた複製を scale-1 件ずつ追加する """
+    if scale <= 1:
+        return content
+
+    def expand(m):
+        item = m.group(0)
+        copies = [RACE_ID.sub(lambda r: b'race_id=' + copy_race_id(r.group(1).decode(), copy).encode(), item)
+                  for copy in range(1, scale)]
+        return item + b''.join(copies)
+    return LIST_ITEM.sub(expand, content)
+
+
+class TokenBucket:
+    """ 1秒あたり rate 件まで (バースト rate 件) を許可する。rate が None なら無制限 """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate or 0.0
+        self._updated = time.monotonic()
+
+    def take(self):
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    フィクスチャを返す HTTP サーバー。start() で別スレッドで起動し、stop() で停止する。
+    latency_ms は遅延の中央値、latency_sigma は対数正規分布の σ (0 なら一定)。
+    """
+    daemon_threads = True
+
+    def __init__(self, fixture_dir, host="127.0.0.1", port=DEFAULT_PORT, latency_ms=0.0, latency_sigma=0.0,
+                 error_rate=0.0, max_rps=None, scale=1, seed=None):
+        super().__init__((host, port), StandinHandler)
+        self.fixture_dir = fixture_dir
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle = TokenBucket(max_rps)
+        self.scale = scale
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}  # (ページ種別, ステータス) → 件数
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def sample_delay(self):
+        """ 応答を返すまでの遅延 (秒) とエラーにするかどうか """
+        with self._lock:
+            delay = self.latency_ms * self.random.lognormvariate(0.0, self.latency_sigma) if self.latency_sigma \
+                else self.latency_ms
+            failed = self.random.random() < self.error_rate
+        return delay / 1000, failed
+
+    def record(self, page, status):
+        with self._lock:
+            key = (page or "other", status)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def respond(self, path):
+        """ リクエストパス → (ページ種別, ステータス, 本文, Content-Type) """
+        prefix = next((p for p in PREFIXES if path == p or path.startswith(p + "/")), None)
+        if prefix is None:
+            return None, 404, b'not found', 'text/plain'
+        url = PREFIXES[prefix] + path[len(prefix):]
+        key = fixtures.fixture_key(url)
+        page = key[0] if key else None
+        # 複製のレースは元のレースのフィクスチャを返す
+        content = fixtures.load_fixture(self.fixture_dir, RACE_ID.sub(
+            lambda m: b'race_id=' + source_race_id(m.group(1).decode()).encode(), url.encode()).decode())
+        if content is None:
+            return page, 404, b'not found', 'text/plain'
+        if page == 'race_list_sub':
+            content = expand_race_list(content, self.scale)
+        return page, 200, content, 'application/json' if page == 'odds' else 'text/html'
+
+    def summary(self):
+        """ ページ種別ごとのステータス別件数 """
+        with self._lock:
+            result = {}
+            for (page, status), count in sorted(self.counts.items()):
+                result.setdefault(page, {})[str(status)] = count
+            return result
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive (fetcher の接続プールを本番と同じように使う)
+
+    def do_GET(self):
+        server = self.server
+        if not server.throttle.take():
+            server.record(None, 429)
+            self._send(429, b'too many requests', 'text/plain', {"Retry-After": "1"})
+            return
+        delay, failed = server.sample_delay()
+        if delay > 0:
+            time.sleep(delay)
+        page, status, body, content_type = server.respond(self.path)
+        if failed:
+            status, body, content_type = 503, b'service unavailable', 'text/plain'
+        server.record(page, status)
+        self._send(status, body, content_type)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="記録済みフィクスチャを返す netkeiba / 競馬ラボのスタンドインサーバー")
+    parser.add_argument("--fixtures", default=fixtures.DEFAULT_FIXTURE_DIR, help="HTMLフィクスチャのディレクトリ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="応答遅延の中央値 (ミリ秒)")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="応答遅延の対数正規分布の σ (裾の重さ)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 を返す割合 (0〜1)")
+    parser.add_argument("--max-rps", type=float, help="1秒あたりのリクエスト数の上限 (超過分は 429)")
+    parser.add_argument("--scale", type=int, default=1, help="レース一覧の各レースを何倍に複製するか")
+    parser.add_argument("--seed", type=int, help="遅延・エラーの乱数シード")
+    args = parser.parse_args(argv)
+
+    server = StandinServer(args.fixtures, args.host, args.port, args.latency_ms, args.latency_sigma,
+                           args.error_rate, args.max_rps, args.scale, args.seed)
+    print(f"スタンドインサーバーを起動しました: {server.base_url}/netkeiba , {server.base_url}/keibalab")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for page, statuses in server.summary().items():
+            print(f"{page:<16}" + "  ".join(f"{status}: {count}" for status, count in statuses.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import pickle
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+import ev_engine
+import fixtures
+import race_model
+import scraper
+from model_params import DEFAULT_PARAMS, PARAM_NAMES
+
+# ==========================================
+# 期待値モデル・買い目生成のパラメータ探索
+# 過去レースのアーカイブ (backtest.py と同じ形式) から1レースごとの特徴量 (ev_engine.build_race_columns の列配列)
+# と払戻を一度だけ作ってキャッシュし、各試行ではスコア計算・買い目生成・精算だけを再実行する。
+# 試行はプロセスプールで並列に評価し、ログ損失 (勝ち馬の推定勝率) と回収率で順位付けした表を出力する。
+# ==========================================
+
+DEFAULT_FEATURE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'sweep')
+LOG_LOSS_EPS = 1e-6
+
+
+def prepare_race(archive_dir, race_id):
+    """ 1レース分のパラメータに依存しない前処理結果 (列配列・馬番・オッズ・勝ち馬・払戻) を返す """
+    race_info, raw_horses = backtest.load_archived_race(archive_dir, race_id)
+    if not race_info:
+        return None
+    numbers = [h.number for h in raw_horses]
+    top3 = race_info["results"]["top3"]
+    winner = top3[0]["number"] if top3 and top3[0]["rank"] == 1 else None
+    return {
+        "race_id": race_id,
+        "columns": ev_engine.build_race_columns(raw_horses, race_info),
+        "numbers": numbers,
+        "odds": [h.odds for h in raw_horses],
+        "winner_index": numbers.index(winner) if winner in numbers else None,
+        "payouts": backtest.parse_payouts(race_info["results"]["payouts"]),
+    }
+
+
+def _prepare_chunk(args):
+    archive_dir, race_ids = args
+    return [prepare_race(archive_dir, race_id) for race_id in race_ids]
+
+
+def _archive_fingerprint(archive_dir, race_ids):
+    """ アーカイブの内容や列の構成が変わったらキャッシュを作り直すためのキー (ファイル名・サイズ・更新時刻・列の版) """
+    digest = hashlib.sha256(f"{os.path.abspath(archive_dir)}:{ev_engine.COLUMNS_VERSION}".encode())
+    for page in ('shutuba', 'shutuba_past', 'result'):
+        for race_id in race_ids:
+            path = fixtures.fixture_path(archive_dir, page, race_id)
+            if os.path.exists(path):
+                st = os.stat(path)
+                digest.update(f"{page}_{race_id}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def load_features(archive_dir, workers=None, cache_dir=DEFAULT_FEATURE_CACHE_DIR, chunk_size=32):
+    """ アーカイブ全レースの前処理結果を返す。cache_dir があればアーカイブ単位でキャッシュする """
+    race_ids = sorted(fixtures.list_fixtures(archive_dir)['result'])
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"features_{_archive_fingerprint(archive_dir, race_ids)}.pkl")
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+
+    chunks = [(archive_dir, race_ids[i:i + chunk_size]) for i in range(0, len(race_ids), chunk_size)]
+    if workers == 1:
+        prepared = [r for chunk in chunks for r in _prepare_chunk(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            prepared = [r for chunk_result in executor.map(_prepare_chunk, chunks) for r in chunk_result]
+    races = [r for r in prepared if r]
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(races, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return races
+
+
+def evaluate(races, params):
+    """ 1つのパラメータセットを全レースで評価し、ログ損失・的中率・回収率を返す """
+    scored = ev_engine.score_races([r["columns"] for r in races], params)
+
+    log_losses = []
+    totals = {"all": [0, 0, 0, 0]}  # [買い目数, 的中数, 購入額, 払戻額]
+    for race, s in zip(races, scored):
+        win_prob = s["win_probability"]
+        if race["winner_index"] is not None:
+            log_losses.append(-math.log(max(float(win_prob[race["winner_index"]]), LOG_LOSS_EPS)))
+
+        # generate_portfolios が参照する項目だけを calculate_expected_values と同じ丸めで渡す
+        horses = []
+        for n, o, p in zip(race["numbers"], race["odds"], win_prob):
+            h = race_model.Horse(n, odds=o)
+            h.win_probability = round(float(p), 3)
+            horses.append(h)
+        portfolios = scraper.generate_portfolios(horses, params, allocate=False)
+        for bet in backtest.settle_portfolios(portfolios, race["payouts"]):
+            for key in ("all", bet["strategy"]):
+                t = totals.setdefault(key, [0, 0, 0, 0])
+                t[0] += 1
+                t[1] += 1 if bet["return"] > 0 else 0
+                t[2] += bet["stake"]
+                t[3] += bet["return"]
+
+    result = {
+        "log_loss": round(sum(log_losses) / len(log_losses), 5) if log_losses else None,
+        "bets": totals["all"][0],
+        "hit_rate": round(totals["all"][1] / totals["all"][0], 4) if totals["all"][0] else 0.0,
+        "roi": round(totals["all"][3] / totals["all"][2], 4) if totals["all"][2] else 0.0,
+    }
+    for strategy in ("strategy_a", "strategy_b"):
+        t = totals.get(strategy)
+        result[f"roi_{strategy[-1]}"] = round(t[3] / t[2], 4) if t and t[2] else 0.0
+    return result
+
+
+# ワーカープロセスごとに1回だけ受け取る前処理済みレース
+_worker_races = None
+
+
+def _init_worker(races):
+    global _worker_races
+    _worker_races = races
+
+
+def _evaluate_trial(overrides):
+    return overrides, evaluate(_worker_races, DEFAULT_PARAMS.replace(**overrides))
+
+
+def run_sweep(races, trials, workers=None):
+    """ 各試行 (既定値からの差分 dict) を並列に評価し、[(差分, 評価結果)] を返す """
+    if workers == 1:
+        _init_worker(races)
+        return [_evaluate_trial(t) for t in trials]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(races,)) as executor:
+        return list(executor.map(_evaluate_trial, trials, chunksize=max(1, len(trials) // 64)))
+
+
+def _parse_value(value):
+    return float(value)
+
+
+def _check_name(name):
+    if name not in PARAM_NAMES:
+        raise argparse.ArgumentTypeError(f"不明なパラメータです: {name} (指定可能: {', '.join(PARAM_NAMES)})")
+    return name
+
+
+def parse_grid(specs):
+    """ ["w1=0.1,0.2", "tau=1,1.5,2"] → 全組み合わせの差分 dict のリスト """
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        axes.append((_check_name(name.strip()), [_parse_value(v) for v in values.split(',') if v.strip()]))
+    if not axes:
+        return [{}]
+    names = [name for name, _ in axes]
+    return [dict(zip(names, combo)) for combo in itertools.product(*(values for _, values in axes))]
+
+
+def parse_random(specs, n_trials, seed=None):
+    """ ["w1=0.05:0.4", ...] の範囲から一様乱数で n_trials 個の差分 dict を作る """
+    ranges = []
+    for spec in specs:
+        name, _, bounds = spec.partition('=')
+        low, _, high = bounds.partition(':')
+        ranges.append((_check_name(name.strip()), _parse_value(low), _parse_value(high)))
+    rng = random.Random(seed)
+    return [{name: round(rng.uniform(low, high), 4) for name, low, high in ranges} for _ in range(n_trials)]
+
+
+def rank_results(results, sort_key="log_loss"):
+    """ ログ損失は小さい順、回収率は大きい順に並べ、両方の順位を付ける """
+    by_loss = sorted(results, key=lambda r: (r[1]["log_loss"] is None, r[1]["log_loss"] or 0.0))
+    by_roi = sorted(results, key=lambda r: -r[1]["roi"])
+    loss_rank = {id(r): i + 1 for i, r in enumerate(by_loss)}
+    roi_rank = {id(r): i + 1 for i, r in enumerate(by_roi)}
+    ordered = by_loss if sort_key == "log_loss" else by_roi
+    return [{"params": r[0], "log_loss_rank": loss_rank[id(r)], "roi_rank": roi_rank[id(r)], **r[1]}
+            for r in ordered]
+
+
+def print_ranking(ranked, n_races, top):
+    print(f"評価レース数: {n_races} / 試行数: {len(ranked)}")
+    print(f"{'#loss':>6}{'#roi':>6}{'logloss':>10}{'hit%':>8}{'ROI%':>8}{'A ROI%':>8}{'B ROI%':>8}  params")
+    for r in ranked[:top]:
+        params = ", ".join(f"{k}={v:g}" for k, v in r["params"].items()) or "(既定値)"
+        log_loss = f"{r['log_loss']:.4f}" if r["log_loss"] is not None else "-"
+        print(f"{r['log_loss_rank']:>6}{r['roi_rank']:>6}{log_loss:>10}{r['hit_rate'] * 100:>7.1f}%"
+              f"{r['roi'] * 100:>7.1f}%{r['roi_a'] * 100:>7.1f}%{r['roi_b'] * 100:>7.1f}%  {params}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="過去レースのアーカイブで期待値モデル・買い目生成のパラメータを探索する")
+    parser.add_argument("--archive", default=fixtures.DEFAULT_FIXTURE_DIR,
+                        help="出馬表・過去走・結果ページのアーカイブ ({ページ種別}_{レースID}.html)")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="グリッド探索する値 (複数指定で全組み合わせ)")
+    parser.add_argument("--random", type=int, default=0, metavar="N", help="ランダム探索の試行数 (--range と併用)")
+    parser.add_argument("--range", action="append", default=[], metavar="NAME=LOW:HIGH",
+                        help="ランダム探索の範囲")
+    parser.add_argument("--seed", type=int, default=None, help="ランダム探索の乱数シード")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数 (既定: CPUコア数)")
+    parser.add_argument("--sort", choices=("log_loss", "roi"), default="log_loss", help="表示順")
+    parser.add_argument("--top", type=int, default=20, help="表示する上位件数")
+    parser.add_argument("--feature-cache-dir", default=DEFAULT_FEATURE_CACHE_DIR,
+                        help="レースごとの前処理結果のキャッシュ先")
+    parser.add_argument("--no-feature-cache", action="store_true", help="前処理結果をキャッシュしない")
+    parser.add_argument("--json", metavar="PATH", help="全試行の結果をJSONで保存する")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.random:
+            trials = parse_random(args.range, args.random, args.seed)
+        else:
+            trials = parse_grid(args.grid)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    # 比較基準として既定値を必ず含める
+    if {} not in trials:
+        trials.insert(0, {})
+
+    races = load_features(args.archive, args.workers, None if args.no_feature_cache else args.feature_cache_dir)
+    if not races:
+        print(f"評価可能な確定済みレースがありません: {args.archive}")
+        return
+
+    ranked = rank_results(run_sweep(races, trials, args.workers), args.sort)
+    print_ranking(ranked, len(races), args.top)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"races": len(races), "defaults": DEFAULT_PARAMS.to_dict(), "trials": ranked},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from race_model import Horse, Runners  # noqa: E402
+
+# ==========================================
+# テスト共通のフィクスチャ
+# - 中山 芝1600m (枠順バイアスあり) の8頭立てで、過去走・上がり3F・騎手成績・馬体重の欠損を含むレース
+# ==========================================
+
+RACE_INFO = {"id": "202606010111&rf=race_list", "name": "テストステークス", "distance": "芝1600m"}
+
+# (馬番, 枠, 単勝オッズ, 馬体重, 増減, 上がり3F, 過去走 [(距離, タイム)], 直近の着順, A_i, 騎手の複勝率, 持ち時計, オッズ推移)
+RUNNERS = (
+    (1, 1, 3.2, 480, 4, 34.1, [(1600, 94.2), (1800, 107.5)], [1, 3, 2], 0.8, 0.45, None, -0.2),
+    (2, 2, 5.8, 0, None, 34.8, [(1600, 95.0)], [4, 2], 0.5, 0.30, None, None),
+    (3, 3, 8.5, 512, -12, None, [(2000, 121.0)], [6], 0.3, None, None, 0.1),
+    (4, 4, 12.0, 466, 0, 35.3, [], None, None, 0.22, 95.8, None),
+    (5, 5, 18.4, 502, 16, 35.0, [(1400, 83.1), (0, 60.0)], [9, 11, 7], 0.0, 0.10, None, 0.0),
+    (6, 6, 26.0, 490, 2, None, None, None, None, None, None, None),
+    (7, 7, 44.7, 458, -4, 36.2, [(1600, 96.4)], [12, 8], 0.5, 0.05, None, 0.3),
+    (8, 8, 95.3, 530, 8, 35.9, [(1200, 71.0)], [15], 0.3, 0.18, None, None),
+)
+
+
+def make_race():
+    """ RUNNERS の出走馬 (race_model.Runners) を毎回新しく作る """
+    horses = Runners()
+    for (number, frame, odds, weight, weight_change, last_3f, past, placements, a_i, jockey_rate, best_time,
+         drift) in RUNNERS:
+        h = Horse(number, f"テスト{number}", frame=frame, odds=odds, popularity=number, weight=weight,
+                  weight_change=weight_change)
+        h.last_3f = last_3f
+        if past is not None:
+            h.past_times = [{"surface": "芝", "distance": d, "time_sec": t} for d, t in past]
+        h.recent_placements = placements
+        h.a_i = a_i
+        h.jockey_place_rate = jockey_rate
+        h.horse_best_time = best_time
+        h.odds_drift = drift
+        horses.append(h)
+    return horses
+
+
+@pytest.fixture
+def race():
+    return RACE_INFO, make_race()
@@ -0,0 +1,33 @@
+import numpy as np
+
+import bet_probabilities
+
+WIN_ODDS = [0.0, 3.2, 5.8, 8.5, 12.0, 18.4, 26.0, 44.7]
+
+
+def test_combination_probabilities_sum_to_one():
+    probs = bet_probabilities.market_win_probabilities(WIN_ODDS[1:] + [95.3])
+    tables = bet_probabilities.combination_probabilities(probs)
+    for bet_type in ("単勝", "馬連", "馬単", "3連複", "3連単"):
+        assert abs(tables[bet_type][1].sum() - 1.0) < 1e-9
+    # 8頭立ての複勝は3着まで・ワイドは3着以内の2頭の組が3通りずつ
+    assert abs(tables["複勝"][1].sum() - 3.0) < 1e-9
+    assert abs(tables["ワイド"][1].sum() - 3.0) < 1e-9
+
+
+def test_estimated_odds_without_runner_odds_are_undefined_not_infinite():
+    odds = bet_probabilities.estimated_odds(WIN_ODDS)
+    tables = bet_probabilities.combination_probabilities(bet_probabilities.market_win_probabilities(WIN_ODDS))
+    for bet_type, (combos, _) in tables.items():
+        values = odds[bet_type]
+        assert not np.isinf(values).any(), bet_type
+        # オッズ 0 の馬 (インデックス 0) を含む組み合わせだけが推定できない
+        scratched = (combos == 0).any(axis=1)
+        assert np.isnan(values[scratched]).all(), bet_type
+        assert np.isfinite(values[~scratched]).all(), bet_type
+        assert (values[~scratched] >= bet_probabilities.MIN_ODDS).all(), bet_type
+
+
+def test_estimated_odds_keeps_actual_win_odds():
+    odds = bet_probabilities.estimated_odds(WIN_ODDS)
+    np.testing.assert_array_equal(odds["単勝"][1:], WIN_ODDS[1:])
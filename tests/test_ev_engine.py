@@ -0,0 +1,89 @@
+import math
+import re
+import statistics
+
+import numpy as np
+import pytest
+
+import course_index
+import ev_engine
+from model_params import DEFAULT_PARAMS
+
+from conftest import RACE_INFO, make_race
+
+
+def reference_scores(horses, race_info, p):
+    """ 1頭ずつ S_i・推定勝率・期待値を計算する (ev_engine のベクトル化前の手順) """
+    profile = course_index.lookup(race_info)
+    distance = int(re.search(r'\d+', race_info["distance"]).group())
+    s_straight, h_slope, r_corner = profile["course"]
+
+    def zscores(values, default_mean, clip=None, missing=None):
+        known = [v for v in values if v is not None]
+        mean = statistics.fmean(known) if known else default_mean
+        std = (statistics.pstdev(known) if len(known) > 1 else 0.0) or 1.0
+        result = []
+        for v in values:
+            if v is None:
+                result.append(missing)
+                continue
+            z = (mean - v) / std
+            result.append(max(-clip, min(clip, z)) if clip is not None else z)
+        return result
+
+    best_times = []
+    for h in horses:
+        estimates = [pt["time_sec"] * distance / pt["distance"] for pt in h.past_times or () if pt["distance"] > 0]
+        best_times.append(min(estimates) if estimates else h.horse_best_time)
+    t_z = zscores(best_times, distance * 0.06, 3.0, p.missing_time_z)
+    f_z = zscores([h.last_3f for h in horses], 35.0, 3.0, p.missing_last_3f_z)
+
+    scores = []
+    for h, t, f in zip(horses, t_z, f_z):
+        bias = float(course_index.draw_bias(profile, [h.frame])[0])
+        if bias < 0:
+            bias *= 1.0 - (h.a_i or 0.0)
+        c = profile["alpha"] * s_straight + profile["beta"] * h_slope + profile["gamma"] * r_corner + bias
+        if h.weight > 500:
+            c += 0.2 * h_slope
+        placement = statistics.fmean(h.recent_placements) if h.recent_placements else ev_engine.MISSING_PLACEMENT
+        if h.jockey_place_rate is None:
+            j = ev_engine.MISSING_JOCKEY_SCORE
+        else:
+            j = max(0.0, min(1.0, h.jockey_place_rate / ev_engine.TOP_JOCKEY_PLACE_RATE))
+        w = 0.5 if h.weight_change is not None and (h.weight_change <= -10 or h.weight_change >= 15) else 1.0
+        w4 = p.w4 * 0.2 if c >= p.theta else p.w4
+        s = p.w1 * t + p.w2 * f + p.w3 * c + w4 * (1.0 / placement) * 10 + p.w5 * j + p.w6 * w
+        scores.append(s - p.w_drift * (h.odds_drift or 0.0))
+
+    s_z = [-z for z in zscores(scores, 0.0)]
+    top = max(s_z)
+    exp_scores = [math.exp((z - top) / p.tau) for z in s_z]
+    total = sum(exp_scores)
+    win_probs = [max(e / total, ev_engine.MIN_WIN_PROB) for e in exp_scores]
+    expected = [prob * min(h.odds, p.odds_cap) for prob, h in zip(win_probs, horses)]
+    return scores, win_probs, expected
+
+
+@pytest.mark.parametrize("params", [DEFAULT_PARAMS, DEFAULT_PARAMS.replace(w_drift=0.5, tau=0.8)])
+def test_score_race_matches_per_horse_reference(race, params):
+    race_info, horses = race
+    scored = ev_engine.score_race(horses, race_info, params)
+    scores, win_probs, expected = reference_scores(horses, race_info, params)
+
+    np.testing.assert_allclose(scored["score_si"], scores, rtol=1e-9)
+    np.testing.assert_allclose(scored["win_probability"], win_probs, rtol=1e-9)
+    np.testing.assert_allclose(scored["expected_return"], expected, rtol=1e-9)
+
+
+def test_score_races_batches_match_single_races():
+    horses = make_race()
+    small = make_race()
+    small.horses = small.horses[:5]
+    columns = [ev_engine.build_race_columns(horses, RACE_INFO), ev_engine.build_race_columns(small, RACE_INFO)]
+
+    batched = ev_engine.score_races(columns)
+    for race_columns, result in zip(columns, batched):
+        single = ev_engine.score_races([race_columns])[0]
+        for key in ("score_si", "win_probability", "expected_return"):
+            np.testing.assert_allclose(result[key], single[key], rtol=1e-12)
@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+
+import ev_engine
+import scraper
+import stake_optimizer
+from model_params import DEFAULT_PARAMS
+
+from conftest import RACE_INFO, make_race
+
+
+def scored_race():
+    horses = make_race()
+    scored = ev_engine.score_race(horses, RACE_INFO)
+    for h, prob in zip(horses, scored["win_probability"]):
+        h.win_probability = round(float(prob), 3)
+    return horses
+
+
+def assert_within_budget(bets, params):
+    stakes = np.array([bet["stake"] for bet in bets])
+    total = stakes.sum()
+    assert total <= params.race_budget
+    assert (stakes % stake_optimizer.STAKE_UNIT == 0).all()
+    # どの買い目が的中しても払戻が総購入額以上 (トリガミにならない)
+    for bet in bets:
+        if bet["stake"]:
+            assert bet["stake"] * bet["odds"] >= total
+
+
+def test_portfolios_stay_within_budget():
+    portfolios = scraper.generate_portfolios(scored_race())
+    assert portfolios["strategy_a"] and portfolios["strategy_b"]
+    for bets in portfolios.values():
+        assert_within_budget(bets, DEFAULT_PARAMS)
+    assert any(bet["stake"] for bet in portfolios["strategy_b"])
+
+
+def test_zero_odds_runner_gives_finite_serializable_portfolios():
+    horses = scored_race()
+    horses[0].odds = 0.0  # 取消、またはオッズが取得できなかった馬
+    portfolios = scraper.generate_portfolios(horses)
+
+    json.dumps(portfolios, allow_nan=False)
+    for bets in portfolios.values():
+        assert all(np.isfinite(bet["odds"]) and np.isfinite(bet["expected_return"]) for bet in bets)
+        assert all(1 not in bet["numbers"] or bet["type"] == "単勝" for bet in bets)
+        assert_within_budget(bets, DEFAULT_PARAMS)
+
+
+def test_allocate_stakes_skips_unusable_odds():
+    horses = scored_race()
+    win_probs = [h.win_probability for h in horses]
+    numbers = [h.number for h in horses]
+    bets = [
+        {"type": "単勝", "numbers": [1], "odds": float("inf")},
+        {"type": "単勝", "numbers": [2], "odds": float("nan")},
+        {"type": "単勝", "numbers": [3], "odds": 0.0},
+        {"type": "馬連", "numbers": [1, 2], "odds": 9.6},
+    ]
+    stake_optimizer.allocate_stakes(bets, win_probs, numbers, DEFAULT_PARAMS)
+    assert [bet["stake"] for bet in bets[:3]] == [0, 0, 0]
+    assert_within_budget(bets, DEFAULT_PARAMS)
+
+
+def test_allocate_stakes_degenerate_inputs():
+    numbers = [1, 2, 3]
+    assert stake_optimizer.allocate_stakes([], [0.5, 0.3, 0.2], numbers, DEFAULT_PARAMS) == []
+
+    # 勝率がすべて 0 でも均等な勝率として解ける
+    bets = [{"type": "単勝", "numbers": [n], "odds": 2.0} for n in numbers]
+    stake_optimizer.allocate_stakes(bets, [0.0, 0.0, 0.0], numbers, DEFAULT_PARAMS)
+    assert_within_budget(bets, DEFAULT_PARAMS)
+
+    # 期待値が 1 を下回る買い目には賭けない
+    bets = [{"type": "単勝", "numbers": [1], "odds": 1.1}]
+    stake_optimizer.allocate_stakes(bets, [0.5, 0.3, 0.2], numbers, DEFAULT_PARAMS)
+    assert bets[0]["stake"] == 0
+
+
+def test_project_capped_simplex():
+    projected = stake_optimizer._project_capped_simplex(np.array([0.8, 0.6, -0.1]), 1.0)
+    np.testing.assert_allclose(projected, [0.6, 0.4, 0.0])
+    assert projected.sum() <= 1.0 + 1e-12
+    # NaN を含む勾配では射影できないため賭けない
+    np.testing.assert_array_equal(stake_optimizer._project_capped_simplex(np.array([np.nan, 2.0]), 1.0), [0.0, 0.0])